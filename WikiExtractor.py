@@ -16,6 +16,8 @@ from itertools import zip_longest
 from multiprocessing import Queue, Process, Value, cpu_count
 from timeit import default_timer
 
+from others import applyEdits
+
 # ===========================================================================
 
 # Program version
@@ -450,12 +452,14 @@ class Extractor(object):
         # ############### Process HTML ###############
 
         # turn into HTML, except for the content of <syntaxhighlight>
-        res = ''
+        pieces = []
         cur = 0
         for m in syntaxhighlight.finditer(text):
-            res += unescape(text[cur:m.start()]) + m.group(1)
+            pieces.append(unescape(text[cur:m.start()]))
+            pieces.append(m.group(1))
             cur = m.end()
-        text = res + unescape(text[cur:])
+        pieces.append(unescape(text[cur:]))
+        text = ''.join(pieces)
 
         # Handle bold/italic/quote
         if self.toHTML:
@@ -1628,16 +1632,7 @@ def dropSpans(spans, text):
     """
     Drop from text the blocks identified in :param spans:, possibly nested.
     """
-    spans.sort()
-    res = ''
-    offset = 0
-    for s, e in spans:
-        if offset <= s:  # handle nesting
-            if offset < s:
-                res += text[offset:s]
-            offset = e
-    res += text[offset:]
-    return res
+    return applyEdits(text, [(s, e, '') for s, e in spans])
 
 
 # ----------------------------------------------------------------------
@@ -1658,8 +1653,7 @@ def replaceInternalLinks(text):
     """
     # call this after removal of external links, so we need not worry about
     # triple closing ]]].
-    cur = 0
-    res = ''
+    edits = []
     for s, e in findBalanced(text):
         m = tailRE.match(text, e)
         if m:
@@ -1684,9 +1678,8 @@ def replaceInternalLinks(text):
                     pipe = last  # advance
                 curp = e1
             label = inner[pipe + 1:].strip()
-        res += text[cur:s] + makeInternalLink(title, label) + trail
-        cur = end
-    return res + text[cur:]
+        edits.append((s, end, makeInternalLink(title, label) + trail))
+    return applyEdits(text, edits)
 
 
 # the official version is a method in class Parser, similar to this:
@@ -1989,17 +1982,18 @@ wgUrlProtocols = [
 # as well as U+3000 is IDEOGRAPHIC SPACE for bug 19052
 EXT_LINK_URL_CLASS = r'[^][<>"\x00-\x20\x7F\s]'
 ANCHOR_CLASS = r'[^][\x00-\x08\x0a-\x1F]'
+# a global flag has to come first since Python 3.11, (?i) applied to the whole pattern anyway
 ExtLinkBracketedRegex = re.compile(
-    '\[(((?i)' + '|'.join(wgUrlProtocols) + ')' + EXT_LINK_URL_CLASS + r'+)' +
+    '\[((' + '|'.join(wgUrlProtocols) + ')' + EXT_LINK_URL_CLASS + r'+)' +
     r'\s*((?:' + ANCHOR_CLASS + r'|\[\[' + ANCHOR_CLASS + r'+\]\])' + r'*?)\]',
-    re.S | re.U)
+    re.S | re.U | re.I)
 # A simpler alternative:
 # ExtLinkBracketedRegex = re.compile(r'\[(.*?)\](?!])')
 
 EXT_IMAGE_REGEX = re.compile(
     r"""^(http://|https://)([^][<>"\x00-\x20\x7F\s]+)
-    /([A-Za-z0-9_.,~%\-+&;#*?!=()@\x80-\xFF]+)\.((?i)gif|png|jpg|jpeg)$""",
-    re.X | re.S | re.U)
+    /([A-Za-z0-9_.,~%\-+&;#*?!=()@\x80-\xFF]+)\.(gif|png|jpg|jpeg)$""",
+    re.X | re.S | re.U | re.I)
 
 
 def replaceExternalLinks(text):
@@ -2007,11 +2001,8 @@ def replaceExternalLinks(text):
     https://www.mediawiki.org/wiki/Help:Links#External_links
     [URL anchor text]
     """
-    s = ''
-    cur = 0
+    edits = []
     for m in ExtLinkBracketedRegex.finditer(text):
-        s += text[cur:m.start()]
-        cur = m.end()
 
         url = m.group(1)
         label = m.group(3)
@@ -2034,9 +2025,9 @@ def replaceExternalLinks(text):
         # This means that users can paste URLs directly into the text
         # Funny characters like ö aren't valid in URLs anyway
         # This was changed in August 2004
-        s += makeExternalLink(url, label)  # + trail
+        edits.append((m.start(), m.end(), makeExternalLink(url, label)))  # + trail
 
-    return s + text[cur:]
+    return applyEdits(text, edits)
 
 
 def makeExternalLink(url, anchor):
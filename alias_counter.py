@@ -0,0 +1,170 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import heapq
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+"""
+Memory-bounded counting of the (alias, entity) pairs of the Wikipedia links, for the prior probabilities.
+
+When the number of pairs in memory hits the budget, they are spilled to disk as a run sorted by alias.
+At the end, all runs are merged (k-way) into the aliases in sorted order, each with its entities sorted by
+descending count. Ties are kept in the order in which the entities were first seen for the alias,
+exactly as if all counts had been kept in a single dict.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PAIRS = 20000000
+# number of runs read at once, runs beyond are merged in several passes
+MAX_MERGE_RUNS = 64
+
+
+class AliasCounter(object):
+    def __init__(self, max_pairs=DEFAULT_MAX_PAIRS, tmp_dir=None):
+        """
+        :param max_pairs: number of (alias, entity) pairs kept in memory before spilling a run to disk,
+            None to keep everything in memory.
+        :param tmp_dir: directory in which the runs are written (in a temporary subdirectory).
+        """
+        self.max_pairs = max_pairs
+        self.tmp_dir = tmp_dir
+        self.alias_to_link = dict()
+        self.n_pairs = 0
+        self.run_dir = None
+        self.run_paths = []
+        self.n_runs = 0
+
+    def add(self, alias, entity, count=1):
+        alias_dict = self.alias_to_link.get(alias)
+        if alias_dict is None:
+            alias_dict = self.alias_to_link[alias] = dict()
+        if entity in alias_dict:
+            alias_dict[entity] += count
+        else:
+            alias_dict[entity] = count
+            self.n_pairs += 1
+            if self.max_pairs and self.n_pairs >= self.max_pairs:
+                self.spill()
+
+    def update(self, alias_to_link):
+        """ Add the counts of an alias -> entity -> count dict, in its order """
+        for alias, alias_dict in alias_to_link.items():
+            for entity, count in alias_dict.items():
+                self.add(alias, entity, count)
+
+    def spill(self):
+        """ Write the pairs in memory to disk as a run sorted by alias """
+        if not self.alias_to_link:
+            return
+        run_path = self._new_run_path()
+        logger.info("Spilling {} alias-entity pairs to {}".format(self.n_pairs, run_path))
+        with open(run_path, "wb") as run_file:
+            for alias in sorted(self.alias_to_link):
+                # the entities stay in the order in which they were first seen in this run
+                pickle.dump((alias, list(self.alias_to_link[alias].items())), run_file, pickle.HIGHEST_PROTOCOL)
+        self.run_paths.append(run_path)
+        self.alias_to_link = dict()
+        self.n_pairs = 0
+
+    def checkpoint(self):
+        """ Spill the pairs in memory, and return the state of the runs for restore """
+        self.spill()
+        if self.run_dir is None:
+            # so that restore also drops the runs of a directory created after the checkpoint
+            self.run_dir = tempfile.mkdtemp(prefix="alias_counter_", dir=self.tmp_dir)
+        return {"run_dir": self.run_dir, "run_paths": list(self.run_paths), "n_runs": self.n_runs}
+
+    def restore(self, state):
+        """ Continue from the runs of a checkpoint, dropping the runs spilled after it """
+        self.alias_to_link = dict()
+        self.n_pairs = 0
+        self.run_dir = state["run_dir"]
+        self.run_paths = list(state["run_paths"])
+        self.n_runs = state["n_runs"]
+        if self.run_dir is not None:
+            for name in os.listdir(self.run_dir):
+                run_path = os.path.join(self.run_dir, name)
+                if run_path not in self.run_paths:
+                    os.remove(run_path)
+
+    def add_runs(self, state):
+        """
+        Take over the runs of the checkpoint() of another counter, as if its pairs were counted after these.
+        The runs are moved to the run directory of this counter, and the directory of the other one is removed.
+        """
+        self.spill()
+        for run_path in state["run_paths"]:
+            new_run_path = self._new_run_path()
+            shutil.move(run_path, new_run_path)
+            self.run_paths.append(new_run_path)
+        if state["run_dir"] is not None:
+            shutil.rmtree(state["run_dir"], ignore_errors=True)
+
+    def items_sorted(self):
+        """ Yield (alias, [(entity, count), ...]) by sorted alias, with the entities by descending count """
+        while len(self.run_paths) > MAX_MERGE_RUNS:
+            self._merge_first_runs()
+        runs = [_read_run(run_path) for run_path in self.run_paths]
+        runs.append((alias, list(self.alias_to_link[alias].items())) for alias in sorted(self.alias_to_link))
+        for alias, entities in _merge_runs(runs):
+            yield alias, sorted(entities, key=lambda x: x[1], reverse=True)
+
+    def _merge_first_runs(self):
+        # merging consecutive runs keeps the order in which the entities were first seen
+        merged_path = self._new_run_path()
+        with open(merged_path, "wb") as run_file:
+            for alias, entities in _merge_runs([_read_run(run_path) for run_path in self.run_paths[:MAX_MERGE_RUNS]]):
+                pickle.dump((alias, entities), run_file, pickle.HIGHEST_PROTOCOL)
+        for run_path in self.run_paths[:MAX_MERGE_RUNS]:
+            os.remove(run_path)
+        self.run_paths[:MAX_MERGE_RUNS] = [merged_path]
+
+    def _new_run_path(self):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="alias_counter_", dir=self.tmp_dir)
+        self.n_runs += 1
+        return os.path.join(self.run_dir, "run_{}.pkl".format(self.n_runs))
+
+    def close(self):
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.run_paths = []
+
+
+def _read_run(run_path):
+    with open(run_path, "rb") as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                break
+
+
+def _merge_runs(runs):
+    """
+    k-way merge of runs of (alias, [(entity, count), ...]) sorted by alias, into the same with the counts summed.
+    The entities stay in the order in which they were first seen, given that the runs are in the order in which they were counted.
+    """
+    runs = [_tag_run(run, run_index) for run_index, run in enumerate(runs)]
+    previous_alias = None
+    entity_counts = dict()
+    for alias, run_index, entities in heapq.merge(*runs, key=lambda x: (x[0], x[1])):
+        if alias != previous_alias and previous_alias is not None:
+            yield previous_alias, list(entity_counts.items())
+            entity_counts = dict()
+        for entity, count in entities:
+            entity_counts[entity] = entity_counts.get(entity, 0) + count
+        previous_alias = alias
+    if previous_alias is not None:
+        yield previous_alias, list(entity_counts.items())
+
+
+def _tag_run(run, run_index):
+    for alias, entities in run:
+        yield alias, run_index, entities
@@ -0,0 +1,195 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import json
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+from compact_maps import id_to_code, code_to_id, OTHER_ID_KIND
+
+"""
+Binary, column-oriented tables for the intermediate files of wiki_io, as an alternative to the |-separated text files.
+
+A table starts with MAGIC and a JSON header with its (name, type) columns, followed by blocks of up to BLOCK_ROWS rows.
+Each block holds its number of rows and then every column at once:
+- str: the strings as one utf-8 blob, with their (32-bit) end offsets in characters
+- id: the Wikidata ids as integers (cf. compact_maps), with the ids that don't fit as strings
+- cat: a dictionary of the distinct strings of the block (e.g. languages) and their index for each row
+- int: the integers
+All numbers are little-endian. Any character can be stored, including | and newlines.
+"""
+
+MAGIC = b"WIKIBIN\x01"
+BLOCK_ROWS = 65536
+COLUMN_TYPES = ("str", "id", "cat", "int")
+
+_COUNT = struct.Struct("<Q")
+
+
+def is_binary_table(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _array_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(file, typecode, n):
+    values = array(typecode)
+    values.frombytes(file.read(n * values.itemsize))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _pack_strings(strings):
+    blob = "".join(strings).encode("utf-8")
+    ends = array("I", accumulate(len(string) for string in strings))
+    return _COUNT.pack(len(blob)) + blob + _array_bytes(ends)
+
+
+def _read_strings(file, n):
+    blob_len = _COUNT.unpack(file.read(_COUNT.size))[0]
+    text = file.read(blob_len).decode("utf-8")
+    ends = _read_array(file, "I", n)
+    strings = []
+    start = 0
+    for end in ends:
+        strings.append(text[start:end])
+        start = end
+    return strings
+
+
+def _pack_column(column_type, values):
+    if column_type == "str":
+        return _pack_strings(values)
+    if column_type == "int":
+        return _array_bytes(array("q", values))
+    if column_type == "id":
+        codes = array("q")
+        others = []
+        for value in values:
+            code = id_to_code(value)
+            if code is None:
+                code = (len(others) << 2) + OTHER_ID_KIND
+                others.append(value)
+            codes.append(code)
+        return _array_bytes(codes) + _COUNT.pack(len(others)) + _pack_strings(others)
+    if column_type == "cat":
+        index = dict()
+        codes = array("I", (index.setdefault(value, len(index)) for value in values))
+        return _COUNT.pack(len(index)) + _pack_strings(list(index)) + _array_bytes(codes)
+    raise ValueError("Unknown column type {}, expected one of {}".format(column_type, COLUMN_TYPES))
+
+
+def _read_column(file, column_type, n):
+    if column_type == "str":
+        return _read_strings(file, n)
+    if column_type == "int":
+        return _read_array(file, "q", n).tolist()
+    if column_type == "id":
+        codes = _read_array(file, "q", n)
+        n_others = _COUNT.unpack(file.read(_COUNT.size))[0]
+        others = _read_strings(file, n_others)
+        return [others[code >> 2] if code & 3 == OTHER_ID_KIND else code_to_id(code) for code in codes]
+    if column_type == "cat":
+        n_values = _COUNT.unpack(file.read(_COUNT.size))[0]
+        categories = _read_strings(file, n_values)
+        return [categories[code] for code in _read_array(file, "I", n)]
+    raise ValueError("Unknown column type {}, expected one of {}".format(column_type, COLUMN_TYPES))
+
+
+class BinaryTableWriter(object):
+    """ Write rows to a binary table, by blocks of BLOCK_ROWS rows """
+
+    def __init__(self, path, columns, position=None):
+        """
+        columns: (name, type) of each column, with type one of COLUMN_TYPES
+        position: to continue an existing table from a position returned by flush()
+        """
+        for name, column_type in columns:
+            if column_type not in COLUMN_TYPES:
+                raise ValueError("Unknown column type {}, expected one of {}".format(column_type, COLUMN_TYPES))
+        self.columns = list(columns)
+        self.rows = []
+        if position is None:
+            self.file = open(path, "wb")
+            header = json.dumps({"columns": self.columns}).encode("utf-8")
+            self.file.write(MAGIC + _COUNT.pack(len(header)) + header)
+        else:
+            size, rows = position
+            self.file = open(path, "r+b")
+            self.file.truncate(size)
+            self.file.seek(size)
+            self.rows = [tuple(row) for row in rows]
+
+    def write_row(self, *values):
+        self.rows.append(values)
+        if len(self.rows) >= BLOCK_ROWS:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.rows:
+            return
+        self.file.write(_COUNT.pack(len(self.rows)))
+        for (name, column_type), values in zip(self.columns, zip(*self.rows)):
+            self.file.write(_pack_column(column_type, values))
+        self.rows = []
+
+    def flush(self):
+        """
+        Flush the complete blocks to disk, and return the position of the writer: the size of the table and
+        the rows of the current block, so that the blocks are the same as without flushing
+        """
+        self.file.flush()
+        return [self.file.tell(), [list(row) for row in self.rows]]
+
+    def close(self):
+        if self.file is not None:
+            self.flush_block()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_columns(path):
+    """ The (name, type) columns of a binary table """
+    with open(path, "rb") as file:
+        return _read_header(file)
+
+
+def _read_header(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary table: {}".format(file.name))
+    header_len = _COUNT.unpack(file.read(_COUNT.size))[0]
+    return [tuple(column) for column in json.loads(file.read(header_len).decode("utf-8"))["columns"]]
+
+
+def iter_blocks(path):
+    """ Yield the blocks of a binary table, as a list of values for each column """
+    with open(path, "rb") as file:
+        columns = _read_header(file)
+        while True:
+            data = file.read(_COUNT.size)
+            if not data:
+                break
+            n_rows = _COUNT.unpack(data)[0]
+            yield [_read_column(file, column_type, n_rows) for name, column_type in columns]
+
+
+def iter_rows(path):
+    """ Yield the rows of a binary table, as tuples """
+    for block in iter_blocks(path):
+        for row in zip(*block):
+            yield row
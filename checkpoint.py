@@ -0,0 +1,78 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import time
+
+"""
+Checkpoints of the long passes over the dumps (cf. wikidata_processor.read_wikidata_entities_json and
+wikipedia_processor.scan_wikipedia), so that a crashed pass can be resumed instead of started over.
+
+A checkpoint is saved between two chunks (bz2 stream ranges) of a dump: it holds the number of chunks done,
+the line counts and the state of the partial aggregates, which are flushed to disk beforehand,
+e.g. the sizes of the output files, to which they are truncated when resuming.
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 600
+
+
+class Checkpoint(object):
+    """ JSON state of a pass, written atomically to path at most every interval seconds """
+
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last_save = time.time()
+
+    def load(self):
+        """ The last saved state, None if there isn't any """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r", encoding="utf8") as file:
+            state = json.load(file)
+        logger.info("Resuming from the checkpoint {}".format(self.path))
+        return state
+
+    def due(self):
+        return time.time() - self.last_save >= self.interval
+
+    def save(self, state):
+        # a crash while saving leaves the previous checkpoint as it was
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
+        logger.info("Saved the checkpoint {}".format(self.path))
+
+    def clear(self):
+        """ Remove the checkpoint, once the pass is over """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def file_size(file):
+    """ Size of an open file, once flushed """
+    file.flush()
+    return os.fstat(file.fileno()).st_size
+
+
+def truncate_file(path, size):
+    """ Drop what was written to path after a checkpoint """
+    with open(path, "r+b") as file:
+        file.truncate(size)
+
+
+def open_checkpoint(path, resume=False):
+    """ The Checkpoint of a pass, and the state to resume from (None unless resume) """
+    checkpoint = Checkpoint(path)
+    resume_state = checkpoint.load() if resume else None
+    if resume and resume_state is None:
+        logger.warning("No checkpoint {} to resume from, starting over".format(path))
+    return checkpoint, resume_state
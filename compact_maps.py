@@ -0,0 +1,322 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from array import array
+from collections.abc import Mapping
+
+"""
+Compact, array-backed versions of the maps read from the Wikidata dump (cf. wikidata_processor), for 90M+ entities.
+
+Wikidata ids are stored as integers, language codes are interned, and strings are kept as utf-8 in a single arena.
+The maps behave as read-only dicts (get, items, [], in, len) with dict-style assignment, in insertion order,
+so that they can be passed as-is to the writers of wiki_io and to kb_creator.
+"""
+
+# kinds of the Wikidata ids stored as integers, other ids (e.g. L7-S1) are stored as strings
+ID_KINDS = "QPL"
+OTHER_ID_KIND = 3
+# larger numbers don't fit in a signed 64-bit integer once shifted
+MAX_ID_DIGITS = 17
+
+INITIAL_BUCKETS = 8
+
+
+class StringArena(object):
+    """ Append-only store of strings, as utf-8 bytes in a single buffer, addressed by their index """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, string):
+        self._data += string.encode("utf-8")
+        self._offsets.append(len(self._data))
+        return len(self._offsets) - 2
+
+    def __getitem__(self, index):
+        return self._data[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+
+
+def id_to_code(id):
+    """ The integer code of a Q, P or L id, None for the other ids """
+    kind = ID_KINDS.find(id[:1]) if id else -1
+    number = id[1:]
+    if kind >= 0 and number.isdigit() and number.isascii() and number[0] != "0" and len(number) <= MAX_ID_DIGITS:
+        return (int(number) << 2) + kind
+    return None
+
+
+def code_to_id(code):
+    return ID_KINDS[code & 3] + str(code >> 2)
+
+
+class IdTable(object):
+    """ Encoding of the Wikidata ids (Q42, P31, L7) as integers, other ids are kept in a StringArena """
+
+    def __init__(self):
+        self._other_ids = StringArena()
+        self._other_index = dict()
+
+    def encode(self, id, add=True):
+        """ Returns the code of the id, or None if it isn't known and add is False """
+        code = id_to_code(id)
+        if code is not None:
+            return code
+        index = self._other_index.get(id)
+        if index is None:
+            if not add:
+                return None
+            index = self._other_index[id] = self._other_ids.append(id)
+        return (index << 2) + OTHER_ID_KIND
+
+    def decode(self, code):
+        if code & 3 == OTHER_ID_KIND:
+            return self._other_ids[code >> 2]
+        return code_to_id(code)
+
+
+class LanguageTable(object):
+    """ Interned language codes """
+
+    def __init__(self):
+        self.langs = []
+        self._index = dict()
+
+    def encode(self, lang):
+        index = self._index.get(lang)
+        if index is None:
+            index = self._index[lang] = len(self.langs)
+            self.langs.append(lang)
+        return index
+
+    def decode(self, index):
+        return self.langs[index]
+
+
+class _CompactMap(Mapping):
+    """
+    Open addressing hash index from the keys to their slots, in insertion order.
+    Subclasses store the keys and values of the slots.
+    """
+
+    def __init__(self):
+        self._size = 0
+        # slot + 1 for each bucket, 0 for an empty bucket
+        self._buckets = array("q", [0]) * INITIAL_BUCKETS
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for slot in range(self._size):
+            yield self._slot_key(slot)
+
+    def __getitem__(self, key):
+        slot = self._find_slot(key)
+        if slot < 0:
+            raise KeyError(key)
+        return self._slot_value(slot)
+
+    def __contains__(self, key):
+        return self._find_slot(key) >= 0
+
+    def __setitem__(self, key, value):
+        slot = self._find_slot(key)
+        if slot < 0:
+            slot = self._size
+            self._add_key(key)
+            self._size += 1
+            self._insert_bucket(key, slot)
+            if 2 * self._size > len(self._buckets):
+                self._grow()
+        # a new value for an existing key keeps its position, as in a dict
+        self._set_slot_value(slot, value)
+
+    def items(self):
+        for slot in range(self._size):
+            yield self._slot_key(slot), self._slot_value(slot)
+
+    def _find_slot(self, key):
+        code = self._lookup_code(key)
+        if code is None:
+            return -1
+        mask = len(self._buckets) - 1
+        bucket = hash(key) & mask
+        while True:
+            entry = self._buckets[bucket]
+            if entry == 0:
+                return -1
+            if self._slot_code(entry - 1) == code:
+                return entry - 1
+            bucket = (bucket + 1) & mask
+
+    def _insert_bucket(self, key, slot):
+        mask = len(self._buckets) - 1
+        bucket = hash(key) & mask
+        while self._buckets[bucket]:
+            bucket = (bucket + 1) & mask
+        self._buckets[bucket] = slot + 1
+
+    def _grow(self):
+        self._buckets = array("q", [0]) * (2 * len(self._buckets))
+        for slot in range(self._size):
+            self._insert_bucket(self._slot_key(slot), slot)
+
+    def _lookup_code(self, key):
+        """ The value compared with _slot_code, None when the key can't be in the map """
+        raise NotImplementedError
+
+    def _slot_code(self, slot):
+        raise NotImplementedError
+
+    def _add_key(self, key):
+        raise NotImplementedError
+
+    def _slot_key(self, slot):
+        raise NotImplementedError
+
+    def _set_slot_value(self, slot, value):
+        raise NotImplementedError
+
+    def _slot_value(self, slot):
+        raise NotImplementedError
+
+
+class CompactTitleToId(_CompactMap):
+    """ lang_title -> WD id, as title_to_id """
+
+    def __init__(self):
+        _CompactMap.__init__(self)
+        self._titles = StringArena()
+        self._ids = IdTable()
+        self._values = array("q")
+
+    def _lookup_code(self, key):
+        return key
+
+    def _slot_code(self, slot):
+        return self._titles[slot]
+
+    def _add_key(self, key):
+        self._titles.append(key)
+        self._values.append(0)
+
+    def _slot_key(self, slot):
+        return self._titles[slot]
+
+    def _set_slot_value(self, slot, value):
+        self._values[slot] = self._ids.encode(value)
+
+    def _slot_value(self, slot):
+        return self._ids.decode(self._values[slot])
+
+
+class _CompactIdRows(_CompactMap):
+    """
+    WD id -> a value stored as a range of (key, value) integer rows, cf. _encode_rows and _decode_rows.
+    A new value for an id is appended, and the rows of the previous value are left unused.
+    """
+
+    def __init__(self):
+        _CompactMap.__init__(self)
+        self._ids = IdTable()
+        self._keys = array("q")
+        self._starts = array("q")
+        self._ends = array("q")
+        self._row_keys = array("q")
+        self._row_values = array("q")
+
+    def _lookup_code(self, key):
+        return self._ids.encode(key, add=False)
+
+    def _slot_code(self, slot):
+        return self._keys[slot]
+
+    def _add_key(self, key):
+        self._keys.append(self._ids.encode(key))
+        self._starts.append(0)
+        self._ends.append(0)
+
+    def _slot_key(self, slot):
+        return self._ids.decode(self._keys[slot])
+
+    def _set_slot_value(self, slot, value):
+        self._starts[slot] = len(self._row_keys)
+        for row_key, row_value in self._encode_rows(value):
+            self._row_keys.append(row_key)
+            self._row_values.append(row_value)
+        self._ends[slot] = len(self._row_keys)
+
+    def _slot_value(self, slot):
+        start = self._starts[slot]
+        end = self._ends[slot]
+        return self._decode_rows(self._row_keys[start:end], self._row_values[start:end])
+
+    def _encode_rows(self, value):
+        raise NotImplementedError
+
+    def _decode_rows(self, row_keys, row_values):
+        raise NotImplementedError
+
+
+class CompactDescriptions(_CompactIdRows):
+    """ WD id -> {lang: description}, as id_to_descr """
+
+    def __init__(self):
+        _CompactIdRows.__init__(self)
+        self._langs = LanguageTable()
+        self._strings = StringArena()
+
+    def _encode_rows(self, value):
+        for lang, descr in value.items():
+            yield self._langs.encode(lang), self._strings.append(descr)
+
+    def _decode_rows(self, row_keys, row_values):
+        return {self._langs.decode(lang): self._strings[descr] for lang, descr in zip(row_keys, row_values)}
+
+
+class CompactAliases(_CompactIdRows):
+    """ WD id -> {lang: [aliases]}, as id_to_alias. Languages without aliases are dropped. """
+
+    def __init__(self):
+        _CompactIdRows.__init__(self)
+        self._langs = LanguageTable()
+        self._strings = StringArena()
+
+    def _encode_rows(self, value):
+        for lang, alias_list in value.items():
+            lang = self._langs.encode(lang)
+            for alias in alias_list:
+                yield lang, self._strings.append(alias)
+
+    def _decode_rows(self, row_keys, row_values):
+        alias_dict = dict()
+        for lang, alias in zip(row_keys, row_values):
+            alias_dict.setdefault(self._langs.decode(lang), []).append(self._strings[alias])
+        return alias_dict
+
+
+class CompactProperties(_CompactIdRows):
+    """
+    WD id -> [(property, [WD ids])], as id_to_proper.
+    Consecutive tuples of the same property are read back as one, and tuples without ids are dropped.
+    """
+
+    def _encode_rows(self, value):
+        for prop, ids in value:
+            prop = self._ids.encode(prop)
+            for id in ids:
+                yield prop, self._ids.encode(id)
+
+    def _decode_rows(self, row_keys, row_values):
+        proper_list = []
+        previous_prop = None
+        for prop, id in zip(row_keys, row_values):
+            if prop != previous_prop:
+                proper_list.append((self._ids.decode(prop), []))
+                previous_prop = prop
+            proper_list[-1][1].append(self._ids.decode(id))
+        return proper_list
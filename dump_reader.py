@@ -0,0 +1,342 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import bz2
+import logging
+import os
+import re
+from collections import namedtuple
+from multiprocessing import Pool
+from urllib.parse import urlparse
+
+"""
+Helpers to read (multistream) bz2 dumps in independent pieces, so that they can be processed by several workers.
+
+A bz2 file made of concatenated streams (pbzip2 output, Wikipedia multistream dumps) can be decompressed starting
+at the first byte of any of its streams. Single-stream files (e.g. bzip2 or lbzip2 output) only have one such offset
+and can not be split this way: pre-split them into shards instead.
+"""
+
+logger = logging.getLogger(__name__)
+
+# stream header "BZh" + block size, followed by the magic number of the first compressed block (BCD pi)
+stream_header_regex = re.compile(rb"BZh[1-9]1AY&SY")
+
+# XML tags of the Wikipedia dump, cf. WikiExtractor.tagRE
+tag_regex = re.compile(rb"(.*?)<(/?\w+)[^>]*>(?:([^<]*)(<.*?>)?)?")
+# <namespace key="6" case="first-letter">File</namespace> of the <siteinfo> header
+namespace_key_regex = re.compile(rb'key="(-?\d+)"')
+
+# lang: prefix of the dump in the Wikidata sitelinks (e.g. "en" for "enwiki"), namespaces: {key: name}
+SiteInfo = namedtuple("SiteInfo", ["lang", "base", "namespaces"])
+
+SCAN_BLOCK_SIZE = 64 * 1024 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def find_stream_offsets(bz2_file):
+    """ Scan a bz2 file for the byte offsets at which a new bz2 stream starts """
+    offsets = []
+    overlap = 9
+    with open(bz2_file, mode="rb") as file:
+        position = 0
+        previous = b""
+        while True:
+            block = file.read(SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            data = previous + block
+            base = position - len(previous)
+            for match in stream_header_regex.finditer(data):
+                offset = base + match.start()
+                if not offsets or offset > offsets[-1]:
+                    offsets.append(offset)
+            position += len(block)
+            previous = data[-overlap:]
+    if not offsets or offsets[0] != 0:
+        # not a bz2 file we can split, let the decompressor complain about it
+        offsets.insert(0, 0)
+    return offsets
+
+
+def group_stream_ranges(offsets, file_size, chunk_bytes):
+    """ Group consecutive streams into (start, end) byte ranges of about chunk_bytes compressed bytes each """
+    ranges = []
+    start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= chunk_bytes:
+            ranges.append((start, offset))
+            start = offset
+    if start < file_size:
+        ranges.append((start, file_size))
+    return ranges
+
+
+def get_stream_ranges(bz2_file, chunk_bytes=SCAN_BLOCK_SIZE):
+    offsets = find_stream_offsets(bz2_file)
+    ranges = group_stream_ranges(offsets, os.path.getsize(bz2_file), chunk_bytes)
+    if len(ranges) == 1:
+        logger.warning(
+            "Found a single bz2 stream in {}: it can't be split, consider pre-splitting it into shards".format(bz2_file)
+        )
+    return ranges
+
+
+def iter_range_data(bz2_file, start, end):
+    """ Decompress the (possibly multiple) bz2 streams in the byte range [start, end) of a file """
+    with open(bz2_file, mode="rb") as file:
+        file.seek(start)
+        remaining = end - start
+        decompressor = bz2.BZ2Decompressor()
+        while remaining > 0:
+            data = file.read(min(READ_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            while data:
+                yield decompressor.decompress(data)
+                if decompressor.eof:
+                    # start of the next stream in this range
+                    data = decompressor.unused_data
+                    decompressor = bz2.BZ2Decompressor()
+                else:
+                    data = b""
+
+
+def iter_range_lines(bz2_file, start, end):
+    """
+    Yield the newline-separated pieces of a decompressed byte range, without the line endings.
+    The first and the last piece are usually fragments of lines that cross the range boundaries.
+    """
+    pending = b""
+    for data in iter_range_data(bz2_file, start, end):
+        if not data:
+            continue
+        pieces = (pending + data).split(b"\n")
+        pending = pieces.pop()
+        for piece in pieces:
+            yield piece
+    yield pending
+
+
+def read_range_lines(bz2_file, start, end, line_fn):
+    """
+    Call line_fn on every complete line of a decompressed byte range.
+    Returns the (head, tail) fragments at both ends of the range, which the caller has to stitch
+    together with the tail of the previous range and the head of the next range.
+    The tail is None when the range doesn't contain a single line ending.
+    """
+    pieces = iter_range_lines(bz2_file, start, end)
+    head = next(pieces, b"")
+    previous = None
+    for piece in pieces:
+        if previous is not None:
+            line_fn(previous)
+        previous = piece
+    return head, previous
+
+
+def get_multistream_index_path(wikipedia_input):
+    """ Path of the companion -multistream-index.txt.bz2 file of a multistream Wikipedia dump, if it exists """
+    if wikipedia_input.endswith("-multistream.xml.bz2"):
+        index_file = wikipedia_input[: -len(".xml.bz2")] + "-index.txt.bz2"
+        if os.path.exists(index_file):
+            return index_file
+    return None
+
+
+def read_multistream_index(index_file):
+    """ Read the sorted stream offsets from a multistream index, made of offset:page_id:title lines """
+    offsets = set()
+    with bz2.open(index_file, mode="rb") as file:
+        for line in file:
+            offsets.add(int(line[: line.index(b":")]))
+    # the first stream contains the <siteinfo> header and isn't listed in the index
+    offsets.add(0)
+    return sorted(offsets)
+
+
+def get_page_stream_ranges(wikipedia_input, chunk_bytes=SCAN_BLOCK_SIZE, index_file=None):
+    """
+    Byte ranges of a Wikipedia dump that start at a bz2 stream. With a multistream index, the ranges only contain
+    whole <page> records. Without one, a page can cross the end of a range, cf. iter_range_pages.
+    """
+    if index_file is None:
+        index_file = get_multistream_index_path(wikipedia_input)
+    if index_file is None:
+        logger.info("No multistream index for {}, scanning for bz2 streams".format(wikipedia_input))
+        return get_stream_ranges(wikipedia_input, chunk_bytes)
+    offsets = read_multistream_index(index_file)
+    return group_stream_ranges(offsets, os.path.getsize(wikipedia_input), chunk_bytes)
+
+
+def iter_range_pages(bz2_file, start, end):
+    """
+    Yield the <page>...</page> records that start in a decompressed byte range, as bytes.
+    A page that crosses the end of the range is completed with the streams after it, and the fragment of a page
+    that crosses the start of the range is skipped, as the previous range reads it.
+    """
+    buffer = b""
+    search_from = 0
+    for data in iter_range_data(bz2_file, start, end):
+        if not data:
+            continue
+        buffer += data
+        while True:
+            page_start = buffer.find(b"<page>")
+            if page_start < 0:
+                # keep a possibly incomplete <page> tag
+                buffer = buffer[-5:]
+                search_from = 0
+                break
+            page_end = buffer.find(b"</page>", max(search_from, page_start))
+            if page_end < 0:
+                buffer = buffer[page_start:]
+                search_from = max(0, len(buffer) - 6)
+                break
+            page_end += len(b"</page>")
+            yield buffer[page_start:page_end]
+            buffer = buffer[page_end:]
+            search_from = 0
+    if buffer.startswith(b"<page>") or any(buffer.endswith(b"<page>"[:size]) for size in range(1, 6)):
+        page = _read_page_after(bz2_file, end, buffer)
+        if page is not None:
+            yield page
+
+
+def _read_page_after(bz2_file, end, buffer):
+    # buffer is an unfinished page, or ends with the start of a <page> tag, at the end of the range
+    limit = len(buffer)
+    search_from = 0
+    for data in iter_range_data(bz2_file, end, os.path.getsize(bz2_file)):
+        buffer += data
+        # only a <page> tag that starts before the end of the range belongs to it
+        page_start = buffer.find(b"<page>", 0, limit + 5)
+        if page_start < 0:
+            if len(buffer) >= limit + 5:
+                return None
+            continue
+        page_end = buffer.find(b"</page>", max(search_from, page_start))
+        if page_end >= 0:
+            return buffer[page_start:page_end + len(b"</page>")]
+        search_from = max(0, len(buffer) - 6)
+    if buffer.find(b"<page>", 0, limit + 5) >= 0:
+        logger.warning("Unfinished <page> at the end of {}".format(bz2_file))
+    return None
+
+
+def pages_from(lines):
+    """
+    Scans the lines (as bytes) of a Wikipedia XML dump and yields (id, title, ns, text) for every page,
+    in the manner of WikiExtractor.pages_from. Redirect pages are not skipped.
+    Only the lines with a tag are matched against a regex, and the text of a page is decoded at once.
+    """
+    text = []
+    id = None
+    title = None
+    ns = "0"
+    in_text = False
+    for line in lines:
+        if b"<" not in line:  # faster than doing re.search()
+            if in_text:
+                text.append(line)
+            continue
+        m = tag_regex.search(line)
+        if not m:
+            if in_text:
+                text.append(line)
+            continue
+        tag = m.group(2)
+        if tag == b"page":
+            text = []
+            id = None
+            title = None
+            ns = "0"
+            in_text = False
+        elif tag == b"id" and not id:  # skip the revision and contributor <id>
+            id = m.group(3).decode("utf-8")
+        elif tag == b"title":
+            title = m.group(3).decode("utf-8").strip()
+        elif tag == b"ns":
+            ns = m.group(3).decode("utf-8")
+        elif tag == b"text":
+            if line[m.start(3) - 2:m.start(3)] == b"/>":  # <text ... /> of an empty page
+                continue
+            in_text = True
+            text.append(line[m.start(3):m.end(3)])
+            if m.lastindex == 4:  # open-close
+                in_text = False
+        elif tag == b"/text":
+            if m.group(1):
+                text.append(m.group(1))
+            in_text = False
+        elif in_text:
+            text.append(line)
+        elif tag == b"/page":
+            if id:
+                yield id, title, ns, b"".join(text).decode("utf-8")
+            id = None
+            text = []
+
+
+def read_siteinfo(wikipedia_input):
+    """
+    Read the <siteinfo> header at the start of a Wikipedia dump, as WikiExtractor.process_dump does.
+    The language is taken from <dbname>, or else from the host of <base>. It is None without a header,
+    e.g. for the shards of a dump after the first one.
+    """
+    dbname = None
+    base = None
+    namespaces = dict()
+    with bz2.open(wikipedia_input, mode="rb") as file:
+        for line in file:
+            m = tag_regex.search(line)
+            if not m:
+                continue
+            tag = m.group(2)
+            if tag == b"dbname":
+                dbname = m.group(3).decode("utf-8").strip()
+            elif tag == b"base":
+                base = m.group(3).decode("utf-8").strip()
+            elif tag == b"namespace":
+                key = namespace_key_regex.search(line)
+                name = (m.group(3) or b"").decode("utf-8").strip()
+                if key and name:
+                    namespaces[int(key.group(1))] = name
+            elif tag in (b"/siteinfo", b"page"):
+                break
+    lang = None
+    if dbname and dbname.endswith("wiki"):
+        lang = dbname[: -len("wiki")]
+    elif base and urlparse(base).hostname:
+        lang = urlparse(base).hostname.split(".")[0]
+    return SiteInfo(lang, base, namespaces)
+
+
+def _apply_to_range_pages(task):
+    page_fn, args, bz2_file, start, end = task
+    records = iter_range_pages(bz2_file, start, end)
+    pages = pages_from(line for record in records for line in record.splitlines(True))
+    return page_fn(pages, *args)
+
+
+def map_page_ranges(
+    wikipedia_input, page_fn, args=(), n_procs=1, chunk_bytes=SCAN_BLOCK_SIZE, index_file=None, ranges=None
+):
+    """
+    Apply page_fn(pages, *args) to the (id, title, ns, text) pages of every independent range of a Wikipedia dump
+    in a pool of n_procs processes (or in this process if n_procs is 1), and yield the results in dump order.
+    page_fn must be a module-level function, and args must be picklable.
+    ranges are the ranges of get_page_stream_ranges to read, by default all of them.
+    """
+    if ranges is None:
+        ranges = get_page_stream_ranges(wikipedia_input, chunk_bytes, index_file)
+    logger.info("Reading {} chunks of {} with {} processes".format(len(ranges), wikipedia_input, n_procs))
+    tasks = [(page_fn, args, wikipedia_input, start, end) for start, end in ranges]
+    if n_procs <= 1:
+        for task in tasks:
+            yield _apply_to_range_pages(task)
+        return
+    with Pool(n_procs) as pool:
+        for result in pool.imap(_apply_to_range_pages, tasks):
+            yield result
@@ -24,17 +24,18 @@ def create_kb(
     entity_freq_path,
     prior_prob_path,
     entity_vector_length,
+    index=False,
 ):
     # Create the knowledge base from Wikidata entries
     kb = KnowledgeBase(vocab=nlp.vocab, entity_vector_length=entity_vector_length)
-    entity_list, filtered_title_to_id = _define_entities(nlp, kb, entity_def_path, entity_descr_path, min_entity_freq, entity_freq_path, entity_vector_length)
+    entity_list, filtered_title_to_id = _define_entities(nlp, kb, entity_def_path, entity_descr_path, min_entity_freq, entity_freq_path, entity_vector_length, index)
     _define_aliases(kb, entity_alias_path, entity_list, filtered_title_to_id, max_entities_per_alias, min_occ, prior_prob_path)
     return kb
 
 
-def _define_entities(nlp, kb, entity_def_path, entity_descr_path, min_entity_freq, entity_freq_path, entity_vector_length):
+def _define_entities(nlp, kb, entity_def_path, entity_descr_path, min_entity_freq, entity_freq_path, entity_vector_length, index=False):
     # read the mappings from file
-    title_to_id = io.read_title_to_id(entity_def_path)
+    title_to_id = io.read_title_to_id(entity_def_path, index=index)
     id_to_descr = io.read_id_to_descr(entity_descr_path)
 
     # check the length of the nlp vectors
@@ -107,54 +108,43 @@ def _add_aliases(kb, entity_list, title_to_id, max_entities_per_alias, min_occ,
     # adding aliases with prior probabilities
     # we can read this file sequentially, it's sorted by alias, and then by count
     logger.info("Adding WP aliases")
-    with open(prior_prob_path, "r", encoding="utf8") as prior_file:
-        # skip header
-        prior_file.readline()
-        line = prior_file.readline()
-        previous_alias = None
-        total_count = 0
-        counts = []
-        entities = []
-        while line:
-            splits = line.replace("\n", "").split(sep="|")
-            new_alias = splits[0]
-            count = int(splits[1])
-            entity = splits[2]
-
-            if new_alias != previous_alias and previous_alias:
-                # done reading the previous alias --> output
-                if len(entities) > 0:
-                    selected_entities = []
-                    prior_probs = []
-                    for ent_count, ent_string in zip(counts, entities):
-                        if ent_string in wp_titles:
-                            wd_id = title_to_id[ent_string]
-                            p_entity_givenalias = ent_count / total_count
-                            selected_entities.append(wd_id)
-                            prior_probs.append(p_entity_givenalias)
-
-                    if selected_entities:
-                        try:
-                            kb.add_alias(
-                                alias=previous_alias,
-                                entities=selected_entities,
-                                probabilities=prior_probs,
-                            )
-                        except ValueError as e:
-                            logger.error(e)
-                total_count = 0
-                counts = []
-                entities = []
-
-            total_count += count
-
-            if len(entities) < max_entities_per_alias and count >= min_occ:
-                ##alias对应的entity的个数最多为10个，每个entity的count数要大于5个
-                counts.append(count)
-                entities.append(entity)
-            previous_alias = new_alias
-
-            line = prior_file.readline()
+    previous_alias = None
+    total_count = 0
+    counts = []
+    entities = []
+    for new_alias, count, entity in io.read_prior_probs(prior_prob_path):
+        if new_alias != previous_alias and previous_alias:
+            # done reading the previous alias --> output
+            if len(entities) > 0:
+                selected_entities = []
+                prior_probs = []
+                for ent_count, ent_string in zip(counts, entities):
+                    if ent_string in wp_titles:
+                        wd_id = title_to_id[ent_string]
+                        p_entity_givenalias = ent_count / total_count
+                        selected_entities.append(wd_id)
+                        prior_probs.append(p_entity_givenalias)
+
+                if selected_entities:
+                    try:
+                        kb.add_alias(
+                            alias=previous_alias,
+                            entities=selected_entities,
+                            probabilities=prior_probs,
+                        )
+                    except ValueError as e:
+                        logger.error(e)
+            total_count = 0
+            counts = []
+            entities = []
+
+        total_count += count
+
+        if len(entities) < max_entities_per_alias and count >= min_occ:
+            ##alias对应的entity的个数最多为10个，每个entity的count数要大于5个
+            counts.append(count)
+            entities.append(entity)
+        previous_alias = new_alias
 
 
 def read_kb(nlp, kb_file):
@@ -16,15 +16,16 @@ wgUrlProtocols = [
 # as well as U+3000 is IDEOGRAPHIC SPACE for bug 19052
 EXT_LINK_URL_CLASS = r'[^][<>"\x00-\x20\x7F\s]'
 ANCHOR_CLASS = r'[^][\x00-\x08\x0a-\x1F]'
+# the inline (?i) of WikiExtractor applied to the whole pattern, a global flag has to come first since Python 3.11
 ExtLinkBracketedRegex = re.compile(
-    '\[(((?i)' + '|'.join(wgUrlProtocols) + ')' + EXT_LINK_URL_CLASS + r'+)' +
+    '\[((' + '|'.join(wgUrlProtocols) + ')' + EXT_LINK_URL_CLASS + r'+)' +
     r'\s*((?:' + ANCHOR_CLASS + r'|\[\[' + ANCHOR_CLASS + r'+\]\])' + r'*?)\]',
-    re.S | re.U)
+    re.S | re.U | re.I)
 
 EXT_IMAGE_REGEX = re.compile(
     r"""^(http://|https://)([^][<>"\x00-\x20\x7F\s]+)
-    /([A-Za-z0-9_.,~%\-+&;#*?!=()@\x80-\xFF]+)\.((?i)gif|png|jpg|jpeg)$""",
-    re.X | re.S | re.U)
+    /([A-Za-z0-9_.,~%\-+&;#*?!=()@\x80-\xFF]+)\.(gif|png|jpg|jpeg)$""",
+    re.X | re.S | re.U | re.I)
 
 switches = (
         '__NOTOC__',
@@ -366,10 +367,13 @@ ignoredTags = (
 placeholder_tags = {'math': 'formula', 'code': 'codice'}
 
 ignored_tag_patterns = []
+# the same patterns by tag, cf. tagNames
+ignored_tag_regexes = {}
 def ignoreTag(tag):
     left = re.compile(r'<%s\b.*?>' % tag, re.IGNORECASE | re.DOTALL)  # both <ref> and <reference>
     right = re.compile(r'</\s*%s>' % tag, re.IGNORECASE)
     ignored_tag_patterns.append((left, right))
+    ignored_tag_regexes[tag] = (left, right)
 
 for tag in ignoredTags:
     ignoreTag(tag)
@@ -379,18 +383,68 @@ selfClosing_tag_patterns = [
     re.compile(r'<\s*%s\b[^>]*/\s*>' % tag, re.DOTALL | re.IGNORECASE) for tag in selfClosingTags
 ]
 
+selfClosing_tag_regexes = dict(zip(selfClosingTags, selfClosing_tag_patterns))
+
+# Match the opening and closing discardElements, for dropNestedRegex
+discard_element_regexes = [
+    (tag, re.compile(r'<\s*%s\b[^>/]*>' % tag, re.IGNORECASE), re.compile(r'<\s*/\s*%s>' % tag, re.IGNORECASE))
+    for tag in discardElements
+]
+
+# Match the name of every (opening, closing or self-closing) tag
+tag_name = re.compile(r'<\s*/?\s*(\w+)')
+
 # Match HTML placeholder tags
 placeholder_tag_patterns = [
     (re.compile(r'<\s*%s(\s*| [^>]+?)>.*?<\s*/\s*%s\s*>' % (tag, tag), re.DOTALL | re.IGNORECASE),
      repl) for tag, repl in placeholder_tags.items()
 ]
 
+# compiled delimiters of dropNested
+delimiter_regexes = {}
+
+
+def delimiterRegex(delim):
+    regex = delimiter_regexes.get(delim)
+    if regex is None:
+        regex = delimiter_regexes[delim] = re.compile(delim, re.IGNORECASE)
+    return regex
+
+
+def tagNames(text):
+    """
+    The (casefolded) names of the tags of text, in a single scan: a tag pattern can only match if its name is there.
+    """
+    return {m.group(1).casefold() for m in tag_name.finditer(text)}
+
+
 def dropNested(text, openDelim, closeDelim):
     """
     A matching function for nested expressions, e.g. namespaces and tables.
     """
-    openRE = re.compile(openDelim, re.IGNORECASE)
-    closeRE = re.compile(closeDelim, re.IGNORECASE)
+    return dropNestedRegex(text, delimiterRegex(openDelim), delimiterRegex(closeDelim))
+
+
+def dropDiscardElements(text):
+    """
+    Drop the discardElements, only searching for the ones whose tag is in the text.
+    """
+    names = tagNames(text)
+    for tag, openRE, closeRE in discard_element_regexes:
+        if tag not in names:
+            continue
+        dropped = dropNestedRegex(text, openRE, closeRE)
+        if len(dropped) != len(text):
+            text = dropped
+            # the pieces around a dropped element may join into a new tag
+            names = tagNames(text)
+    return text
+
+
+def dropNestedRegex(text, openRE, closeRE):
+    """
+    dropNested with compiled delimiters.
+    """
     # partition text in separate blocks { } { }
     spans = []  # pairs (s, e) for each partition
     nest = 0  # nesting level
@@ -442,16 +496,27 @@ def dropSpans(spans, text):
     """
     Drop from text the blocks identified in :param spans:, possibly nested.
     """
-    spans.sort()
-    res = ''
+    return applyEdits(text, [(s, e, '') for s, e in spans])
+
+
+def applyEdits(text, edits):
+    """
+    Replace in text the blocks of the (start, end, replacement) :param edits:, in a single join.
+    An edit starting inside a previous one is nested in it and skipped, as in dropSpans.
+    """
+    edits.sort()
+    pieces = []
     offset = 0
-    for s, e in spans:
+    append = pieces.append
+    for s, e, replacement in edits:
         if offset <= s:  # handle nesting
             if offset < s:
-                res += text[offset:s]
+                append(text[offset:s])
+            if replacement:
+                append(replacement)
             offset = e
-    res += text[offset:]
-    return res
+    append(text[offset:])
+    return ''.join(pieces)
 
 
 def replaceExternalLinks(text):
@@ -459,10 +524,46 @@ def replaceExternalLinks(text):
     https://www.mediawiki.org/wiki/Help:Links#External_links
     [URL anchor text]
     """
-    s = ''
+    return applyEdits(text, [(m.start(), m.end(), '') for m in ExtLinkBracketedRegex.finditer(text)])
+
+
+def unescapeOutside(text, regex):
+    """
+    unescape text, except for the first group of the matches of regex, e.g. the content of <syntaxhighlight>.
+    """
+    pieces = []
     cur = 0
-    for m in ExtLinkBracketedRegex.finditer(text):
-        s += text[cur:m.start()]
+    for m in regex.finditer(text):
+        pieces.append(unescape(text[cur:m.start()]))
+        pieces.append(m.group(1))
         cur = m.end()
+    pieces.append(unescape(text[cur:]))
+    return ''.join(pieces)
 
-    return s + text[cur:]
+
+def expandPlaceholders(text):
+    """
+    Replace the placeholder tags, e.g. <math>, with numbered placeholders in a single join per tag.
+    A repeated tag keeps the number of its first occurrence.
+    """
+    for pattern, placeholder in placeholder_tag_patterns:
+        first_index = {}  # tag -> number of its first occurrence
+        replaced = {}  # tag -> (offset, number) of the part that is replaced
+        edits = []
+        for index, match in enumerate(pattern.finditer(text), 1):
+            tag = match.group()
+            if tag not in replaced:
+                # as with str.replace, a previous tag nested at the end of this one takes the place of it
+                offset, number = 0, index
+                inner = pattern.search(text, match.start() + 1, match.end())
+                while inner:
+                    if first_index.get(inner.group(), number) < number:
+                        offset, number = inner.start() - match.start(), first_index[inner.group()]
+                    inner = pattern.search(text, inner.start() + 1, match.end())
+                first_index[tag] = index
+                replaced[tag] = offset, number
+            offset, number = replaced[tag]
+            edits.append((match.start() + offset, match.end(), '%s_%d' % (placeholder, number)))
+        if edits:
+            text = applyEdits(text, edits)
+    return text
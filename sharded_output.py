@@ -0,0 +1,137 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import bz2
+import glob
+import gzip
+import json
+import logging
+import os
+
+"""
+Output of the gold entities split in shards, like WikiExtractor.OutputSplitter: the lines are written to the
+smallest of n_shards open files, a file is closed and replaced by a new one once it reaches max_shard_size
+characters, and the files can be compressed with gzip, bz2 or zstd (with the zstandard package).
+
+The shards of <base>.jsonl are named <base>-00000.jsonl.gz etc., and are listed with their line counts in the
+manifest <base>.manifest.json, so that they can be read in parallel, cf. read_manifest.
+"""
+
+logger = logging.getLogger(__name__)
+
+# file extension of each compression
+COMPRESSIONS = {None: "", "gzip": ".gz", "bz2": ".bz2", "zstd": ".zst"}
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def is_sharded(n_shards=1, max_shard_size=None, compression=None):
+    """ Whether the output options need a ShardedWriter instead of a single plain file """
+    return n_shards > 1 or bool(max_shard_size) or compression is not None
+
+
+def manifest_path(path):
+    """ The manifest of the shards of path, e.g. gold_entities_en.jsonl -> gold_entities_en.manifest.json """
+    return os.path.splitext(path)[0] + MANIFEST_SUFFIX
+
+
+def _check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression {}, expected one of gzip, bz2 or zstd".format(compression))
+
+
+def open_shard(path, mode="rt", compression=None):
+    """ Open a shard in text mode, with the compression of its extension by default """
+    if compression is None:
+        compression = next((name for name, ext in COMPRESSIONS.items() if name and path.endswith(ext)), None)
+    _check_compression(compression)
+    if compression == "gzip":
+        return gzip.open(path, mode, encoding="utf8")
+    if compression == "bz2":
+        return bz2.open(path, mode, encoding="utf8")
+    if compression == "zstd":
+        import zstandard
+        return zstandard.open(path, mode, encoding="utf8")
+    return open(path, mode[0], encoding="utf8")
+
+
+def read_manifest(path):
+    """ The (path, line count) of the shards of a manifest, in the order they were closed """
+    with open(path, "r", encoding="utf8") as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(path)
+    return [(os.path.join(directory, shard["path"]), shard["records"]) for shard in manifest["shards"]]
+
+
+class ShardedWriter(object):
+    """
+    File-like writer of the lines of path to its shards. The shards that are done are kept with their line counts,
+    the manifest is written when the writer is closed.
+    """
+
+    def __init__(self, path, n_shards=1, max_shard_size=None, compression=None, shards=None):
+        _check_compression(compression)
+        self.base, self.ext = os.path.splitext(path)
+        self.n_shards = n_shards
+        self.max_shard_size = max_shard_size
+        self.compression = compression
+        # shards that are done: {path, records, size}, with a path relative to the directory of the manifest
+        self.shards = list(shards or [])
+        # open shards: [file, shard]
+        self.open_shards = []
+
+    def _new_shard(self):
+        number = len(self.shards) + len(self.open_shards)
+        name = "{}-{:05d}{}{}".format(self.base, number, self.ext, COMPRESSIONS[self.compression])
+        shard = {"path": os.path.basename(name), "records": 0, "size": 0}
+        self.open_shards.append([open_shard(name, "wt", self.compression), shard])
+        return self.open_shards[-1]
+
+    def write(self, data):
+        if not data:
+            return
+        if len(self.open_shards) < self.n_shards:
+            entry = self._new_shard()
+        else:
+            entry = min(self.open_shards, key=lambda open_entry: open_entry[1]["size"])
+        file, shard = entry
+        if self.max_shard_size and shard["size"] and shard["size"] + len(data) > self.max_shard_size:
+            self._close_shard(entry)
+            file, shard = self._new_shard()
+        file.write(data)
+        shard["records"] += data.count("\n")
+        shard["size"] += len(data)
+
+    def _close_shard(self, entry):
+        file, shard = entry
+        file.close()
+        self.open_shards.remove(entry)
+        self.shards.append(shard)
+
+    def checkpoint(self):
+        """ Close the open shards, so that they are complete on disk, and return the shards that are done """
+        for entry in list(self.open_shards):
+            self._close_shard(entry)
+        return list(self.shards)
+
+    @classmethod
+    def resume(cls, path, shards, n_shards=1, max_shard_size=None, compression=None):
+        """ Continue after the shards of a checkpoint, removing the shards written after it """
+        writer = cls(path, n_shards, max_shard_size, compression, shards)
+        done = {os.path.join(os.path.dirname(path), shard["path"]) for shard in shards}
+        for name in glob.glob(glob.escape(writer.base) + "-[0-9][0-9][0-9][0-9][0-9]" + writer.ext + "*"):
+            if name not in done:
+                os.remove(name)
+        return writer
+
+    def close(self):
+        self.checkpoint()
+        manifest = {
+            "compression": self.compression,
+            "records": sum(shard["records"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        path = self.base + MANIFEST_SUFFIX
+        with open(path + ".tmp", "w", encoding="utf8") as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(path + ".tmp", path)
+        logger.info("Wrote {} shards of {} lines, cf. {}".format(len(self.shards), manifest["records"], path))
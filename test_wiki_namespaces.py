@@ -0,0 +1,25 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from wiki_namespaces import NamespaceMatcher
+
+
+def test_siteinfo_category_links_are_removed():
+    # "Kategorie" is only known from the <siteinfo> of the dump, not from WP_CATEGORY_NAMESPACE
+    matcher = NamespaceMatcher({14: "Kategorie"})
+    text = "Berlin ist [[Hauptstadt]].\n[[Kategorie:Ort in Berlin]]\n[[kategorie:Stadt|Berlin]]"
+    assert matcher.remove_category_and_file_links(text) == "Berlin ist [[Hauptstadt]].\n\n"
+    assert matcher.is_meta("Kategorie:Ort in Berlin")
+    assert not matcher.is_meta("Hauptstadt")
+
+
+def test_siteinfo_category_links_are_kept_without_siteinfo():
+    matcher = NamespaceMatcher()
+    assert matcher.remove_category_and_file_links("[[Kategorie:Stadt]]") == "[[Kategorie:Stadt]]"
+    assert not matcher.is_meta("Kategorie:Stadt")
+
+
+def test_namespace_names_match_spaces_and_underscores():
+    matcher = NamespaceMatcher({6: "Fichier image"})
+    text = "a [[Fichier_image:x.jpg|b [[c]]]] d [[fichier image:y.png]]"
+    assert matcher.remove_category_and_file_links(text) == "a  d "
@@ -0,0 +1,145 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import bz2
+import os
+
+import pytest
+
+import dump_reader
+import wikipedia_processor as wp
+from checkpoint import Checkpoint
+
+CITIES = ["Paris", "London", "Berlin", "Tokyo", "Rome"]
+
+
+def _write_dump(path, n_pages=40):
+    # a multistream dump with one page per bz2 stream
+    streams = [
+        "<mediawiki>\n  <siteinfo>\n    <dbname>enwiki</dbname>\n"
+        '    <namespaces>\n      <namespace key="14" case="first-letter">Category</namespace>\n'
+        "    </namespaces>\n  </siteinfo>\n"
+    ]
+    for page_id in range(1, n_pages + 1):
+        links = " ".join(
+            "The city of [[{}|{} {}]] is linked from page {}.".format(city, city.lower(), page_id % 7, page_id)
+            for city in CITIES[page_id % 3:]
+        )
+        streams.append(
+            "  <page>\n    <title>Page {0}</title>\n    <ns>0</ns>\n    <id>{0}</id>\n    <revision>\n"
+            '      <id>{1}</id>\n      <text xml:space="preserve">{2}\n[[Category:Test]]</text>\n'
+            "    </revision>\n  </page>\n".format(page_id, 1000 + page_id, links)
+        )
+    streams.append("</mediawiki>\n")
+    with open(path, "wb") as file:
+        for stream in streams:
+            file.write(bz2.compress(stream.encode("utf8")))
+
+
+def _write_defs(path):
+    with open(path, "w", encoding="utf8") as file:
+        file.write("WP_title|WD_id\n")
+        for i, city in enumerate(CITIES):
+            file.write("en_{}|Q{}\n".format(city, i + 1))
+
+
+def _read_prior_probs(dump, output_dir, checkpoint=None, resume_state=None):
+    wp.read_prior_probs(
+        [dump], os.path.join(output_dir, "prior_prob.csv"), max_pairs=3, checkpoint=checkpoint,
+        resume_state=resume_state,
+    )
+
+
+def _create_training(dump, output_dir, checkpoint=None, resume_state=None):
+    wp.create_training(
+        [dump], os.path.join(output_dir, "entity_defs.csv"), output_dir, segmenter="rules", checkpoint=checkpoint,
+        resume_state=resume_state,
+    )
+
+
+def _run_with_checkpoint(run_pass, dump, output_dir):
+    # as the pipeline does: resume from the checkpoint if there is one, and clear it at the end of the pass
+    checkpoint = Checkpoint(os.path.join(output_dir, run_pass.__name__ + ".json"), interval=0)
+    run_pass(dump, output_dir, checkpoint, checkpoint.load())
+    checkpoint.clear()
+
+
+def _leftovers(directory):
+    return sorted(
+        name for _, dir_names, file_names in os.walk(directory) for name in dir_names + file_names
+        if name.startswith(("alias_counter_", "scan_wikipedia_")) or name.endswith(".partial")
+    )
+
+
+def _read_outputs(output_dir):
+    outputs = dict()
+    for name in ("prior_prob.csv", "gold_entities_en.jsonl"):
+        with open(os.path.join(output_dir, name), "rb") as file:
+            outputs[name] = file.read()
+    return outputs
+
+
+@pytest.fixture
+def one_page_per_chunk(monkeypatch):
+    get_page_stream_ranges = dump_reader.get_page_stream_ranges
+    monkeypatch.setattr(
+        dump_reader, "get_page_stream_ranges",
+        lambda wikipedia_input, chunk_bytes=1, index_file=None: get_page_stream_ranges(wikipedia_input, 1, index_file)
+    )
+
+
+def test_resume_removes_the_files_of_the_crashed_pass(tmp_path, one_page_per_chunk):
+    dump = str(tmp_path / "enwiki-test-pages-articles-multistream.xml.bz2")
+    _write_dump(dump)
+    expected_dir, output_dir = str(tmp_path / "expected"), str(tmp_path / "output")
+    for directory in (expected_dir, output_dir):
+        os.makedirs(directory)
+        _write_defs(os.path.join(directory, "entity_defs.csv"))
+    _read_prior_probs(dump, expected_dir)
+    _create_training(dump, expected_dir)
+    assert _leftovers(expected_dir) == []
+
+    crashes = [(_read_prior_probs, wp.PriorProbConsumer), (_create_training, wp.TrainingConsumer)]
+    for run_pass, consumer_class in crashes:
+        pid = os.fork()
+        if pid == 0:
+            # the pass is killed in the middle of a chunk, after its consumer spilled or wrote to disk
+            process_page = consumer_class.process_page
+            n_pages = [0]
+
+            def crashing_process_page(self, page, lang):
+                process_page(self, page, lang)
+                n_pages[0] += 1
+                if n_pages[0] == 25:
+                    os._exit(1)
+
+            consumer_class.process_page = crashing_process_page
+            try:
+                _run_with_checkpoint(run_pass, dump, output_dir)
+            finally:
+                os._exit(0)
+        assert os.waitpid(pid, 0)[1] >> 8 == 1
+    assert _leftovers(output_dir) != []
+
+    _run_with_checkpoint(_read_prior_probs, dump, output_dir)
+    _run_with_checkpoint(_create_training, dump, output_dir)
+    assert _leftovers(output_dir) == []
+    assert _read_outputs(output_dir) == _read_outputs(expected_dir)
+
+
+def test_error_without_checkpoint_removes_the_files(tmp_path, one_page_per_chunk, monkeypatch):
+    dump = str(tmp_path / "enwiki-test-pages-articles-multistream.xml.bz2")
+    _write_dump(dump)
+    merge = wp.PriorProbConsumer.merge
+    n_chunks = [0]
+
+    def failing_merge(self, partial):
+        merge(self, partial)
+        n_chunks[0] += 1
+        if n_chunks[0] == 20:
+            raise RuntimeError("merge failed")
+
+    monkeypatch.setattr(wp.PriorProbConsumer, "merge", failing_merge)
+    with pytest.raises(RuntimeError):
+        wp.read_prior_probs([dump], str(tmp_path / "prior_prob.csv"), n_procs=2, max_pairs=3)
+    assert _leftovers(str(tmp_path)) == []
@@ -0,0 +1,252 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping
+
+from compact_maps import id_to_code, code_to_id, OTHER_ID_KIND
+
+"""
+On-disk hash index of the entity definitions (lang_title -> WD id, cf. wiki_io.read_title_to_id), opened with mmap.
+
+The index is built once from entity_defs.csv and then shared through the page cache by all the processes
+that open it, instead of each of them loading the 15M+ titles into a dict.
+
+Layout, after a fixed-size header (cf. _HEADER):
+- the utf-8 titles, one after the other, and their end offsets
+- the WD id of each title as an integer (cf. compact_maps), the other ids are stored as strings
+- the hash table: linear probing on the crc32 of the titles, with the title index + 1 in each bucket (0 if empty)
+All numbers are in the byte order of the machine that built the index, an index from another machine is stale.
+"""
+
+MAGIC = b"WIKITIX\x01"
+# a title that is seen again replaces the value of the first one, as in a dict, and its own entry is unused
+UNUSED_CODE = -1
+
+# magic, byte order, source size and mtime, entries, used entries, other ids, buckets, then the section offsets
+_HEADER = struct.Struct("=8s8sqqqqqqqqqqqq")
+_ALIGNMENT = 8
+
+
+def _hash(key_bytes):
+    # unlike hash(), stable across processes and runs
+    return zlib.crc32(key_bytes)
+
+
+def _source_stamp(source_path):
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _pad(file):
+    padding = -file.tell() % _ALIGNMENT
+    file.write(b"\0" * padding)
+    return file.tell()
+
+
+def _read_header(file):
+    data = file.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        return None
+    header = _HEADER.unpack(data)
+    if header[0] != MAGIC or header[1].rstrip(b"\0") != sys.byteorder.encode("ascii"):
+        return None
+    return header
+
+
+def is_fresh(index_path, source_path):
+    """ Whether the index exists and was built from the current version of source_path """
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, "rb") as file:
+        header = _read_header(file)
+    return header is not None and (header[2], header[3]) == _source_stamp(source_path)
+
+
+def write_title_index(index_path, rows, source_path):
+    """
+    Build the index of the (title, WD id) rows read from source_path.
+    The index is written to a temporary file first, so that the processes opening it never see a partial index.
+    """
+    source_size, source_mtime = _source_stamp(source_path)
+    tmp_path = "{}.tmp{}".format(index_path, os.getpid())
+    key_ends = array("q", [0])
+    key_hashes = array("I")
+    codes = array("q")
+    other_ids = []
+    try:
+        with open(tmp_path, "w+b") as file:
+            file.write(b"\0" * _HEADER.size)
+            keys_start = _pad(file)
+            key_end = 0
+            for title, qid in rows:
+                key_bytes = title.encode("utf-8")
+                file.write(key_bytes)
+                key_end += len(key_bytes)
+                key_ends.append(key_end)
+                key_hashes.append(_hash(key_bytes))
+                code = id_to_code(qid)
+                if code is None:
+                    code = (len(other_ids) << 2) + OTHER_ID_KIND
+                    other_ids.append(qid)
+                codes.append(code)
+            file.flush()
+
+            n_entries = len(codes)
+            n_buckets = 8
+            while n_buckets < 2 * n_entries:
+                n_buckets *= 2
+            buckets = array("I", [0]) * n_buckets
+            mask = n_buckets - 1
+            n_used = n_entries
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as keys:
+                for entry in range(n_entries):
+                    key_hash = key_hashes[entry]
+                    bucket = key_hash & mask
+                    while buckets[bucket]:
+                        other = buckets[bucket] - 1
+                        if key_hashes[other] == key_hash and _slice(keys, keys_start, key_ends, other) == _slice(
+                            keys, keys_start, key_ends, entry
+                        ):
+                            codes[other] = codes[entry]
+                            codes[entry] = UNUSED_CODE
+                            n_used -= 1
+                            break
+                        bucket = (bucket + 1) & mask
+                    else:
+                        buckets[bucket] = entry + 1
+            del key_hashes
+
+            file.seek(0, os.SEEK_END)
+            key_ends_start = _pad(file)
+            key_ends.tofile(file)
+            codes_start = _pad(file)
+            codes.tofile(file)
+            other_blob = "".join(other_ids).encode("utf-8")
+            other_ends = array("q", [0])
+            for other_id in other_ids:
+                other_ends.append(other_ends[-1] + len(other_id.encode("utf-8")))
+            others_start = _pad(file)
+            file.write(other_blob)
+            other_ends_start = _pad(file)
+            other_ends.tofile(file)
+            buckets_start = _pad(file)
+            buckets.tofile(file)
+
+            file.seek(0)
+            file.write(_HEADER.pack(
+                MAGIC, sys.byteorder.encode("ascii"), source_size, source_mtime,
+                n_entries, n_used, len(other_ids), n_buckets,
+                keys_start, key_ends_start, codes_start, others_start, other_ends_start, buckets_start,
+            ))
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _slice(data, start, ends, index):
+    return data[start + ends[index]:start + ends[index + 1]]
+
+
+class TitleIndex(Mapping):
+    """
+    Read-only, dict-like view of an index written by write_title_index: get, [], in, len, items in file order.
+    get_title(lang, title) is the same as get(lang + "_" + title). Forked workers share the mapping of the parent.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._open()
+
+    def _open(self):
+        with open(self.index_path, "rb") as file:
+            header = _read_header(file)
+            if header is None:
+                raise ValueError("Not a title index for this machine: {}".format(self.index_path))
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (_, _, _, _, n_entries, self._n_used, n_others, n_buckets,
+         self._keys_start, key_ends_start, codes_start, others_start, other_ends_start, buckets_start) = header
+        self._view = view = memoryview(self._mmap)
+        self._key_ends = view[key_ends_start:key_ends_start + 8 * (n_entries + 1)].cast("q")
+        self._codes = view[codes_start:codes_start + 8 * n_entries].cast("q")
+        self._others_start = others_start
+        self._other_ends = view[other_ends_start:other_ends_start + 8 * (n_others + 1)].cast("q")
+        self._buckets = view[buckets_start:buckets_start + 4 * n_buckets].cast("I")
+        self._mask = n_buckets - 1
+
+    def close(self):
+        if self._mmap is not None:
+            # the views have to be released before the mmap can be closed
+            for view in (self._key_ends, self._codes, self._other_ends, self._buckets, self._view):
+                view.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __getstate__(self):
+        # e.g. for the workers of a spawned Pool: the index is opened again, and mapped to the same pages
+        return {"index_path": self.index_path}
+
+    def __setstate__(self, state):
+        self.index_path = state["index_path"]
+        self._open()
+
+    def __len__(self):
+        return self._n_used
+
+    def __iter__(self):
+        for entry in range(len(self._codes)):
+            if self._codes[entry] != UNUSED_CODE:
+                yield self._key(entry)
+
+    def items(self):
+        for entry in range(len(self._codes)):
+            code = self._codes[entry]
+            if code != UNUSED_CODE:
+                yield self._key(entry), self._decode(code)
+
+    def __getitem__(self, key):
+        entry = self._find(key)
+        if entry < 0:
+            raise KeyError(key)
+        return self._decode(self._codes[entry])
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def get(self, key, default=None):
+        entry = self._find(key)
+        if entry < 0:
+            return default
+        return self._decode(self._codes[entry])
+
+    def get_title(self, lang, title, default=None):
+        return self.get(lang + "_" + title, default)
+
+    def _key(self, entry):
+        return _slice(self._mmap, self._keys_start, self._key_ends, entry).decode("utf-8")
+
+    def _decode(self, code):
+        if code & 3 == OTHER_ID_KIND:
+            return _slice(self._mmap, self._others_start, self._other_ends, code >> 2).decode("utf-8")
+        return code_to_id(code)
+
+    def _find(self, key):
+        if not isinstance(key, str):
+            return -1
+        key_bytes = key.encode("utf-8")
+        # hot loop of the lookups, cf. _slice
+        data, start, ends, buckets, mask = self._mmap, self._keys_start, self._key_ends, self._buckets, self._mask
+        bucket = _hash(key_bytes) & mask
+        while True:
+            entry = buckets[bucket] - 1
+            if entry < 0:
+                return -1
+            if data[start + ends[entry]:start + ends[entry + 1]] == key_bytes:
+                return entry
+            bucket = (bucket + 1) & mask
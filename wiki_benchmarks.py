@@ -0,0 +1,362 @@
+# coding: utf-8
+"""Benchmarks of the hot loops of the Wikidata and Wikipedia processing, on a sample of a dump.
+
+Example: python wiki_benchmarks.py wikidata_filter ./data/wikidata-20210301-all.json.bz2 -n 100000
+         python wiki_benchmarks.py wp_links ./data/enwiki-20210301-pages-articles-multistream.xml.bz2 -n 1000000
+         python wiki_benchmarks.py clean_text ./data/enwiki-20210301-pages-articles-multistream.xml.bz2 -n 10000000
+         python wiki_benchmarks.py many_refs ./data/enwiki-20210301-pages-articles-multistream.xml.bz2 -n 100000
+         python wiki_benchmarks.py remove_links ./data/enwiki-20210301-pages-articles-multistream.xml.bz2 -n 1000000
+
+"""
+from __future__ import unicode_literals
+
+import bz2
+import logging
+import re
+import time
+from functools import partial
+
+import plac
+
+import dump_reader
+import wikidata_processor as wd
+import wikipedia_processor as wp
+from wiki_namespaces import get_namespace_matcher
+from wiki_segmenter import get_segmenter
+from wiki_io import LOG_FORMAT
+
+logger = logging.getLogger(__name__)
+
+
+def _read_lines(bz2_file, limit):
+    lines = []
+    with bz2.open(bz2_file, mode="rb") as file:
+        for line in file:
+            if len(lines) >= limit:
+                break
+            lines.append(line)
+    return lines
+
+
+def _time_lines(lines, line_fn):
+    start = time.perf_counter()
+    for line in lines:
+        line_fn(line)
+    return time.perf_counter() - start
+
+
+def benchmark_wikidata_filter(input_file, limit):
+    """ Lines/sec of the parsing of the Wikidata dump, with and without the pre-filter, for each JSON backend """
+    lines = _read_lines(input_file, limit)
+    lang = ['ja', 'de', 'es', 'ar', 'sr', 'tr', 'fa', 'ta', 'en', 'fr', 'it']
+    entity_filter = wd.EntityFilter()
+    print("{} lines, {:.1f} MB".format(len(lines), sum(len(line) for line in lines) / 1e6))
+    for backend in wd.JSON_BACKENDS:
+        try:
+            wd.set_json_backend(backend)
+        except ImportError:
+            print("{:>10}: not installed".format(backend))
+            continue
+        for require_sitelinks in (False, True):
+            sitelink_markers = wd._get_sitelink_markers(lang) if require_sitelinks else None
+            all_results = []
+            for line_filter in (None, partial(wd._may_keep_line, sitelink_markers=sitelink_markers)):
+                results = (dict(), dict(), dict(), dict())
+                parse_args = (lang, True, entity_filter, line_filter, require_sitelinks)
+                seconds = _time_lines(lines, lambda line: wd._parse_entity_line(line, results, *parse_args))
+                all_results.append(results)
+                print("{:>10}, {:>13}{}: {:>9.0f} lines/sec, {} entities kept".format(
+                    backend,
+                    "pre-filter" if line_filter else "no pre-filter",
+                    ", require_sitelinks" if require_sitelinks else "",
+                    len(lines) / seconds,
+                    len(results[1]),
+                ))
+            if all_results[0] != all_results[1]:
+                print("{:>10}: the pre-filter changes the results!".format(backend))
+    wd.set_json_backend()
+
+
+def _reference_wp_links(text, namespaces):
+    # get_wp_links as it was before iter_wp_links, for the comparison of the results
+    aliases = []
+    entities = []
+    normalizations = []
+    for match in wp.link_regex.findall(text):
+        match = match[2:][:-2].replace("_", " ").strip()
+        if namespaces.is_meta(match):
+            pass
+        elif "|" not in match:
+            aliases.append(match)
+            entities.append(match)
+            normalizations.append(True)
+        else:
+            splits = match.split("|")
+            entity = splits[0].strip()
+            alias = splits[1].strip()
+            if len(alias) == 0 and "(" in entity:
+                alias = entity.split("(")[0]
+            aliases.append(alias)
+            entities.append(entity)
+            normalizations.append(False)
+    return aliases, entities, normalizations
+
+
+def benchmark_wp_links(input_file, limit):
+    """ Lines/sec of the link extraction of the prior probabilities, on the lines of a Wikipedia dump """
+    lines = [line.decode("utf-8") for line in _read_lines(input_file, limit)]
+    namespaces = get_namespace_matcher(wp._get_lang(input_file))
+    print("{} lines, {:.1f} MB, {:.1%} with a link".format(
+        len(lines), sum(len(line) for line in lines) / 1e6, sum("[[" in line for line in lines) / max(1, len(lines))
+    ))
+    results = []
+
+    def reference(line):
+        results.append(list(zip(*_reference_wp_links(line.strip(), namespaces))))
+
+    def lists(line):
+        results.append(list(zip(*wp.get_wp_links(line.strip(), namespaces))))
+
+    def scanner(line):
+        if "[[" in line:
+            results.append(list(wp.iter_wp_links(line.strip(), namespaces)))
+        else:
+            results.append([])
+
+    all_results = []
+    for name, line_fn in (("reference", reference), ("get_wp_links", lists), ("iter_wp_links", scanner)):
+        results = []
+        seconds = _time_lines(lines, line_fn)
+        all_results.append(results)
+        print("{:>13}: {:>9.0f} lines/sec, {} links".format(name, len(lines) / seconds, sum(map(len, results))))
+    if any(results != all_results[0] for results in all_results[1:]):
+        print("The link extraction changes the results!")
+
+
+def _reference_clean_wp_text(article_text, namespaces):
+    # wikipedia_processor._get_clean_wp_text with the repeated full-string replaces, for the comparison of the results
+    clean_text = article_text.strip()
+    clean_text = wp.html_regex.sub("", clean_text)
+    clean_text = namespaces.remove_category_and_file_links(clean_text)
+    while "==" in clean_text:
+        clean_text = clean_text.replace("==", "=")
+    clean_text = clean_text.replace(". =", ".")
+    clean_text = clean_text.replace(" = ", ". ")
+    clean_text = clean_text.replace("= ", ".")
+    clean_text = clean_text.replace(" =", "")
+    clean_text = wp.ref_regex.sub("", clean_text)
+    clean_text = wp.ref_2_regex.sub("", clean_text)
+    clean_text = re.sub(r"&lt;blockquote&gt;", "", clean_text)
+    clean_text = re.sub(r"&lt;/blockquote&gt;", "", clean_text)
+    clean_text = clean_text.replace(r"&lt;", "<")
+    clean_text = clean_text.replace(r"&gt;", ">")
+    clean_text = clean_text.replace(r"&quot;", '"')
+    clean_text = clean_text.replace(r"&amp;nbsp;", " ")
+    clean_text = clean_text.replace(r"&amp;", "&")
+    while "  " in clean_text:
+        clean_text = clean_text.replace("  ", " ")
+    return clean_text.strip()
+
+
+def benchmark_clean_text(input_file, limit, n_pages=1000, n_buckets=5):
+    """ Time per article of the markup cleanup, on the n_pages longest pages of the sample, by page length """
+    namespaces = get_namespace_matcher(wp._get_lang(input_file))
+    pages = [
+        " ".join(line.strip() for line in text.split("\n"))
+        for _, _, _, text in dump_reader.pages_from(_read_lines(input_file, limit))
+    ]
+    pages = sorted(pages, key=len)[-n_pages:]
+    print("{} pages of {:.1f} to {:.1f} KB".format(len(pages), len(pages[0]) / 1e3, len(pages[-1]) / 1e3))
+    results = dict()
+    timings = dict()
+    for name, clean_fn in (
+        ("reference", _reference_clean_wp_text), ("_get_clean_wp_text", wp._get_clean_wp_text)
+    ):
+        results[name] = []
+        timings[name] = []
+        for text in pages:
+            start = time.perf_counter()
+            results[name].append(clean_fn(text, namespaces))
+            timings[name].append(time.perf_counter() - start)
+    # the time per KB stays flat with the length for a linear cleanup
+    bucket_size = max(1, len(pages) // n_buckets)
+    for start in range(0, len(pages), bucket_size):
+        kb = sum(len(text) for text in pages[start:start + bucket_size]) / 1e3
+        print("{:>9.1f} KB/page: {}".format(
+            kb / len(pages[start:start + bucket_size]),
+            ", ".join(
+                "{} {:.1f} us/KB".format(name, sum(seconds[start:start + bucket_size]) * 1e6 / kb)
+                for name, seconds in timings.items()
+            ),
+        ))
+    if results["reference"] != results["_get_clean_wp_text"]:
+        print("The cleanup changes the results!")
+
+
+def _reference_drop_spans(spans, text):
+    # others.dropSpans with the string concatenation, before others.applyEdits
+    spans.sort()
+    res = ''
+    offset = 0
+    for s, e in spans:
+        if offset <= s:
+            if offset < s:
+                res += text[offset:s]
+            offset = e
+    res += text[offset:]
+    return res
+
+
+def _reference_expand_placeholders(text):
+    # others.expandPlaceholders with a full-string replace per tag
+    for pattern, placeholder in wp.placeholder_tag_patterns:
+        index = 1
+        for match in pattern.finditer(text):
+            text = text.replace(match.group(), '%s_%d' % (placeholder, index))
+            index += 1
+    return text
+
+
+def benchmark_many_refs(input_file, limit, n_refs=(1000, 2000, 4000, 8000, 16000)):
+    """ Time per ref of the markup cleanup, on pages made of the sample text with thousands of refs """
+    words = " ".join(
+        text for _, _, _, text in dump_reader.pages_from(_read_lines(input_file, limit))
+    ).split()
+    ref = '<ref name="r{0}">{{{{cite web|url=http://example.org/{0}}}}} [http://example.org/{0} source]</ref> <math>x_{0}</math>'
+    for n in n_refs:
+        page = " ".join(
+            "{} {}".format(" ".join(words[i * 20 % len(words):][:20]), ref.format(i)) for i in range(n)
+        )
+        spans = [(m.start(), m.end()) for m in re.finditer(r"<ref[^>]*>|</ref>", page)]
+        timings = dict()
+        for name, fn in (
+            ("clean", wp.clean),
+            ("_reference_drop_spans", partial(_reference_drop_spans, list(spans))),
+            ("dropSpans", partial(wp.dropSpans, list(spans))),
+            ("_reference_expand_placeholders", _reference_expand_placeholders),
+            ("expandPlaceholders", wp.expandPlaceholders),
+        ):
+            start = time.perf_counter()
+            fn(page)
+            timings[name] = time.perf_counter() - start
+        # the time per ref stays flat with the number of refs for a linear rewriting
+        print("{:>6} refs, {:>7.1f} KB: {}".format(
+            n, len(page) / 1e3, ", ".join("{} {:.2f} us/ref".format(name, seconds * 1e6 / n) for name, seconds in timings.items()),
+        ))
+
+
+def _reference_remove_links(clean_text, wp_to_id, lang, segmenter):
+    # wikipedia_processor._remove_links reading the sentences char by char, for the comparison of the results
+    entities = []
+    final_texts = []
+    open_read = 0
+    reading_text = True
+    reading_entity = False
+    reading_mention = False
+    reading_special_case = False
+    entity_buffer = ""
+    mention_buffer = ""
+    for sentence in segmenter.sentences(clean_text):
+        entity = []
+        final_text = ""
+        for letter in sentence:
+            if letter == "[":
+                open_read += 1
+            elif letter == "]":
+                open_read -= 1
+            elif letter == "|":
+                if reading_text:
+                    final_text += letter
+                elif reading_entity:
+                    reading_text = False
+                    reading_entity = False
+                    reading_mention = True
+                else:
+                    reading_special_case = True
+            elif reading_entity:
+                entity_buffer += letter
+            elif reading_mention:
+                mention_buffer += letter
+            else:
+                final_text += letter
+            if open_read > 2:
+                reading_special_case = True
+            if open_read == 2 and reading_text:
+                reading_text = False
+                reading_entity = True
+                reading_mention = False
+            if open_read == 0 and not reading_text:
+                if "#" in entity_buffer or entity_buffer.startswith(":"):
+                    reading_special_case = True
+                if not reading_special_case:
+                    if not mention_buffer:
+                        mention_buffer = entity_buffer
+                    start = len(final_text)
+                    end = start + len(mention_buffer)
+                    qid = wp_to_id.get(lang + "_" + entity_buffer, None)
+                    if qid:
+                        entity.append((mention_buffer, qid, start, end))
+                    final_text += mention_buffer
+                entity_buffer = ""
+                mention_buffer = ""
+                reading_text = True
+                reading_entity = False
+                reading_mention = False
+                reading_special_case = False
+        if len(final_text) == 0:
+            continue
+        final_texts.append(final_text)
+        entities.append(entity)
+    return final_texts, entities
+
+
+def benchmark_remove_links(input_file, limit, segmenter="rules"):
+    """ Time per MB of the link stripping of the gold entities, on the cleaned pages of the sample """
+    lang = wp._get_lang(input_file)
+    namespaces = get_namespace_matcher(lang)
+    segmenter = get_segmenter(lang, segmenter)
+    texts = [
+        wp.clean(wp._get_clean_wp_text(" ".join(line.strip() for line in text.split("\n")), namespaces))
+        for _, _, _, text in dump_reader.pages_from(_read_lines(input_file, limit))
+    ]
+    # every link of the sample is a known entity
+    wp_to_id = dict()
+    for text in texts:
+        for alias, entity, norm in wp.iter_wp_links(text, namespaces):
+            wp_to_id.setdefault(lang + "_" + entity, "Q{}".format(len(wp_to_id)))
+    mb = sum(len(text) for text in texts) / 1e6
+    print("{} pages, {:.1f} MB of text".format(len(texts), mb))
+    start = time.perf_counter()
+    for text in texts:
+        segmenter.sentences(text)
+    print("{:>23}: {:.3f} s/MB".format("sentences", (time.perf_counter() - start) / mb))
+    results = dict()
+    for name, remove_fn in (("reference", _reference_remove_links), ("_remove_links", wp._remove_links)):
+        start = time.perf_counter()
+        results[name] = [remove_fn(text, wp_to_id, lang, segmenter) for text in texts]
+        print("{:>23}: {:.3f} s/MB, with the sentences".format(name, (time.perf_counter() - start) / mb))
+    if results["reference"] != results["_remove_links"]:
+        print("The link stripping changes the results!")
+
+
+BENCHMARKS = {
+    "wikidata_filter": benchmark_wikidata_filter,
+    "wp_links": benchmark_wp_links,
+    "clean_text": benchmark_clean_text,
+    "many_refs": benchmark_many_refs,
+    "remove_links": benchmark_remove_links,
+}
+
+
+@plac.annotations(
+    benchmark=("Benchmark to run", "positional", None, str, sorted(BENCHMARKS)),
+    input_file=("Location of the dump to sample", "positional", None, str),
+    limit=("Number of lines of the dump to sample (default 100000)", "option", "n", int),
+)
+def main(benchmark, input_file, limit=100000):
+    BENCHMARKS[benchmark](input_file, limit)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    plac.call(main)
@@ -1,8 +1,18 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import os
 import sys
 import csv
+import json
+import logging
+
+import binary_table
+from binary_table import BinaryTableWriter, is_binary_table
+from compact_maps import CompactTitleToId, CompactDescriptions
+from title_index import TitleIndex, is_fresh, write_title_index
+from checkpoint import file_size, truncate_file
+from sharded_output import MANIFEST_SUFFIX, open_shard, read_manifest
 
 TRAINING_DATA_FILE = "gold_entities.jsonl"
 KB_FILE = "kb"
@@ -15,112 +25,358 @@ ENTITY_PROPER_PATH = "entity_proper.csv"
 ENTITY_FREQ_PATH = "entity_freq.csv"
 ENTITY_ALIAS_PATH = "entity_alias.csv"
 ENTITY_DESCR_PATH = "entity_descriptions.csv"
+# index of ENTITY_DEFS_PATH, next to it, cf. title_index
+TITLE_INDEX_SUFFIX = ".idx"
+# checkpoints of the passes over the dumps, cf. checkpoint
+WIKIDATA_CHECKPOINT_PATH = "wikidata_checkpoint.json"
+PRIOR_PROB_CHECKPOINT_PATH = "prior_prob_checkpoint.json"
+TRAINING_CHECKPOINT_PATH = "gold_entities_checkpoint.json"
+# hashes of the inputs and outputs of the steps of wikidata_pipeline
+PIPELINE_STATE_PATH = "pipeline_state.json"
+
+# (name, type) of the columns of each intermediate file, cf. binary_table for the types
+TITLE_TO_ID_COLUMNS = [("WP_title", "str"), ("WD_id", "id")]
+ID_TO_ALIAS_COLUMNS = [("WD_id", "id"), ("lang", "cat"), ("alias", "str")]
+ID_TO_DESCR_COLUMNS = [("WD_id", "id"), ("lang", "cat"), ("description", "str")]
+ID_TO_PROPER_COLUMNS = [("WD_id", "id"), ("proper", "cat"), ("WD_id", "id")]
+ENTITY_TO_COUNT_COLUMNS = [("entity", "str"), ("count", "int")]
+PRIOR_PROB_COLUMNS = [("alias", "str"), ("count", "int"), ("entity", "str")]
 
 LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
 
+logger = logging.getLogger(__name__)
+
 # min() needed to prevent error on windows, cf https://stackoverflow.com/questions/52404416/
 csv.field_size_limit(min(sys.maxsize, 2147483646))
 
 """ This class provides reading/writing methods for temp files """
 
 
+class _TextTableWriter(object):
+    """ Write rows to a |-separated text file, with the names of the columns as header """
+
+    def __init__(self, path, columns, position=None):
+        # with a position returned by flush, append to the file truncated to that position
+        if position is None:
+            self.file = open(path, "w", encoding="utf8")
+            self.file.write("|".join(name for name, column_type in columns) + "\n")
+        else:
+            truncate_file(path, position)
+            self.file = open(path, "a", encoding="utf8")
+
+    def write_row(self, *values):
+        self.file.write("|".join(map(str, values)) + "\n")
+
+    def flush(self):
+        return file_size(self.file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _open_table_writer(path, columns, binary=False, position=None):
+    if binary:
+        return BinaryTableWriter(path, columns, position)
+    return _TextTableWriter(path, columns, position)
+
+
+def _iter_table_rows(path):
+    """ The rows of a file written by this module, in the text or the binary format """
+    if is_binary_table(path):
+        return binary_table.iter_rows(path)
+    return _iter_text_rows(path)
+
+
+def _iter_text_rows(path):
+    with open(path, "r", encoding="utf8") as file:
+        csvreader = csv.reader(file, delimiter="|")
+        # skip header
+        next(csvreader, None)
+        for row in csvreader:
+            yield row
+
+
 # Entity definition: WP title -> WD ID #
 ##多个语言的title：id
-def write_title_to_id(entity_def_output, title_to_id):
-    with open(entity_def_output,"w", encoding="utf8") as id_file:
-        id_file.write("WP_title" + "|" + "WD_id" + "\n")
+def write_title_to_id(entity_def_output, title_to_id, binary=False):
+    with _open_table_writer(entity_def_output, TITLE_TO_ID_COLUMNS, binary) as writer:
         for title, qid in title_to_id.items():
-            id_file.write(title + "|" + str(qid) + "\n")
+            _write_title_to_id(writer, title, qid)
 
 
-def read_title_to_id(entity_def_output):
-    title_to_id = dict()
-    with open(entity_def_output, "r", encoding="utf8") as id_file:
-        csvreader = csv.reader(id_file, delimiter="|")
-        # skip header
-        next(csvreader)
-        for row in csvreader:
-            title_to_id[row[0]] = row[1]
+def _write_title_to_id(writer, title, qid):
+    writer.write_row(title, str(qid))
+
+
+def read_title_to_id(entity_def_output, compact=False, index=False):
+    # compact=True reads into an array-backed dict, cf. compact_maps
+    if index:
+        return read_title_index(entity_def_output)
+    title_to_id = CompactTitleToId() if compact else dict()
+    for row in _iter_table_rows(entity_def_output):
+        title_to_id[row[0]] = row[1]
     return title_to_id
 
 
+def read_title_index(entity_def_output):
+    """
+    A read-only, memory-mapped view of the entity definitions, cf. title_index,
+    built next to the file the first time, and again whenever the file changes.
+    """
+    index_path = entity_def_output + TITLE_INDEX_SUFFIX
+    if not is_fresh(index_path, entity_def_output):
+        logger.info("Building the title index {}".format(index_path))
+        rows = ((row[0], row[1]) for row in _iter_table_rows(entity_def_output))
+        write_title_index(index_path, rows, entity_def_output)
+    return TitleIndex(index_path)
+
+
 # Entity aliases from WD: WD ID -> WD alias #
-def write_id_to_alias(entity_alias_path, id_to_alias):
-    with open(entity_alias_path,"w", encoding="utf8") as alias_file:
-        alias_file.write("WD_id" + "|" + 'lang' + "|" + "alias" + "\n")
+def write_id_to_alias(entity_alias_path, id_to_alias, binary=False):
+    with _open_table_writer(entity_alias_path, ID_TO_ALIAS_COLUMNS, binary) as writer:
         for qid, alias_dict in id_to_alias.items():
-            for lang, alias_list in alias_dict.items():
-                for alias in alias_list:
-                    alias_file.write(str(qid) + "|" + lang + "|" +alias + "\n")
+            _write_id_to_alias(writer, qid, alias_dict)
+
+
+def _write_id_to_alias(writer, qid, alias_dict):
+    for lang, alias_list in alias_dict.items():
+        for alias in alias_list:
+            writer.write_row(str(qid), lang, alias)
 
 
 def read_id_to_alias(entity_alias_path):
     id_to_alias = dict()
-    with entity_alias_path.open("r", encoding="utf8") as alias_file:
-        csvreader = csv.reader(alias_file, delimiter="|")
-        # skip header
-        next(csvreader)
-        for row in csvreader:
-            qid = row[0]
-            alias = row[1]
-            alias_list = id_to_alias.get(qid, [])
-            alias_list.append(alias)
-            id_to_alias[qid] = alias_list
+    for row in _iter_table_rows(entity_alias_path):
+        qid = row[0]
+        alias = row[1]
+        alias_list = id_to_alias.get(qid, [])
+        alias_list.append(alias)
+        id_to_alias[qid] = alias_list
     return id_to_alias
 
 
 def read_alias_to_id_generator(entity_alias_path):
     """ Read (aliases, qid) tuples """
 
-    with entity_alias_path.open("r", encoding="utf8") as alias_file:
-        csvreader = csv.reader(alias_file, delimiter="|")
-        # skip header
-        next(csvreader)
-        for row in csvreader:
-            qid = row[0]
-            alias = row[1]
-            yield alias, qid
+    for row in _iter_table_rows(entity_alias_path):
+        qid = row[0]
+        alias = row[1]
+        yield alias, qid
 
 
 # Entity descriptions from WD: WD ID -> WD alias #
-def write_id_to_descr(entity_descr_output, id_to_descr):
-    with open(entity_descr_output, "w", encoding="utf8") as descr_file:
-        descr_file.write("WD_id" + "|" + 'lang'+'|'+ "description" + "\n")
+def write_id_to_descr(entity_descr_output, id_to_descr, binary=False):
+    with _open_table_writer(entity_descr_output, ID_TO_DESCR_COLUMNS, binary) as writer:
         for qid, descr_dict in id_to_descr.items():
-            for lang,descr in descr_dict.items():
-                descr_file.write(str(qid) + "|" + lang + '|' + descr + "\n")
+            _write_id_to_descr(writer, qid, descr_dict)
 
 
-def write_id_to_proper(entity_proper_output, id_to_proper):
-    with open(entity_proper_output, "w", encoding="utf8") as proper_file:
-        proper_file.write("WD_id" + "|" + 'proper' + '|'+ "WD_id" + "\n")
-        for qid, proper_list in id_to_proper.items():
-            for tuple in proper_list:
-                proper = tuple[0]
-                ids = tuple[1]
-                for id in ids:
-                    proper_file.write(str(qid) + "|" + proper + '|' + id + "\n")
+def _write_id_to_descr(writer, qid, descr_dict):
+    for lang,descr in descr_dict.items():
+        writer.write_row(str(qid), lang, descr)
 
 
-def read_id_to_descr(entity_desc_path):
+def write_id_to_proper(entity_proper_output, id_to_proper, binary=False):
+    with _open_table_writer(entity_proper_output, ID_TO_PROPER_COLUMNS, binary) as writer:
+        for qid, proper_list in id_to_proper.items():
+            _write_id_to_proper(writer, qid, proper_list)
+
+
+def _write_id_to_proper(writer, qid, proper_list):
+    for tuple in proper_list:
+        proper = tuple[0]
+        ids = tuple[1]
+        for id in ids:
+            writer.write_row(str(qid), proper, id)
+
+
+class _MapWriter(object):
+    """
+    Write-only stand-in for one of the maps of wikidata_processor.read_wikidata_entities_json:
+    each value is written to file as soon as it is set, instead of being kept in memory.
+    Without a path, the values are discarded.
+    """
+
+    def __init__(self, path, columns, write_fn, binary=False, position=None):
+        self.write_fn = write_fn
+        self.writer = None
+        if path is not None:
+            self.writer = _open_table_writer(path, columns, binary, position)
+
+    def __contains__(self, key):
+        return False
+
+    def get(self, key, default=None):
+        return default
+
+    def __setitem__(self, key, value):
+        if self.writer is not None:
+            self.write_fn(self.writer, key, value)
+
+    def flush(self):
+        if self.writer is not None:
+            return self.writer.flush()
+        return None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class EntityWriter(object):
+    """
+    Streams the entities of the Wikidata dump to the files of write_title_to_id, write_id_to_descr,
+    write_id_to_alias and write_id_to_proper, as they are parsed, cf. read_wikidata_entities_json(writer=...).
+    The files are the same as when writing the maps at the end, as long as every entity id is seen only once.
+    With the positions returned by flush() at a checkpoint, the writer continues the files from these positions.
+    """
+
+    def __init__(
+        self, entity_def_output, entity_alias_output, entity_descr_output, entity_proper_output, binary=False,
+        positions=None
+    ):
+        if positions is None:
+            positions = [None] * 4
+        self.title_to_id = _MapWriter(
+            entity_def_output, TITLE_TO_ID_COLUMNS, _write_title_to_id, binary, positions[0]
+        )
+        self.id_to_descr = _MapWriter(
+            entity_descr_output, ID_TO_DESCR_COLUMNS, _write_id_to_descr, binary, positions[1]
+        )
+        self.id_to_alias = _MapWriter(
+            entity_alias_output, ID_TO_ALIAS_COLUMNS, _write_id_to_alias, binary, positions[2]
+        )
+        self.id_to_proper = _MapWriter(
+            entity_proper_output, ID_TO_PROPER_COLUMNS, _write_id_to_proper, binary, positions[3]
+        )
+
+    @property
+    def maps(self):
+        return self.title_to_id, self.id_to_descr, self.id_to_alias, self.id_to_proper
+
+    def flush(self):
+        """ The positions of the writers (JSON), in the order of maps """
+        return [map_writer.flush() for map_writer in self.maps]
+
+    def close(self):
+        for map_writer in self.maps:
+            map_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def patch_entity_files(entity_paths, output_paths, changed_ids, maps):
+    """
+    Incremental update of the files of EntityWriter (defs, alias, descr, proper), cf. wikidata_update.py:
+    the rows of the changed_ids are dropped, and the maps of their new versions are written at the end.
+    The definitions of the titles in the new title_to_id are dropped too, as a title can only have one id.
+    The output files have the format of the input files, and can be the input files themselves.
+    A path is None when the file isn't updated (e.g. the descriptions with descr_from_wp).
+    """
+    title_to_id, id_to_descr, id_to_alias, id_to_proper = maps
+    tables = [
+        (TITLE_TO_ID_COLUMNS, _write_title_to_id, title_to_id,
+         lambda row: row[-1] in changed_ids or "|".join(row[:-1]) in title_to_id),
+        (ID_TO_ALIAS_COLUMNS, _write_id_to_alias, id_to_alias, lambda row: row[0] in changed_ids),
+        (ID_TO_DESCR_COLUMNS, _write_id_to_descr, id_to_descr, lambda row: row[0] in changed_ids),
+        (ID_TO_PROPER_COLUMNS, _write_id_to_proper, id_to_proper, lambda row: row[0] in changed_ids),
+    ]
+    for entity_path, output_path, (columns, write_fn, new_map, skip_row) in zip(entity_paths, output_paths, tables):
+        if entity_path is None or output_path is None:
+            continue
+        logger.info("Updating {} to {}".format(entity_path, output_path))
+        n_dropped = _patch_table(entity_path, output_path, columns, write_fn, new_map, skip_row)
+        logger.info("Dropped {} rows, added {} entries".format(n_dropped, len(new_map)))
+
+
+def _patch_table(input_path, output_path, columns, write_fn, new_map, skip_row):
+    # written next to the output first, so that the input can be patched in place
+    tmp_path = output_path + ".tmp"
+    n_dropped = 0
+    if is_binary_table(input_path):
+        with BinaryTableWriter(tmp_path, columns) as writer:
+            for row in binary_table.iter_rows(input_path):
+                if skip_row(row):
+                    n_dropped += 1
+                else:
+                    writer.write_row(*row)
+            for key, value in new_map.items():
+                write_fn(writer, key, value)
+    else:
+        with open(input_path, "r", encoding="utf8") as input_file, _TextTableWriter(tmp_path, columns) as writer:
+            # skip header
+            next(input_file, None)
+            # the lines are copied as they are, going through csv and back could change their quotes
+            for line in input_file:
+                if skip_row(line.rstrip("\n").split("|")):
+                    n_dropped += 1
+                else:
+                    writer.file.write(line)
+            for key, value in new_map.items():
+                write_fn(writer, key, value)
+    os.replace(tmp_path, output_path)
+    return n_dropped
+
+
+def read_id_to_descr(entity_desc_path, compact=False):
+    if compact:
+        return _read_id_to_descr_compact(entity_desc_path)
     id_to_desc = dict()
-    with open(entity_desc_path, "r", encoding="utf8") as descr_file:
-        csvreader = csv.reader(descr_file, delimiter="|")
-        # skip header
-        next(csvreader)
-        for row in csvreader:
-            if row[0] not in id_to_desc:
-                id_to_desc[row[0]] = {}
-            id_to_desc[row[0]][row[1]] = row[2]
+    for row in _iter_table_rows(entity_desc_path):
+        if row[0] not in id_to_desc:
+            id_to_desc[row[0]] = {}
+        id_to_desc[row[0]][row[1]] = row[2]
     return id_to_desc
 
 
-# Entity counts from WP: WP title -> count #
-def write_entity_to_count(prior_prob_input, count_output):
-    # Write entity counts for quick access later
-    entity_to_count = dict()
-    total_count = 0
+def _read_id_to_descr_compact(entity_desc_path):
+    # the compact values are copies, so the descriptions of an entity are collected before they're stored.
+    # they're written consecutively, cf. write_id_to_descr
+    id_to_desc = CompactDescriptions()
+    qid = None
+    descr_dict = {}
+    for row in _iter_table_rows(entity_desc_path):
+        if row[0] != qid:
+            if qid is not None:
+                id_to_desc[qid] = descr_dict
+            qid = row[0]
+            descr_dict = id_to_desc.get(qid, {})
+        descr_dict[row[1]] = row[2]
+    if qid is not None:
+        id_to_desc[qid] = descr_dict
+    return id_to_desc
 
+
+# Prior probabilities from WP: alias -> entity counts #
+def write_prior_probs(prior_prob_output, alias_entity_counts, binary=False):
+    """ Write the [(entity, count)] of every alias, given as (alias, [(entity, count), ...]) sorted by alias """
+    with _open_table_writer(prior_prob_output, PRIOR_PROB_COLUMNS, binary) as writer:
+        ##alias->entity:count，一个alias可能对应着多个实体，因此有多个count
+        for alias, entity_counts in alias_entity_counts:
+            for entity, count in entity_counts:
+                writer.write_row(alias, count, entity)
+
+
+def read_prior_probs(prior_prob_input):
+    """ Read (alias, count, entity) tuples, sorted by alias, and then by count """
+    if is_binary_table(prior_prob_input):
+        for row in binary_table.iter_rows(prior_prob_input):
+            yield row
+        return
+    # not read with csv: the aliases may contain quotes
     with open(prior_prob_input, "r", encoding="utf8") as prior_file:
         # skip header
         prior_file.readline()
@@ -128,30 +384,60 @@ def write_entity_to_count(prior_prob_input, count_output):
 
         while line:
             splits = line.replace("\n", "").split(sep="|")
-            # alias = splits[0]
-            count = int(splits[1])
-            entity = splits[2]
+            yield splits[0], int(splits[1]), splits[2]
+            line = prior_file.readline()
 
-            current_count = entity_to_count.get(entity, 0)
-            entity_to_count[entity] = current_count + count
 
-            total_count += count
+# Entity counts from WP: WP title -> count #
+def write_entity_to_count(prior_prob_input, count_output, binary=False):
+    # Write entity counts for quick access later
+    entity_to_count = dict()
+    total_count = 0
+
+    for alias, count, entity in read_prior_probs(prior_prob_input):
+        current_count = entity_to_count.get(entity, 0)
+        entity_to_count[entity] = current_count + count
 
-            line = prior_file.readline()
+        total_count += count
 
-    with open(count_output, "w", encoding="utf8") as entity_file:
-        entity_file.write("entity" + "|" + "count" + "\n")
+    with _open_table_writer(count_output, ENTITY_TO_COUNT_COLUMNS, binary) as writer:
         for entity, count in entity_to_count.items():
-            entity_file.write(entity + "|" + str(count) + "\n")
+            writer.write_row(entity, count)
 
 
 def read_entity_to_count(count_input):
     entity_to_count = dict()
-    with open(count_input, "r", encoding="utf8") as csvfile:
-        csvreader = csv.reader(csvfile, delimiter="|")
-        # skip header
-        next(csvreader)
-        for row in csvreader:
-            entity_to_count[row[0]] = int(row[1])
+    for row in _iter_table_rows(count_input):
+        entity_to_count[row[0]] = int(row[1])
 
     return entity_to_count
+
+
+# Gold entities from WP, cf. wikipedia_processor.TrainingConsumer #
+def read_gold_entities(gold_path, expand=True):
+    """
+    Read the lines of gold_entities_<lang>.jsonl, written with one line per mention or with group_contexts,
+    or of its shards with the path of their manifest, cf. sharded_output.
+    With expand, a line of a context is expanded to a line per mention:
+    {article_id, article_title, context, entity, mention, start, end}
+    """
+    if gold_path.endswith(MANIFEST_SUFFIX):
+        for shard_path, _ in read_manifest(gold_path):
+            yield from read_gold_entities(shard_path, expand)
+        return
+    with open_shard(gold_path) as file:
+        for line in file:
+            example = json.loads(line)
+            if not expand or "mentions" not in example:
+                yield example
+                continue
+            for entity, mention, start, end in example["mentions"]:
+                yield {
+                    "article_id": example["article_id"],
+                    "article_title": example["article_title"],
+                    "context": example["context"],
+                    "entity": entity,
+                    "mention": mention,
+                    "start": start,
+                    "end": end,
+                }
@@ -1,6 +1,8 @@
 # coding: utf8
 from __future__ import unicode_literals
 
+import re
+
 # List of meta pages in Wikidata, should be kept out of the Knowledge base
 WD_META_ITEMS = [
     "Q163875",
@@ -126,3 +128,72 @@ WP_META_NAMESPACE = (
         "WP",
     ]
 )
+
+# keys of the <namespace> elements of the <siteinfo> header of a dump
+FILE_NAMESPACE_KEY = 6
+CATEGORY_NAMESPACE_KEY = 14
+
+# [[prefix:...]] link with (one level of) nested links, e.g. [[File:x.jpg|a [[b]]]], cf. NamespaceMatcher
+prefixed_link_pattern = r"\[\[(?:{}):[^\[\]]*(\[\[[^\[\]]*\]\])*[^\[\]]*\]\]"
+
+# NamespaceMatcher of each language, cf. get_namespace_matcher
+_namespace_matchers = dict()
+
+
+class NamespaceMatcher(object):
+    """
+    Namespaces of the dump of one language, from the {key: name} of its <siteinfo> header on top of the
+    (mostly English) lists above. Titles and links are matched by a set lookup of the prefix before the colon,
+    the category and file links by a regex of the few names of these namespaces.
+    """
+
+    def __init__(self, namespaces=None):
+        self.namespaces = dict(namespaces or {})
+        names = set(self.namespaces.values())
+        # namespace names are case-insensitive
+        self.meta = {name.lower() for name in names.union(WP_META_NAMESPACE)}
+        files = list(WP_FILE_NAMESPACE)
+        categories = list(WP_CATEGORY_NAMESPACE)
+        if FILE_NAMESPACE_KEY in self.namespaces:
+            files.append(self.namespaces[FILE_NAMESPACE_KEY])
+        if CATEGORY_NAMESPACE_KEY in self.namespaces:
+            categories.append(self.namespaces[CATEGORY_NAMESPACE_KEY])
+        self.file_regex = _prefixed_link_regex(files)
+        self.category_regex = _prefixed_link_regex(categories)
+
+    def is_meta(self, title):
+        """ Whether a title or link (optionally starting with :) points to a meta page or to another language """
+        start = 1 if title.startswith(":") else 0
+        colon = title.find(":", start)
+        if colon < 0:
+            return False
+        prefix = title[start:colon]
+        # interwiki links, e.g. `en:` or `:fr:`
+        if len(prefix) == 2 and prefix.isascii() and prefix.isalpha():
+            return True
+        return prefix.lower() in self.meta
+
+    def remove_category_and_file_links(self, text):
+        """ Remove the [[Category:...]] links, and then the [[File:...]] links, with their nested links """
+        if "[[" not in text:
+            return text
+        return self.file_regex.sub("", self.category_regex.sub("", text))
+
+
+def _prefixed_link_regex(names):
+    # the few names of one namespace, the meta namespaces are looked up in a set instead
+    # re.escape leaves the spaces as they are, a space also matches an underscore in the links
+    alternatives = {"[ _]".join(re.escape(part) for part in name.split(" ")) for name in names}
+    alternatives = sorted(alternatives, key=len, reverse=True)
+    return re.compile(prefixed_link_pattern.format("|".join(alternatives)), re.IGNORECASE)
+
+
+def get_namespace_matcher(lang, namespaces=None):
+    """
+    The NamespaceMatcher of a language, built once from the namespaces of the <siteinfo> of its dump.
+    Without namespaces (e.g. for an unknown language), only the lists above are used.
+    """
+    matcher = _namespace_matchers.get(lang)
+    if matcher is None or (namespaces and not matcher.namespaces):
+        matcher = _namespace_matchers[lang] = NamespaceMatcher(namespaces)
+    return matcher
@@ -0,0 +1,81 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import re
+
+# backends of get_segmenter: polyglot, or rules (with CJK_LANGS split by characters)
+DEFAULT_SEGMENTER = "polyglot"
+
+# languages written without spaces between the words
+CJK_LANGS = {"ja", "zh"}
+
+# CJK punctuation, kana, Han and full-width forms
+CJK_CHARS = "\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef"
+
+# a sentence ends at . ! or ? before a space, with its closing quotes and brackets and the spaces after it
+sentence_regex = re.compile(r"""\S.*?(?:[.!?]+['"’”)\]]*(?=\s)|$)\s*""", re.S)
+word_regex = re.compile(r"\w+|[^\w\s]")
+
+# a sentence also ends at a full-width . ! or ? without a space after it
+cjk_sentence_regex = re.compile(
+    r"""\S.*?(?:[.!?]+['"’”)\]]*(?=\s)|[\u3002\uff01\uff1f]+[\u300d\u300f\uff09\u3015\u3011"’”)\]]*|$)\s*""", re.S
+)
+# each Han or kana character counts as a word
+cjk_word_regex = re.compile(r"[{0}]|[^\W{0}]+|[^\w\s{0}]".format(CJK_CHARS))
+
+# Segmenter of each backend and language, cf. get_segmenter
+_segmenters = dict()
+
+
+class PolyglotSegmenter(object):
+    """ Sentences and words of polyglot.text.Text, the language is detected from the text itself """
+
+    def __init__(self):
+        from polyglot.text import Text
+
+        self.text_class = Text
+
+    def sentences(self, text):
+        return [sentence.raw for sentence in self.text_class(text).sentences]
+
+    def count_words(self, text):
+        return len(self.text_class(text).words)
+
+
+class RuleSegmenter(object):
+    """
+    Sentences and words of the languages that are written with spaces, with a regex for each.
+    The sentences keep the spaces after them, so that they add up to the text.
+    """
+
+    def __init__(self, sentence_re=sentence_regex, word_re=word_regex):
+        self.sentence_re = sentence_re
+        self.word_re = word_re
+
+    def sentences(self, text):
+        return self.sentence_re.findall(text)
+
+    def count_words(self, text):
+        return sum(1 for _ in self.word_re.finditer(text))
+
+
+class CjkSegmenter(RuleSegmenter):
+    """ RuleSegmenter for CJK_LANGS: the sentences also end at 。 and the words are single characters """
+
+    def __init__(self):
+        super(CjkSegmenter, self).__init__(cjk_sentence_regex, cjk_word_regex)
+
+
+def get_segmenter(lang, backend=DEFAULT_SEGMENTER):
+    """ The segmenter of a language with a backend, polyglot or rules, built once """
+    key = backend, lang
+    segmenter = _segmenters.get(key)
+    if segmenter is None:
+        if backend == "polyglot":
+            segmenter = PolyglotSegmenter()
+        elif backend == "rules":
+            segmenter = CjkSegmenter() if lang in CJK_LANGS else RuleSegmenter()
+        else:
+            raise ValueError("Unknown segmenter {}, use polyglot or rules".format(backend))
+        _segmenters[key] = segmenter
+    return segmenter
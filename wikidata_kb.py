@@ -3,8 +3,8 @@
 with specific parameters. Intermediate files are written to disk.
 
 Running the full pipeline on a standard laptop, may take up to 13 hours of processing.
-Use the -p, -d and -s options to speed up processing using the intermediate files
-from a previous run.
+To reuse the intermediate files of a previous run, run the steps with wikidata_pipeline.py instead:
+it skips the steps whose inputs and parameters didn't change.
 
 For the Wikidata dump: get the latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
 For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
@@ -45,6 +45,7 @@ def main(
     limit_train=None,
     limit_wd=None,
     lang=None,
+    binary=False,
 ):
     entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
     entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
@@ -76,7 +77,7 @@ def main(
 
     # STEP 3: calculate entity frequencies
     logger.info("STEP 3: Calculating and writing entity frequencies to {}".format(entity_freq_path))
-    io.write_entity_to_count(prior_prob_path, entity_freq_path)
+    io.write_entity_to_count(prior_prob_path, entity_freq_path, binary)
 
 
 
@@ -0,0 +1,403 @@
+# coding: utf-8
+"""Script to run the whole pipeline of the wikidata_* scripts (STEP 2 to STEP 6) on Wikipedia and Wikidata dumps,
+and create a knowledge base (KB). Intermediate files are written to the output directory.
+
+Each step declares its input and output files. A step is skipped when the content of its inputs and outputs and
+its parameters didn't change since its last successful run (cf. PIPELINE_STATE_PATH in the output directory),
+e.g. after changing min_freq only the KB is created again. Independent steps (e.g. the Wikidata pass and the
+prior probabilities from Wikipedia) run at the same time, in separate processes.
+
+Example: python wikidata_pipeline.py ./data/wikidata-20210301-all.json.bz2 ./data/output
+             ./data/enwiki-20210301-pages-articles-multistream.xml.bz2 -m xx_ent_wiki_sm -n 8
+
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from multiprocessing.connection import wait
+
+import plac
+
+import wikipedia_processor as wp, wikidata_processor as wd
+import wiki_io as io
+from wiki_io import KB_FILE, ENTITY_DESCR_PATH, LOG_FORMAT, PIPELINE_STATE_PATH
+from wiki_io import ENTITY_FREQ_PATH, PRIOR_PROB_PATH, ENTITY_DEFS_PATH, ENTITY_ALIAS_PATH, ENTITY_PROPER_PATH
+from wiki_segmenter import DEFAULT_SEGMENTER
+from sharded_output import is_sharded, manifest_path
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class Step(object):
+    """
+    A step of the pipeline: fn(**params, **options) reads the inputs and writes the outputs (lists of paths).
+    The params are part of the cache key of the step, the options (e.g. n_procs) don't change the outputs.
+    """
+
+    def __init__(self, name, fn, inputs, outputs, params=None, options=None):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.options = options or {}
+
+    def run(self):
+        self.fn(**self.params, **self.options)
+
+
+class Pipeline(object):
+    """ Run the steps in the order of their inputs and outputs, at most max_parallel at a time """
+
+    def __init__(self, steps, state_path, max_parallel=2):
+        self.steps = list(steps)
+        self.state_path = state_path
+        self.max_parallel = max_parallel
+        self.producers = dict()
+        for step in self.steps:
+            for output in step.outputs:
+                if output in self.producers:
+                    raise ValueError("{} is written by {} and {}".format(output, self.producers[output].name, step.name))
+                self.producers[output] = step
+
+    def dependencies(self, step):
+        return {self.producers[input].name for input in step.inputs if input in self.producers}
+
+    def run(self, force=False):
+        state = self._load_state()
+        done = set()
+        running = dict()
+        failed = []
+        pending = list(self.steps)
+        while pending or running:
+            if not failed:
+                for step in list(pending):
+                    if len(running) >= self.max_parallel:
+                        break
+                    if not self.dependencies(step) <= done:
+                        continue
+                    pending.remove(step)
+                    key = self._step_key(step, state)
+                    if not force and self._is_up_to_date(step, key, state):
+                        logger.info("Skipping {}: its inputs and parameters didn't change".format(step.name))
+                        done.add(step.name)
+                        continue
+                    logger.info("Running {}".format(step.name))
+                    process = multiprocessing.Process(target=step.run, name=step.name)
+                    process.start()
+                    running[process.sentinel] = (step, key, process)
+            if not running:
+                if pending and not failed:
+                    raise ValueError("Steps with missing dependencies: {}".format([step.name for step in pending]))
+                break
+            for sentinel in wait(list(running)):
+                step, key, process = running.pop(sentinel)
+                process.join()
+                if process.exitcode != 0:
+                    logger.error("{} failed with exit code {}".format(step.name, process.exitcode))
+                    failed.append(step.name)
+                    continue
+                state["steps"][step.name] = {
+                    "key": key,
+                    "outputs": {output: _file_digest(output, state) for output in step.outputs},
+                }
+                self._save_state(state)
+                logger.info("Finished {}".format(step.name))
+                done.add(step.name)
+        if failed:
+            raise RuntimeError("Failed steps: {}".format(failed))
+
+    def _step_key(self, step, state):
+        # the outputs of the previous steps are final by now
+        key = {
+            "params": step.params,
+            "inputs": {input: _file_digest(input, state) for input in step.inputs},
+        }
+        return hashlib.blake2b(json.dumps(key, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _is_up_to_date(self, step, key, state):
+        step_state = state["steps"].get(step.name)
+        if step_state is None or step_state["key"] != key:
+            return False
+        for output in step.outputs:
+            if not os.path.exists(output) or _file_digest(output, state) != step_state["outputs"].get(output):
+                return False
+        return True
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf8") as file:
+                return json.load(file)
+        return {"files": {}, "steps": {}}
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as file:
+            json.dump(state, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+
+def _file_digest(path, state):
+    """ Hash of the content of a file, only computed again when its size or modification time change """
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    cached = state["files"].get(path)
+    if cached is not None and cached[:2] == stamp:
+        return cached[2]
+    logger.info("Hashing {}".format(path))
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    state["files"][path] = stamp + [digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def _run_prior(wp_xml, prior_prob_path, limit_prior, binary, n_procs, per_dump):
+    # STEP 2: prior probabilities from WP
+    wp.read_prior_probs(
+        wp_xml, prior_prob_path, limit=limit_prior, n_procs=n_procs, binary=binary, per_dump=per_dump
+    )
+
+
+def _run_entity_freq(prior_prob_path, entity_freq_path, binary):
+    # STEP 3: entity frequencies
+    io.write_entity_to_count(prior_prob_path, entity_freq_path, binary)
+
+
+def _run_wikidata(wd_json, entity_paths, limit_wd, lang, descr_from_wp, binary, n_procs):
+    # STEP 4: definitions, aliases, (possibly) descriptions and properties from WD
+    with io.EntityWriter(*entity_paths, binary=binary) as writer:
+        wd.read_wikidata_entities_json(
+            wd_json, limit_wd, lang=lang, parse_descr=(not descr_from_wp), n_procs=n_procs, writer=writer,
+        )
+
+
+def _run_prior_for_des(wp_xml, prior_prob_path_for_des, entity_defs_path, limit_prior, n_procs, index, per_dump):
+    # STEP 2b: description counts from WP
+    wp.read_prior_probs_for_des(
+        wp_xml, prior_prob_path_for_des, entity_defs_path, limit=limit_prior, n_procs=n_procs, index=index,
+        per_dump=per_dump,
+    )
+
+
+def _run_gold(
+    wp_xml, entity_defs_path, output_dir, limit_train, segmenter, group_contexts, n_shards, max_shard_size,
+    compression, n_procs, index, per_dump
+):
+    # STEP 5: gold entities from WP
+    wp.create_training(
+        wp_xml, entity_defs_path, output_dir, limit_train, n_procs=n_procs, index=index, per_dump=per_dump,
+        segmenter=segmenter, group_contexts=group_contexts, n_shards=n_shards, max_shard_size=max_shard_size,
+        compression=compression,
+    )
+
+
+def _run_kb(
+    model, kb_path, max_per_alias, min_freq, min_pair, entity_vector_length, entity_defs_path, entity_descr_path,
+    entity_alias_path, entity_freq_path, prior_prob_path, index
+):
+    # STEP 6: the KB, spaCy is only needed for this step
+    import spacy
+    import kb_creator
+
+    nlp = spacy.load(model)
+    kb = kb_creator.create_kb(
+        nlp=nlp,
+        max_entities_per_alias=max_per_alias,
+        min_entity_freq=min_freq,
+        min_occ=min_pair,
+        entity_def_path=entity_defs_path,
+        entity_descr_path=entity_descr_path,
+        entity_alias_path=entity_alias_path,
+        entity_freq_path=entity_freq_path,
+        prior_prob_path=prior_prob_path,
+        entity_vector_length=entity_vector_length,
+        index=index,
+    )
+    kb.dump(kb_path)
+    logger.info("kb entities: {}".format(kb.get_size_entities()))
+    logger.info("kb aliases: {}".format(kb.get_size_aliases()))
+
+
+def get_steps(
+    wd_json,
+    wp_xml,
+    output_dir,
+    model=None,
+    max_per_alias=10,
+    min_freq=20,
+    min_pair=5,
+    entity_vector_length=64,
+    descr_from_wp=False,
+    limit_prior=None,
+    limit_train=None,
+    limit_wd=None,
+    lang=None,
+    n_procs=1,
+    binary=False,
+    index=False,
+    per_dump=False,
+    segmenter=DEFAULT_SEGMENTER,
+    group_contexts=False,
+    n_shards=1,
+    max_shard_size=None,
+    compression=None,
+):
+    """ The steps of the pipeline, the KB is only created with a model """
+    wp_xml = list(wp_xml)
+    entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
+    entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
+    entity_descr_path = os.path.join(output_dir,ENTITY_DESCR_PATH) #"entity_descriptions.csv"
+    entity_freq_path = os.path.join(output_dir,ENTITY_FREQ_PATH) #"entity_freq.csv"
+    entity_proper_path = os.path.join(output_dir, ENTITY_PROPER_PATH)
+    prior_prob_path = os.path.join(output_dir,PRIOR_PROB_PATH) #"prior_prob.csv"
+    prior_prob_path_for_des = os.path.join(output_dir,'prior_prob.pkl')
+    kb_path = os.path.join(output_dir,KB_FILE) #kb
+    gold_paths = [
+        os.path.join(output_dir, 'gold_entities_%s.jsonl' % wp._get_lang(wikipedia_input)) for wikipedia_input in wp_xml
+    ]
+    if is_sharded(n_shards, max_shard_size, compression):
+        # the manifests list the shards with their line counts
+        gold_paths = [manifest_path(path) for path in gold_paths]
+    entity_paths = [
+        entity_defs_path, entity_alias_path, None if descr_from_wp else entity_descr_path, entity_proper_path
+    ]
+    workers = {"n_procs": n_procs}
+    # the Wikipedia steps can also read the dumps of the languages at the same time
+    dump_workers = dict(workers, per_dump=per_dump)
+
+    steps = [
+        Step(
+            "prior", _run_prior, wp_xml, [prior_prob_path],
+            dict(wp_xml=wp_xml, prior_prob_path=prior_prob_path, limit_prior=limit_prior, binary=binary), dump_workers,
+        ),
+        Step(
+            "entity_freq", _run_entity_freq, [prior_prob_path], [entity_freq_path],
+            dict(prior_prob_path=prior_prob_path, entity_freq_path=entity_freq_path, binary=binary),
+        ),
+        Step(
+            "wikidata", _run_wikidata, [wd_json], [path for path in entity_paths if path is not None],
+            dict(wd_json=wd_json, entity_paths=entity_paths, limit_wd=limit_wd, lang=lang,
+                 descr_from_wp=descr_from_wp, binary=binary), workers,
+        ),
+        Step(
+            "prior_for_des", _run_prior_for_des, wp_xml + [entity_defs_path], [prior_prob_path_for_des],
+            dict(wp_xml=wp_xml, prior_prob_path_for_des=prior_prob_path_for_des, entity_defs_path=entity_defs_path,
+                 limit_prior=limit_prior), dict(dump_workers, index=index),
+        ),
+        Step(
+            "gold", _run_gold, wp_xml + [entity_defs_path], gold_paths,
+            dict(wp_xml=wp_xml, entity_defs_path=entity_defs_path, output_dir=output_dir, limit_train=limit_train,
+                 segmenter=segmenter, group_contexts=group_contexts, n_shards=n_shards, max_shard_size=max_shard_size,
+                 compression=compression),
+            dict(dump_workers, index=index),
+        ),
+    ]
+    if model is not None:
+        # without the Wikidata descriptions, entity_descr_path isn't an output of the wikidata step
+        kb_inputs = [entity_defs_path, entity_alias_path, entity_freq_path, prior_prob_path]
+        if not descr_from_wp:
+            kb_inputs.insert(1, entity_descr_path)
+        steps.append(Step(
+            "kb", _run_kb, kb_inputs, [kb_path],
+            dict(model=model, kb_path=kb_path, max_per_alias=max_per_alias, min_freq=min_freq, min_pair=min_pair,
+                 entity_vector_length=entity_vector_length, entity_defs_path=entity_defs_path,
+                 entity_descr_path=entity_descr_path, entity_alias_path=entity_alias_path,
+                 entity_freq_path=entity_freq_path, prior_prob_path=prior_prob_path),
+            dict(index=index),
+        ))
+    return steps
+
+
+@plac.annotations(
+    wd_json=("Path to the downloaded WikiData JSON dump.", "positional", None, str),
+    output_dir=("Output directory", "positional", None, str),
+    wp_xml=("Paths to the downloaded Wikipedia XML dumps.", "positional", None, str),
+    model=("Model name or path, to create the KB (default: no KB)", "option", "m", str),
+    max_per_alias=("Max. # entities per alias (default 10)", "option", "a", int),
+    min_freq=("Min. count of an entity in the corpus (default 20)", "option", "f", int),
+    min_pair=("Min. count of entity-alias pairs (default 5)", "option", "c", int),
+    entity_vector_length=("Length of entity vectors (default 64)", "option", "v", int),
+    descr_from_wp=("Flag for using descriptions from WP instead of WD (default False)", "flag", "wp"),
+    limit_prior=("Threshold to limit lines read from WP for prior probabilities", "option", "lp", int),
+    limit_train=("Threshold to limit lines read from WP for training set", "option", "lt", int),
+    limit_wd=("Threshold to limit lines read from WD", "option", "lw", int),
+    n_procs=("Number of worker processes of each step (default 1)", "option", "n", int),
+    max_parallel=("Number of steps run at the same time (default 2)", "option", "j", int),
+    binary=("Flag for writing the intermediate files in the binary format", "flag", "b"),
+    index=("Flag for reading the entity definitions through the title index", "flag", "i"),
+    per_dump=("Flag for reading the Wikipedia dumps at the same time, one per worker process", "flag", "d"),
+    segmenter=("Sentence segmenter of the gold entities, polyglot or rules (default polyglot)", "option", "s", str),
+    group_contexts=("Flag for writing each context of the gold entities once, with its mentions", "flag", "g"),
+    n_shards=("Number of shards of the gold entities written at the same time (default 1)", "option", "S", int),
+    max_shard_size=("Size in characters above which a shard of the gold entities is rotated", "option", "z", int),
+    compression=("Compression of the shards of the gold entities: gzip, bz2 or zstd", "option", "C", str),
+    force=("Flag for running all steps, even the ones that are up to date", "flag", "F"),
+)
+def main(
+    wd_json,
+    output_dir,
+    model=None,
+    max_per_alias=10,
+    min_freq=20,
+    min_pair=5,
+    entity_vector_length=64,
+    descr_from_wp=False,
+    limit_prior=None,
+    limit_train=None,
+    limit_wd=None,
+    n_procs=1,
+    max_parallel=2,
+    binary=False,
+    index=False,
+    per_dump=False,
+    segmenter=DEFAULT_SEGMENTER,
+    group_contexts=False,
+    n_shards=1,
+    max_shard_size=None,
+    compression=None,
+    force=False,
+    *wp_xml
+):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    steps = get_steps(
+        wd_json,
+        wp_xml,
+        output_dir,
+        model=model,
+        max_per_alias=max_per_alias,
+        min_freq=min_freq,
+        min_pair=min_pair,
+        entity_vector_length=entity_vector_length,
+        descr_from_wp=descr_from_wp,
+        limit_prior=limit_prior,
+        limit_train=limit_train,
+        limit_wd=limit_wd,
+        n_procs=n_procs,
+        binary=binary,
+        index=index,
+        per_dump=per_dump,
+        segmenter=segmenter,
+        group_contexts=group_contexts,
+        n_shards=n_shards,
+        max_shard_size=max_shard_size,
+        compression=compression,
+    )
+    Pipeline(steps, os.path.join(output_dir, PIPELINE_STATE_PATH), max_parallel).run(force)
+    logger.info("Done!")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    plac.call(main)
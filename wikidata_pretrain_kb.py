@@ -3,8 +3,8 @@
 with specific parameters. Intermediate files are written to disk.
 
 Running the full pipeline on a standard laptop, may take up to 13 hours of processing.
-Use the -p, -d and -s options to speed up processing using the intermediate files
-from a previous run.
+To reuse the intermediate files of a previous run, run the steps with wikidata_pipeline.py instead:
+it skips the steps whose inputs and parameters didn't change.
 
 For the Wikidata dump: get the latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
 For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
@@ -45,6 +45,11 @@ def main(
     limit_train=None,
     limit_wd=None,
     lang=None,
+    n_procs=1,
+    compact=False,
+    stream=False,
+    binary=False,
+    index=False,
 ):
     entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
     entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
@@ -79,7 +84,7 @@ def main(
     logger.info("STEP 2: Writing prior probabilities to {}".format(prior_prob_path))
     if limit_prior is not None:
         logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_prior))
-    wp.read_prior_probs(wp_xml, prior_prob_path, limit=limit_prior)
+    wp.read_prior_probs(wp_xml, prior_prob_path, limit=limit_prior, n_procs=n_procs, binary=binary)
 
 
 
@@ -88,22 +93,46 @@ def main(
     logger.info("STEP 4: Parsing and writing Wikidata entity definitions to {}".format(entity_defs_path))
     if limit_wd is not None:
         logger.warning("Warning: reading only {} lines of Wikidata dump".format(limit_wd))
-    title_to_id, id_to_descr, id_to_alias, id_to_proper = wd.read_wikidata_entities_json(
-        wd_json,
-        limit_wd,
-        to_print=False,
-        lang=lang,
-        parse_descr=(not descr_from_wp),
-    )
-    io.write_title_to_id(entity_defs_path, title_to_id)
+    if stream:
+        # the entities are written as they are parsed, instead of being kept in memory until the end
+        logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
+        if not descr_from_wp:
+            logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
+        with io.EntityWriter(
+            entity_defs_path,
+            entity_alias_path,
+            None if descr_from_wp else entity_descr_path,
+            entity_proper_path,
+            binary=binary,
+        ) as writer:
+            wd.read_wikidata_entities_json(
+                wd_json,
+                limit_wd,
+                to_print=False,
+                lang=lang,
+                parse_descr=(not descr_from_wp),
+                n_procs=n_procs,
+                writer=writer,
+            )
+    else:
+        title_to_id, id_to_descr, id_to_alias, id_to_proper = wd.read_wikidata_entities_json(
+            wd_json,
+            limit_wd,
+            to_print=False,
+            lang=lang,
+            parse_descr=(not descr_from_wp),
+            n_procs=n_procs,
+            compact=compact,
+        )
+        io.write_title_to_id(entity_defs_path, title_to_id, binary)
 
-    logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
-    io.write_id_to_alias(entity_alias_path, id_to_alias)
+        logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
+        io.write_id_to_alias(entity_alias_path, id_to_alias, binary)
 
-    if not descr_from_wp:
-        logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
-        io.write_id_to_descr(entity_descr_path, id_to_descr)
-    io.write_id_to_proper(entity_proper_path,id_to_proper)
+        if not descr_from_wp:
+            logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
+            io.write_id_to_descr(entity_descr_path, id_to_descr, binary)
+        io.write_id_to_proper(entity_proper_path,id_to_proper, binary)
 
 
 
@@ -111,13 +140,13 @@ def main(
     logger.info("STEP 5: Parsing and writing Wikipedia gold entities to {}".format(output_dir))
     if limit_train is not None:
         logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_train))
-    wp.create_training(wp_xml, entity_defs_path, output_dir, limit_train)
+    wp.create_training(wp_xml, entity_defs_path, output_dir, limit_train, n_procs=n_procs, index=index)
 
 
 
     # STEP 3: calculate entity frequencies
     logger.info("STEP 3: Calculating and writing entity frequencies to {}".format(entity_freq_path))
-    io.write_entity_to_count(prior_prob_path, entity_freq_path)
+    io.write_entity_to_count(prior_prob_path, entity_freq_path, binary)
 
 
 
@@ -135,6 +164,7 @@ def main(
         entity_freq_path=entity_freq_path,
         prior_prob_path=prior_prob_path,
         entity_vector_length=entity_vector_length,
+        index=index,
     )
     kb.dump(kb_path)
     logger.info("kb entities: {}".format(kb.get_size_entities()))
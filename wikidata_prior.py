@@ -3,8 +3,10 @@
 with specific parameters. Intermediate files are written to disk.
 
 Running the full pipeline on a standard laptop, may take up to 13 hours of processing.
-Use the -p, -d and -s options to speed up processing using the intermediate files
-from a previous run.
+To reuse the intermediate files of a previous run, run the steps with wikidata_pipeline.py instead:
+it skips the steps whose inputs and parameters didn't change.
+The pass over the Wikipedia dumps saves checkpoints in the output directory:
+after a crash, run the script again with --resume to continue from the last one.
 
 For the Wikidata dump: get the latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
 For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
@@ -18,10 +20,14 @@ import spacy
 import logging
 import os
 
+import plac
+
 import wikipedia_processor as wp, wikidata_processor as wd
 import wiki_io as io
 from wiki_io import TRAINING_DATA_FILE, KB_FILE, ENTITY_DESCR_PATH, KB_MODEL_DIR, LOG_FORMAT
 from wiki_io import ENTITY_FREQ_PATH, PRIOR_PROB_PATH, ENTITY_DEFS_PATH, ENTITY_ALIAS_PATH, ENTITY_PROPER_PATH
+from wiki_io import PRIOR_PROB_CHECKPOINT_PATH
+from checkpoint import open_checkpoint
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +50,10 @@ def main(
     limit_train=None,
     limit_wd=None,
     lang=None,
+    n_procs=1,
+    binary=False,
+    resume=False,
+    per_dump=False,
 ):
     entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
     entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
@@ -78,13 +88,25 @@ def main(
     logger.info("STEP 2: Writing prior probabilities to {}".format(prior_prob_path))
     if limit_prior is not None:
         logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_prior))
-    wp.read_prior_probs(wp_xml, prior_prob_path, limit=limit_prior)
+    checkpoint = None
+    resume_state = None
+    # the checkpoints are saved between two chunks of a dump, not with per_dump
+    if limit_prior is None and not per_dump:
+        checkpoint, resume_state = open_checkpoint(os.path.join(output_dir, PRIOR_PROB_CHECKPOINT_PATH), resume)
+    wp.read_prior_probs(
+        wp_xml, prior_prob_path, limit=limit_prior, n_procs=n_procs, binary=binary,
+        checkpoint=checkpoint, resume_state=resume_state, per_dump=per_dump,
+    )
+    if checkpoint is not None:
+        checkpoint.clear()
 
 
 
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+@plac.annotations(
+    resume=("Continue from the last checkpoint in the output directory", "flag", "r"),
+)
+def run(resume=False):
     wd_json = './data/wikidata-20210301-all.json.bz2'
     wp_xml = []
     output_dir = './data/output'
@@ -94,4 +116,9 @@ if __name__ == "__main__":
         path = './data/%swiki-20210301-pages-articles-multistream.xml.bz2'%lang
         wp_xml.append(path)
 
-    main(wd_json,wp_xml,output_dir)
+    main(wd_json,wp_xml,output_dir,n_procs=os.cpu_count(),resume=resume)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    plac.call(run)
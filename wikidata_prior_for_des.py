@@ -3,8 +3,8 @@
 with specific parameters. Intermediate files are written to disk.
 
 Running the full pipeline on a standard laptop, may take up to 13 hours of processing.
-Use the -p, -d and -s options to speed up processing using the intermediate files
-from a previous run.
+To reuse the intermediate files of a previous run, run the steps with wikidata_pipeline.py instead:
+it skips the steps whose inputs and parameters didn't change.
 
 For the Wikidata dump: get the latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
 For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
@@ -44,6 +44,9 @@ def main(
     limit_train=None,
     limit_wd=None,
     lang=None,
+    n_procs=1,
+    index=False,
+    per_dump=False,
 ):
     entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
     entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
@@ -78,7 +81,8 @@ def main(
     logger.info("STEP 2: Writing prior probabilities to {}".format(prior_prob_path_for_des))
     if limit_prior is not None:
         logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_prior))
-    wp.read_prior_probs_for_des(wp_xml, prior_prob_path_for_des, entity_defs_path, limit=limit_prior)
+    wp.read_prior_probs_for_des(wp_xml, prior_prob_path_for_des, entity_defs_path, limit=limit_prior, n_procs=n_procs, index=index,
+        per_dump=per_dump)
 
 
 
@@ -94,4 +98,4 @@ if __name__ == "__main__":
         path = './data/%swiki-20210301-pages-articles-multistream.xml.bz2'%lang
         wp_xml.append(path)
 
-    main(wd_json,wp_xml,output_dir,limit_prior=None)
+    main(wd_json,wp_xml,output_dir,index=True,limit_prior=None,n_procs=os.cpu_count())
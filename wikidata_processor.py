@@ -1,51 +1,402 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import base64
 import bz2
+import copy
 import json
 import logging
+import time
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
 
+import dump_reader
+from compact_maps import CompactTitleToId, CompactDescriptions, CompactAliases, CompactProperties
 from wiki_namespaces import WD_META_ITEMS
 
 logger = logging.getLogger(__name__)
 
+# filter: currently defined as OR: one hit suffices to be removed from further processing
+EXCLUDED_ITEMS = tuple(WD_META_ITEMS) + (
+    # punctuation
+    "Q1383557", "Q10617810",
+    # letters etc
+    "Q188725", "Q19776628", "Q3841820", "Q17907810", "Q9788", "Q9398093",
+    ###论文中提到的一些list
+    'Q4167836','Q24046192','Q20010800','Q11266439','Q11753321',
+    'Q19842659','Q21528878','Q17362920','Q14204246','Q21025364','Q17442446',
+    'Q26267864','Q4663903','Q15184295',
+)
+
+EXCLUDED_PROPERTIES = (
+    "P31",  # instance of
+    "P279",  # subclass
+)
+
+
+class EntityFilter(object):
+    """
+    Filter on the claims of the Wikidata entities: an entity is discarded as soon as one of its non-deprecated
+    claims for one of the properties has one of the excluded items as value.
+    The properties and items can't be changed once the filter is built. The filter counts the entities and claims
+    it checked, the time it took, and its hits per (property, item) rule. Pickled copies (e.g. for worker processes)
+    start with empty counts, which can be merged back with merge_stats.
+    """
+
+    def __init__(self, excluded_items=EXCLUDED_ITEMS, extra_items=(), properties=EXCLUDED_PROPERTIES):
+        self._properties = tuple(properties)
+        # the ids are compared as they're parsed: converting them to integers would cost more than hashing them
+        self._excluded_items = frozenset(excluded_items) | frozenset(extra_items)
+        self._reset_stats()
+
+    @property
+    def properties(self):
+        return self._properties
+
+    @property
+    def excluded_items(self):
+        return self._excluded_items
+
+    def _reset_stats(self):
+        self.n_entities = 0
+        self.n_claims = 0
+        self.seconds = 0.0
+        self.hits = Counter()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_stats()
+
+    def keep(self, claims):
+        start = time.perf_counter()
+        self.n_entities += 1
+        excluded_items = self._excluded_items
+        for prop in self._properties:
+            claim_property = claims.get(prop, None)
+            if claim_property:
+                for cp in claim_property:
+                    self.n_claims += 1
+                    cp_id = (
+                        cp["mainsnak"]
+                        .get("datavalue", {})
+                        .get("value", {})
+                        .get("id")
+                    )
+                    cp_rank = cp["rank"]
+                    if cp_rank != "deprecated" and cp_id in excluded_items:
+                        self.hits[(prop, cp_id)] += 1
+                        self.seconds += time.perf_counter() - start
+                        return False
+        self.seconds += time.perf_counter() - start
+        return True
+
+    def stats(self):
+        return self.n_entities, self.n_claims, self.seconds, self.hits
+
+    def merge_stats(self, stats):
+        n_entities, n_claims, seconds, hits = stats
+        self.n_entities += n_entities
+        self.n_claims += n_claims
+        self.seconds += seconds
+        self.hits.update(hits)
+
+    def log_stats(self, n_rules=10):
+        n_removed = sum(self.hits.values())
+        logger.info("Entity filter: removed {} of {} entities, checked {} claims in {:.1f}s".format(
+            n_removed, self.n_entities, self.n_claims, self.seconds
+        ))
+        for (prop, item), count in self.hits.most_common(n_rules):
+            logger.info("Entity filter: {} {} removed {} entities".format(prop, item, count))
+
+
+# fastest installed backend first, cf. set_json_backend
+JSON_BACKENDS = ["orjson", "simdjson", "json"]
+
+
+def get_json_loads(backend=None):
+    """ The loads function of a JSON backend, by default the first one of JSON_BACKENDS that is installed """
+    if backend is None:
+        for backend in JSON_BACKENDS:
+            try:
+                return get_json_loads(backend)
+            except ImportError:
+                pass
+    if backend == "orjson":
+        import orjson
+        return orjson.loads
+    if backend == "simdjson":
+        import simdjson
+        return simdjson.loads
+    if backend == "json":
+        return json.loads
+    raise ValueError("Unknown JSON backend {}, expected one of {}".format(backend, JSON_BACKENDS))
+
+
+json_loads = get_json_loads()
+
+
+def set_json_backend(backend=None):
+    """ Parse the Wikidata entities with another JSON backend, also in the worker processes started afterwards """
+    global json_loads
+    json_loads = get_json_loads(backend)
+
 
 def read_wikidata_entities_json(
-    wikidata_file, limit=None, to_print=False, lang=None, parse_descr=True
+    wikidata_file, limit=None, to_print=False, lang=None, parse_descr=True, n_procs=1,
+    chunk_bytes=dump_reader.SCAN_BLOCK_SIZE, compact=False, writer=None, prefilter=True, require_sitelinks=False,
+    entity_filter=None, checkpoint=None, resume_state=None
 ):
     # Read the JSON wiki data and parse out the entities. Takes about 7-10h to parse 55M lines.
     # get latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
+    # wikidata_file can also be a list of bz2 shards of the dump, which are read in order.
+    # With n_procs > 1, the bz2 streams (or shards) are parsed by n_procs worker processes.
+    # With compact=True, the maps are returned as the array-backed dicts of compact_maps, at a fraction of the memory.
+    # With a wiki_io.EntityWriter, the entities are written to file as they are parsed, and nothing is returned.
+    # With prefilter, the lines of the entities that are certainly discarded are skipped before decoding the JSON.
+    # With require_sitelinks, the entities without a Wikipedia page in any of the languages are discarded.
+    # entity_filter is the EntityFilter on the claims of the entities, by default the one of EXCLUDED_ITEMS.
+    # With a checkpoint.Checkpoint (and a writer, to which the entities are flushed), the state of the pass is saved
+    # between two chunks, and the pass continues from resume_state, the last saved state, if given.
     if lang is None:
         lang= ['ja', 'de', 'es', 'ar', 'sr', 'tr', 'fa', 'ta', 'en',
                  'fr', 'it']
+    if compact and not isinstance(lang, list):
+        raise ValueError("The compact maps need a list of languages, got {}".format(lang))
+    if checkpoint is not None and (writer is None or limit or to_print):
+        raise ValueError("Checkpoints need a writer, and no limit nor to_print")
 
     # site_filter = "{}wiki".format(lang)
 
-    # filter: currently defined as OR: one hit suffices to be removed from further processing
-    exclude_list = WD_META_ITEMS
+    if entity_filter is None:
+        entity_filter = EntityFilter()
 
-    # punctuation
-    exclude_list.extend(["Q1383557", "Q10617810"])
+    line_filter = None
+    if prefilter:
+        line_filter = partial(_may_keep_line, sitelink_markers=_get_sitelink_markers(lang) if require_sitelinks else None)
+    parse_args = (lang, parse_descr, entity_filter, line_filter, require_sitelinks)
 
-    # letters etc
-    exclude_list.extend(
-        ["Q188725", "Q19776628", "Q3841820", "Q17907810", "Q9788", "Q9398093"]
-    )
+    if writer is not None:
+        title_to_id, id_to_descr, id_to_alias, id_to_proper = writer.maps
+    elif compact:
+        title_to_id = CompactTitleToId()
+        id_to_descr = CompactDescriptions()
+        id_to_alias = CompactAliases()
+        id_to_proper = CompactProperties()
+    else:
+        title_to_id = dict()
+        id_to_descr = dict()
+        id_to_alias = dict()
+        id_to_proper = dict()
+    results = (title_to_id, id_to_descr, id_to_alias, id_to_proper)
 
-    ###论文中提到的一些list
-    exclude_list.extend(['Q4167836','Q24046192','Q20010800','Q11266439','Q11753321',
-                'Q19842659','Q21528878','Q17362920','Q14204246','Q21025364','Q17442446',
-                'Q26267864','Q4663903','Q15184295'])
+    if isinstance(wikidata_file, str):
+        wikidata_files = [wikidata_file]
+    else:
+        wikidata_files = list(wikidata_file)
+
+    if checkpoint is not None:
+        # the chunks are also the unit of the checkpoints, even in a single process
+        cnt = _read_wikidata_entities_parallel(
+            wikidata_files, results, parse_args, n_procs, chunk_bytes, checkpoint, resume_state, writer
+        )
+    elif n_procs > 1 and not limit and not to_print:
+        cnt = _read_wikidata_entities_parallel(wikidata_files, results, parse_args, n_procs, chunk_bytes)
+    else:
+        cnt = 0
+        for wikidata_shard in wikidata_files:
+            if limit and cnt >= limit:
+                break
+            with bz2.open(wikidata_shard, mode="rb") as file:
+                for line in file:
+                    if limit and cnt >= limit:
+                        break
+                    if cnt % 500000 == 0 and cnt > 0:
+                        logger.info("processed {} lines of WikiData JSON dump".format(cnt))
+                    _parse_entity_line(line, results, *parse_args, to_print=to_print)
+                    cnt += 1
+
+    # log final number of lines processed
+    logger.info("Finished. Processed {} lines of WikiData JSON dump".format(cnt))
+    entity_filter.log_stats()
+    if writer is not None:
+        return None
+    return title_to_id, id_to_descr, id_to_alias, id_to_proper
+
+
+def read_wikidata_changes(changes_file, lang=None, parse_descr=True, require_sitelinks=False, entity_filter=None):
+    """
+    Read a file of changed entities, one JSON entity per line as in the dump (.bz2 or not),
+    where {"id": "Q42", "deleted": true} stands for a deleted entity. The last line of an entity wins.
+    Returns the ids of all the changed and deleted entities, and the maps of read_wikidata_entities_json
+    for the new versions of the entities that pass the same filters as in the full dump.
+    """
+    if lang is None:
+        lang= ['ja', 'de', 'es', 'ar', 'sr', 'tr', 'fa', 'ta', 'en',
+                 'fr', 'it']
+    if entity_filter is None:
+        entity_filter = EntityFilter()
+    # every changed line is decoded anyway, to know its id
+    parse_args = (lang, parse_descr, entity_filter, None, require_sitelinks)
+
+    changed_lines = dict()
+    opener = bz2.open if changes_file.endswith(".bz2") else open
+    with opener(changes_file, mode="rb") as file:
+        for line in file:
+            clean_line = line.strip()
+            if clean_line.endswith(b","):
+                clean_line = clean_line[:-1]
+            if len(clean_line) <= 1:
+                continue
+            try:
+                obj = json_loads(clean_line)
+            except ValueError:
+                logger.warning("Skipping a line that isn't JSON in {}".format(changes_file))
+                continue
+            unique_id = obj.get("id")
+            if unique_id is None:
+                continue
+            # dict assignment keeps the position of the first line, pop it to follow the order of the last ones
+            changed_lines.pop(unique_id, None)
+            changed_lines[unique_id] = None if obj.get("deleted") else clean_line
+
+    results = (dict(), dict(), dict(), dict())
+    for line in changed_lines.values():
+        if line is not None:
+            _parse_entity_line(line, results, *parse_args)
+    n_deleted = sum(1 for line in changed_lines.values() if line is None)
+    # every kept entity has an entry in id_to_proper, possibly empty
+    logger.info("Read {} changed and {} deleted entities, kept {}".format(
+        len(changed_lines) - n_deleted, n_deleted, len(results[3])
+    ))
+    entity_filter.log_stats()
+    return set(changed_lines), results
 
-    neg_prop_filter = {
-        "P31": exclude_list,  # instance of
-        "P279": exclude_list,  # subclass
-    }
 
-    title_to_id = dict()
-    id_to_descr = dict()
-    id_to_alias = dict()
-    id_to_proper = dict()
+def _read_wikidata_entities_parallel(
+    wikidata_files, results, parse_args, n_procs, chunk_bytes, checkpoint=None, resume_state=None, writer=None
+):
+    entity_filter = parse_args[2]
+    # the chunks count with a copy of the filter, as the worker processes do, and their counts are merged here
+    chunk_parse_args = parse_args[:2] + (copy.copy(entity_filter),) + parse_args[3:]
+    tasks = []
+    for wikidata_shard in wikidata_files:
+        for start, end in dump_reader.get_stream_ranges(wikidata_shard, chunk_bytes):
+            tasks.append((wikidata_shard, start, end, chunk_parse_args))
+    logger.info("Parsing {} chunks of WikiData JSON dump with {} processes".format(len(tasks), n_procs))
+
+    cnt = 0
+    # the lines crossing chunk boundaries are stitched together and parsed here, in dump order
+    carry = b""
+    n_done = 0
+    if resume_state is not None:
+        if resume_state["n_tasks"] != len(tasks):
+            raise ValueError("The checkpoint was saved for {} chunks, not {}".format(resume_state["n_tasks"], len(tasks)))
+        n_done = resume_state["n_done"]
+        cnt = resume_state["cnt"]
+        carry = base64.b64decode(resume_state["carry"])
+        entity_filter.merge_stats(_filter_stats_from_json(resume_state["filter_stats"]))
+        logger.info("Skipping {} chunks and {} lines of WikiData JSON dump".format(n_done, cnt))
+
+    pool = Pool(n_procs) if n_procs > 1 else None
+    try:
+        chunks = pool.imap(_read_wikidata_range, tasks[n_done:]) if pool else map(_read_wikidata_range, tasks[n_done:])
+        for head, tail, chunk_results, filter_stats, chunk_cnt in chunks:
+            carry += head
+            if tail is not None:
+                _parse_entity_line(carry, results, *parse_args)
+                cnt += 1
+                carry = tail
+            _merge_entity_results(results, chunk_results)
+            entity_filter.merge_stats(filter_stats)
+            cnt += chunk_cnt
+            n_done += 1
+            logger.info("processed {} lines of WikiData JSON dump".format(cnt))
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save({
+                    "n_tasks": len(tasks),
+                    "n_done": n_done,
+                    "cnt": cnt,
+                    "carry": base64.b64encode(carry).decode("ascii"),
+                    "filter_stats": _filter_stats_to_json(entity_filter.stats()),
+                    "output_positions": writer.flush(),
+                })
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if carry:
+        _parse_entity_line(carry, results, *parse_args)
+        cnt += 1
+    return cnt
+
+
+def _filter_stats_to_json(stats):
+    n_entities, n_claims, seconds, hits = stats
+    return [n_entities, n_claims, seconds, [[prop, item, count] for (prop, item), count in hits.items()]]
+
+
+def _filter_stats_from_json(stats):
+    n_entities, n_claims, seconds, hits = stats
+    return n_entities, n_claims, seconds, Counter({(prop, item): count for prop, item, count in hits})
+
+
+def _read_wikidata_range(task):
+    wikidata_file, start, end, parse_args = task
+    entity_filter = parse_args[2]
+    # the counts of this chunk only, a worker process reads several chunks with the same filter
+    entity_filter._reset_stats()
+    chunk_results = (dict(), dict(), dict(), dict())
+    chunk_cnt = 0
+
+    def parse_line(line):
+        nonlocal chunk_cnt
+        _parse_entity_line(line, chunk_results, *parse_args)
+        chunk_cnt += 1
+
+    head, tail = dump_reader.read_range_lines(wikidata_file, start, end, parse_line)
+    n_entities, n_claims, seconds, hits = entity_filter.stats()
+    return head, tail, chunk_results, (n_entities, n_claims, seconds, Counter(hits)), chunk_cnt
+
+
+def _merge_entity_results(results, chunk_results):
+    # same semantics as parsing the chunk's lines directly into the results
+    for result, chunk_result in zip(results, chunk_results):
+        for key, value in chunk_result.items():
+            if isinstance(value, list) and key in result:
+                # the values of the compact maps are copies
+                result[key] = result[key] + value
+            else:
+                result[key] = value
+
+
+def _get_sitelink_markers(lang):
+    langs = lang if isinstance(lang, list) else [lang]
+    return tuple('"{}wiki"'.format(l).encode("utf-8") for l in langs)
+
+
+def _may_keep_line(line, sitelink_markers=None):
+    # False only for the lines of entities that _parse_entity_line discards anyway:
+    # not an item, without descriptions, or (with sitelink_markers) without any of the needed sitelinks.
+    # the dump is written without spaces, the other spacing is only there for hand-made files
+    if b'"type":"item"' not in line and b'"type": "item"' not in line:
+        return False
+    if b'"descriptions":{}' in line or b'"descriptions": {}' in line:
+        return False
+    if sitelink_markers:
+        # the sitelinks come last in the dump, only look at them
+        start = line.rfind(b'"sitelinks"')
+        if start >= 0 and not any(line.find(marker, start) >= 0 for marker in sitelink_markers):
+            return False
+    return True
+
+
+def _parse_entity_line(
+    line, results, lang, parse_descr, entity_filter, line_filter=None, require_sitelinks=False, to_print=False
+):
+    title_to_id, id_to_descr, id_to_alias, id_to_proper = results
+
+    if line_filter is not None and not line_filter(line):
+        return
 
     # parse appropriate fields - depending on what we need in the KB
     parse_properties = True
@@ -54,158 +405,137 @@ def read_wikidata_entities_json(
     parse_aliases = True
     parse_claims = True ####过滤一些数据
 
-    with bz2.open(wikidata_file, mode="rb") as file:
-        for cnt, line in enumerate(file):
-            if limit and cnt >= limit:
-                break
-            if cnt % 500000 == 0 and cnt > 0:
-                logger.info("processed {} lines of WikiData JSON dump".format(cnt))
-            clean_line = line.strip()
-            if clean_line.endswith(b","):
-                clean_line = clean_line[:-1]
-            if len(clean_line) > 1:
-                try:
-                    obj = json.loads(clean_line)
-                except:
-                    continue
-                entry_type = obj["type"]
-
-                if entry_type == "item" and len(obj['descriptions'])>0:
-                    keep = True
-
-                    claims = obj["claims"]
-                    if parse_claims:
-                        for prop, value_set in neg_prop_filter.items():
-                            claim_property = claims.get(prop, None)
-                            if claim_property:
-                                for cp in claim_property:
-                                    cp_id = (
-                                        cp["mainsnak"]
-                                        .get("datavalue", {})
-                                        .get("value", {})
-                                        .get("id")
+    clean_line = line.strip()
+    if clean_line.endswith(b","):
+        clean_line = clean_line[:-1]
+    if len(clean_line) > 1:
+        try:
+            obj = json_loads(clean_line)
+        except:
+            return
+        entry_type = obj["type"]
+
+        if entry_type == "item" and len(obj['descriptions'])>0:
+            keep = True
+
+            claims = obj["claims"]
+            if parse_claims:
+                keep = entity_filter.keep(claims)
+
+            if keep and require_sitelinks:
+                sitelinks = obj["sitelinks"]
+                keep = any("{}wiki".format(l) in sitelinks for l in (lang if isinstance(lang, list) else [lang]))
+
+            if keep:
+                unique_id = obj["id"]
+
+                if to_print:
+                    print("ID:", unique_id)
+                    print("type:", entry_type)
+
+                # parsing all properties that refer to other entities
+                if parse_properties:
+                    proper_list = id_to_proper.get(unique_id, [])
+                    for prop, claim_property in claims.items():
+                        cp_dicts = [
+                            cp["mainsnak"]["datavalue"].get("value")
+                            for cp in claim_property
+                            if cp["mainsnak"].get("datavalue")
+                        ]
+                        cp_values = [
+                            cp_dict.get("id")
+                            for cp_dict in cp_dicts
+                            if isinstance(cp_dict, dict)
+                            if cp_dict.get("id") is not None
+                        ]
+                        if cp_values:
+                            if to_print:
+                                print("prop:", prop, cp_values)
+
+                            proper_list.append((prop,cp_values))
+                    id_to_proper[unique_id] = proper_list
+
+                if parse_sitelinks:
+                    if isinstance(lang,list):
+                        for l in lang:
+                            site_filter = "{}wiki".format(l)
+                            site_value = obj["sitelinks"].get(site_filter, None)
+                            if site_value:
+                                site = site_value["title"]
+                                if to_print:
+                                    print(site_filter, ":", site)
+                                # if site_filter+'_'+site in title_to_id:
+                                #     if unique_id!=title_to_id[site_filter+'_'+site]:
+                                #         print(site)
+                                #         print(unique_id)
+                                #         print(title_to_id[site_filter+'_'+site])
+                                title_to_id[l+'_'+site] = unique_id
+                                # if l == 'ar':
+                                #     print(site)
+                                #     print(unique_id)
+                    else:
+                        site_filter = "{}wiki".format(lang)
+                        site_value = obj["sitelinks"].get(site_filter, None)
+                        if site_value:
+                            site = site_value["title"]
+                            if to_print:
+                                print(site_filter, ":", site)
+                            title_to_id[site] = unique_id
+
+                if parse_labels:
+                    labels = obj["labels"]
+                    if labels:
+                        lang_label = labels.get(lang, None)
+                        if lang_label:
+                            if to_print:
+                                print(
+                                    "label (" + lang + "):", lang_label["value"]
+                                )
+
+                if parse_descr:
+                    descriptions = obj["descriptions"]
+                    if descriptions:
+                        if isinstance(lang,list):
+                            des_tmp = {}
+                            for l in lang:
+                                lang_descr = descriptions.get(l, None)
+                                if lang_descr:
+                                    des_tmp[l]=lang_descr["value"]
+                            id_to_descr[unique_id]=des_tmp
+                        else:
+                            lang_descr = descriptions.get(lang, None)
+                            if lang_descr:
+                                if to_print:
+                                    print(
+                                        "description (" + lang + "):",
+                                        lang_descr["value"],
                                     )
-                                    cp_rank = cp["rank"]
-                                    if cp_rank != "deprecated" and cp_id in value_set:
-                                        keep = False
-                                        break
-                            if not keep:
-                                break
-
-                    if keep:
-                        unique_id = obj["id"]
-
-                        if to_print:
-                            print("ID:", unique_id)
-                            print("type:", entry_type)
-
-                        # parsing all properties that refer to other entities
-                        if parse_properties:
-                            proper_list = id_to_proper.get(unique_id, [])
-                            for prop, claim_property in claims.items():
-                                cp_dicts = [
-                                    cp["mainsnak"]["datavalue"].get("value")
-                                    for cp in claim_property
-                                    if cp["mainsnak"].get("datavalue")
-                                ]
-                                cp_values = [
-                                    cp_dict.get("id")
-                                    for cp_dict in cp_dicts
-                                    if isinstance(cp_dict, dict)
-                                    if cp_dict.get("id") is not None
-                                ]
-                                if cp_values:
-                                    if to_print:
-                                        print("prop:", prop, cp_values)
-
-                                    proper_list.append((prop,cp_values))
-                            id_to_proper[unique_id] = proper_list
-
-                        if parse_sitelinks:
-                            if isinstance(lang,list):
-                                for l in lang:
-                                    site_filter = "{}wiki".format(l)
-                                    site_value = obj["sitelinks"].get(site_filter, None)
-                                    if site_value:
-                                        site = site_value["title"]
-                                        if to_print:
-                                            print(site_filter, ":", site)
-                                        # if site_filter+'_'+site in title_to_id:
-                                        #     if unique_id!=title_to_id[site_filter+'_'+site]:
-                                        #         print(site)
-                                        #         print(unique_id)
-                                        #         print(title_to_id[site_filter+'_'+site])
-                                        title_to_id[l+'_'+site] = unique_id
-                                        # if l == 'ar':
-                                        #     print(site)
-                                        #     print(unique_id)
-                            else:
-                                site_filter = "{}wiki".format(lang)
-                                site_value = obj["sitelinks"].get(site_filter, None)
-                                if site_value:
-                                    site = site_value["title"]
-                                    if to_print:
-                                        print(site_filter, ":", site)
-                                    title_to_id[site] = unique_id
-
-                        if parse_labels:
-                            labels = obj["labels"]
-                            if labels:
-                                lang_label = labels.get(lang, None)
-                                if lang_label:
+                                id_to_descr[unique_id] = lang_descr["value"]
+
+                if parse_aliases:
+                    aliases = obj["aliases"]
+
+                    if aliases:
+                        if isinstance(lang,list):
+                            alias_list = {}
+                            for l in lang:
+                                lang_aliases = aliases.get(l, None)
+                                if lang_aliases:
+                                    alias_list[l] = []
+                                    for item in lang_aliases:
+                                        alias_list[l].append(item["value"])
+                            id_to_alias[unique_id] = alias_list
+                        else:
+                            lang_aliases = aliases.get(lang, None)
+                            if lang_aliases:
+                                for item in lang_aliases:
                                     if to_print:
                                         print(
-                                            "label (" + lang + "):", lang_label["value"]
+                                            "alias (" + lang + "):", item["value"]
                                         )
-
-                        if parse_descr:
-                            descriptions = obj["descriptions"]
-                            if descriptions:
-                                if isinstance(lang,list):
-                                    des_tmp = {}
-                                    for l in lang:
-                                        lang_descr = descriptions.get(l, None)
-                                        if lang_descr:
-                                            des_tmp[l]=lang_descr["value"]
-                                    id_to_descr[unique_id]=des_tmp
-                                else:
-                                    lang_descr = descriptions.get(lang, None)
-                                    if lang_descr:
-                                        if to_print:
-                                            print(
-                                                "description (" + lang + "):",
-                                                lang_descr["value"],
-                                            )
-                                        id_to_descr[unique_id] = lang_descr["value"]
-
-                        if parse_aliases:
-                            aliases = obj["aliases"]
-
-                            if aliases:
-                                if isinstance(lang,list):
-                                    alias_list = {}
-                                    for l in lang:
-                                        lang_aliases = aliases.get(l, None)
-                                        if lang_aliases:
-                                            alias_list[l] = []
-                                            for item in lang_aliases:
-                                                alias_list[l].append(item["value"])
+                                    alias_list = id_to_alias.get(unique_id, [])
+                                    alias_list.append(item["value"])
                                     id_to_alias[unique_id] = alias_list
-                                else:
-                                    lang_aliases = aliases.get(lang, None)
-                                    if lang_aliases:
-                                        for item in lang_aliases:
-                                            if to_print:
-                                                print(
-                                                    "alias (" + lang + "):", item["value"]
-                                                )
-                                            alias_list = id_to_alias.get(unique_id, [])
-                                            alias_list.append(item["value"])
-                                            id_to_alias[unique_id] = alias_list
-
-                        if to_print:
-                            print()
 
-    # log final number of lines processed
-    logger.info("Finished. Processed {} lines of WikiData JSON dump".format(cnt))
-    return title_to_id, id_to_descr, id_to_alias, id_to_proper
+                if to_print:
+                    print()
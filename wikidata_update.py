@@ -0,0 +1,68 @@
+# coding: utf-8
+"""Script to update the Wikidata entity files written by wikidata_wikidata.py with a file of changed entities,
+instead of parsing the full Wikidata dump again.
+
+The changed entities are given one JSON entity per line, as in the dump, and {"id": "Q42", "deleted": true}
+for a deleted entity, e.g. collected from the recent changes of Wikidata. They go through the same filters as
+the entities of the full dump. The rows of the changed entities are dropped from the files, and their new
+versions are written at the end, either in place or into a new output directory (the next generation).
+
+The entity definitions change, so the Wikipedia steps using them (wikidata_wikipedia.py) have to be run again.
+
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+
+import wikidata_processor as wd
+import wiki_io as io
+from wiki_io import ENTITY_DESCR_PATH, LOG_FORMAT
+from wiki_io import ENTITY_DEFS_PATH, ENTITY_ALIAS_PATH, ENTITY_PROPER_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def main(
+    wd_changes,
+    output_dir,
+    new_output_dir=None,
+    descr_from_wp=False,
+    lang=None,
+    require_sitelinks=False,
+):
+    entity_paths = [
+        os.path.join(output_dir, ENTITY_DEFS_PATH),
+        os.path.join(output_dir, ENTITY_ALIAS_PATH),
+        None if descr_from_wp else os.path.join(output_dir, ENTITY_DESCR_PATH),
+        os.path.join(output_dir, ENTITY_PROPER_PATH),
+    ]
+    if new_output_dir is None:
+        logger.info("Updating the Wikidata entities in place in {}".format(output_dir))
+        new_entity_paths = entity_paths
+    else:
+        logger.info("Updating the Wikidata entities of {} into {}".format(output_dir, new_output_dir))
+        if not os.path.exists(new_output_dir):
+            os.makedirs(new_output_dir)
+        new_entity_paths = [
+            None if path is None else os.path.join(new_output_dir, os.path.basename(path)) for path in entity_paths
+        ]
+
+    logger.info("Parsing the changed Wikidata entities of {}".format(wd_changes))
+    changed_ids, maps = wd.read_wikidata_changes(
+        wd_changes,
+        lang=lang,
+        parse_descr=(not descr_from_wp),
+        require_sitelinks=require_sitelinks,
+    )
+    io.patch_entity_files(entity_paths, new_entity_paths, changed_ids, maps)
+    logger.info("Done!")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    wd_changes = './data/wikidata-changes.json'
+    output_dir = './data/output'
+    new_output_dir = './data/output-next'
+
+    main(wd_changes,output_dir,new_output_dir)
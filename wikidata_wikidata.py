@@ -3,8 +3,10 @@
 with specific parameters. Intermediate files are written to disk.
 
 Running the full pipeline on a standard laptop, may take up to 13 hours of processing.
-Use the -p, -d and -s options to speed up processing using the intermediate files
-from a previous run.
+To reuse the intermediate files of a previous run, run the steps with wikidata_pipeline.py instead:
+it skips the steps whose inputs and parameters didn't change.
+With stream=True, the pass over the Wikidata dump saves checkpoints in the output directory:
+after a crash, run the script again with --resume to continue from the last one.
 
 For the Wikidata dump: get the latest-all.json.bz2 from https://dumps.wikimedia.org/wikidatawiki/entities/
 For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
@@ -18,10 +20,14 @@ import spacy
 import logging
 import os
 
+import plac
+
 import wikipedia_processor as wp, wikidata_processor as wd
 import wiki_io as io
 from wiki_io import TRAINING_DATA_FILE, KB_FILE, ENTITY_DESCR_PATH, KB_MODEL_DIR, LOG_FORMAT
 from wiki_io import ENTITY_FREQ_PATH, PRIOR_PROB_PATH, ENTITY_DEFS_PATH, ENTITY_ALIAS_PATH, ENTITY_PROPER_PATH
+from wiki_io import WIKIDATA_CHECKPOINT_PATH
+from checkpoint import open_checkpoint
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +50,11 @@ def main(
     limit_train=None,
     limit_wd=None,
     lang=None,
+    n_procs=1,
+    compact=False,
+    stream=False,
+    binary=False,
+    resume=False,
 ):
     entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
     entity_alias_path = os.path.join(output_dir,ENTITY_ALIAS_PATH) #"entity_alias.csv"
@@ -78,27 +89,64 @@ def main(
     logger.info("STEP 4: Parsing and writing Wikidata entity definitions to {}".format(entity_defs_path))
     if limit_wd is not None:
         logger.warning("Warning: reading only {} lines of Wikidata dump".format(limit_wd))
-    title_to_id, id_to_descr, id_to_alias, id_to_proper = wd.read_wikidata_entities_json(
-        wd_json,
-        limit_wd,
-        to_print=False,
-        lang=lang,
-        parse_descr=(not descr_from_wp),
-    )
-    io.write_title_to_id(entity_defs_path, title_to_id)
-
-    logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
-    io.write_id_to_alias(entity_alias_path, id_to_alias)
-
-    if not descr_from_wp:
-        logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
-        io.write_id_to_descr(entity_descr_path, id_to_descr)
-    io.write_id_to_proper(entity_proper_path,id_to_proper)
-
-
-
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    if stream:
+        # the entities are written as they are parsed, instead of being kept in memory until the end
+        logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
+        if not descr_from_wp:
+            logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
+        checkpoint = None
+        resume_state = None
+        if limit_wd is None:
+            checkpoint, resume_state = open_checkpoint(os.path.join(output_dir, WIKIDATA_CHECKPOINT_PATH), resume)
+        with io.EntityWriter(
+            entity_defs_path,
+            entity_alias_path,
+            None if descr_from_wp else entity_descr_path,
+            entity_proper_path,
+            binary=binary,
+            positions=resume_state["output_positions"] if resume_state else None,
+        ) as writer:
+            wd.read_wikidata_entities_json(
+                wd_json,
+                limit_wd,
+                to_print=False,
+                lang=lang,
+                parse_descr=(not descr_from_wp),
+                n_procs=n_procs,
+                writer=writer,
+                checkpoint=checkpoint,
+                resume_state=resume_state,
+            )
+        if checkpoint is not None:
+            checkpoint.clear()
+    else:
+        if resume:
+            raise ValueError("Only the streamed pass (stream=True) can be resumed")
+        title_to_id, id_to_descr, id_to_alias, id_to_proper = wd.read_wikidata_entities_json(
+            wd_json,
+            limit_wd,
+            to_print=False,
+            lang=lang,
+            parse_descr=(not descr_from_wp),
+            n_procs=n_procs,
+            compact=compact,
+        )
+        io.write_title_to_id(entity_defs_path, title_to_id, binary)
+
+        logger.info("STEP 4b: Writing Wikidata entity aliases to {}".format(entity_alias_path))
+        io.write_id_to_alias(entity_alias_path, id_to_alias, binary)
+
+        if not descr_from_wp:
+            logger.info("STEP 4c: Writing Wikidata entity descriptions to {}".format(entity_descr_path))
+            io.write_id_to_descr(entity_descr_path, id_to_descr, binary)
+        io.write_id_to_proper(entity_proper_path,id_to_proper, binary)
+
+
+
+@plac.annotations(
+    resume=("Continue from the last checkpoint in the output directory", "flag", "r"),
+)
+def run(resume=False):
     wd_json = './data/wikidata-20210301-all.json.bz2'
     wp_xml = []
     output_dir = './data/output'
@@ -108,4 +156,9 @@ if __name__ == "__main__":
         path = './data/%swiki-20210301-pages-articles-multistream.xml.bz2'%lang
         wp_xml.append(path)
 
-    main(wd_json,wp_xml,output_dir)
+    main(wd_json,wp_xml,output_dir,n_procs=os.cpu_count(),stream=True,resume=resume)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    plac.call(run)
@@ -0,0 +1,84 @@
+# coding: utf-8
+"""Script to process the Wikipedia dumps in a single pass, once the Wikidata entity definitions
+have been written by wikidata_wikidata.py. Intermediate files are written to disk.
+
+Each dump is decompressed only once, and every page is fed to the consumers of
+STEP 2 (prior probabilities, as in wikidata_prior.py), the description counts
+(as in wikidata_prior_for_des.py) and STEP 5 (gold entities, as in wikidata_gold.py).
+
+For the Wikipedia dump: get enwiki-latest-pages-articles-multistream.xml.bz2
+from https://dumps.wikimedia.org/enwiki/latest/
+
+"""
+from __future__ import unicode_literals
+
+import logging
+import os
+
+import wikipedia_processor as wp
+import wiki_io as io
+from wiki_io import LOG_FORMAT, PRIOR_PROB_PATH, ENTITY_DEFS_PATH
+from wiki_segmenter import DEFAULT_SEGMENTER
+
+logger = logging.getLogger(__name__)
+
+
+def main(
+    wp_xml,
+    output_dir,
+    limit_prior=None,
+    limit_train=None,
+    n_procs=1,
+    binary=False,
+    index=False,
+    per_dump=False,
+    segmenter=DEFAULT_SEGMENTER,
+    group_contexts=False,
+    n_shards=1,
+    max_shard_size=None,
+    compression=None,
+):
+    entity_defs_path = os.path.join(output_dir,ENTITY_DEFS_PATH) #"entity_defs.csv"
+    prior_prob_path = os.path.join(output_dir,PRIOR_PROB_PATH) #"prior_prob.csv"
+    prior_prob_path_for_des = os.path.join(output_dir,'prior_prob.pkl')
+
+    logger.info("Processing Wikipedia in a single pass")
+
+    # STEP 0: set up IO
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if limit_prior is not None:
+        logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_prior))
+    if limit_train is not None:
+        logger.warning("Warning: reading only {} lines of Wikipedia dump".format(limit_train))
+    # index=True: the workers share one memory-mapped copy of the titles, cf. wiki_io.read_title_index
+    wp_to_id = io.read_title_to_id(entity_defs_path, index=index)
+
+    # STEP 2 + STEP 5: prior probabilities, description counts and gold entities from WP
+    logger.info("STEP 2: Writing prior probabilities to {}".format(prior_prob_path))
+    logger.info("STEP 2b: Writing description counts to {}".format(prior_prob_path_for_des))
+    logger.info("STEP 5: Parsing and writing Wikipedia gold entities to {}".format(output_dir))
+    consumers = [
+        wp.PriorProbConsumer(prior_prob_path, limit=limit_prior, binary=binary),
+        wp.DescriptionCountConsumer(prior_prob_path_for_des, wp_to_id, limit=limit_prior),
+        wp.TrainingConsumer(
+            output_dir, wp_to_id, limit=limit_train, segmenter=segmenter, group_contexts=group_contexts,
+            n_shards=n_shards, max_shard_size=max_shard_size, compression=compression,
+        ),
+    ]
+    # per_dump: the dumps are read at the same time, one per worker, instead of one after the other
+    wp.scan_wikipedia(wp_xml, consumers, n_procs=n_procs, per_dump=per_dump)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    wp_xml = []
+    output_dir = './data/output'
+    lang_list = ['ja', 'de', 'es', 'ar', 'sr', 'tr', 'fa', 'ta', 'en',
+                 'fr', 'it']
+    for lang in lang_list:
+        path = './data/%swiki-20210301-pages-articles-multistream.xml.bz2'%lang
+        wp_xml.append(path)
+
+    main(wp_xml,output_dir,n_procs=os.cpu_count(),index=True,per_dump=True)
@@ -6,9 +6,16 @@ import bz2
 import logging
 import random
 import json
-from polyglot.text import Text
+import shutil
+import tempfile
+from multiprocessing import Pool
+import dump_reader
 import wiki_io as io
-from wiki_namespaces import WP_META_NAMESPACE, WP_FILE_NAMESPACE, WP_CATEGORY_NAMESPACE
+from alias_counter import AliasCounter, DEFAULT_MAX_PAIRS
+from checkpoint import file_size, truncate_file
+from wiki_namespaces import get_namespace_matcher
+from wiki_segmenter import DEFAULT_SEGMENTER, get_segmenter
+from sharded_output import ShardedWriter, is_sharded
 import os
 
 """
@@ -20,166 +27,526 @@ Process Wikipedia interlinks to generate a training dataset for the EL algorithm
 
 ENTITY_FILE = "gold_entities.csv"
 
-map_alias_to_link = dict()
+# page consumers of scan_wikipedia, inherited by its worker processes
+_worker_consumers = None
 
 logger = logging.getLogger(__name__)
 
-title_regex = re.compile(r"(?<=<title>).*(?=</title>)")
-id_regex = re.compile(r"(?<=<id>)\d*(?=</id>)")
-text_tag_regex = re.compile(r"(?<=<text).*?(?=>)")
-text_regex = re.compile(r"(?<=<text>).*(?=</text)")
 info_regex = re.compile(r"{[^{]*?}")
 html_regex = re.compile(r"&lt;!--[^-]*--&gt;")
 ref_regex = re.compile(r"&lt;ref.*?&gt;")  # non-greedy
 ref_2_regex = re.compile(r"&lt;/ref.*?&gt;")  # non-greedy
+# escaped special characters, &amp;nbsp; before &amp;
+SPECIAL_CHARS = {"&lt;": "<", "&gt;": ">", "&quot;": '"', "&amp;nbsp;": " ", "&amp;": "&"}
+special_char_regex = re.compile("|".join(SPECIAL_CHARS))
 
 # find the links
 link_regex = re.compile(r"\[\[[^\[\]]*\]\]") #[^]所有不在集合范围内的词可以被匹配，*表示前面的一次或者多次匹配
+# the characters of the links, and a [[entity]] or [[entity|mention]] link without nested ones, cf. _remove_links
+link_char_regex = re.compile(r"[\[\]|]")
+simple_link_regex = re.compile(r"\[\[([^\[\]|]*)(?:\|([^\[\]|]*))?\]\]")
 
-# match on interwiki links, e.g. `en:` or `:fr:`
-ns_regex = r":?" + "[a-z][a-z]" + ":" ###?是尽量少的字符串被匹配，0-1次
-# match on Namespace: optionally preceded by a :
-for ns in WP_META_NAMESPACE:
-    ns_regex += "|" + ":?" + ns + ":"
+# the meta pages, interwiki links, categories and files are matched with the namespaces of the dump of each language,
+# cf. wiki_namespaces.get_namespace_matcher
 
-ns_regex = re.compile(ns_regex, re.IGNORECASE)
-
-files = r""
-for f in WP_FILE_NAMESPACE:
-    files += "\[\[" + f + ":[^\[\]]*(\[\[[^\[\]]*\]\])*[^\[\]]*\]\]" + "|"
-files = files[0 : len(files) - 1]
-file_regex = re.compile(files)
+from others import *
 
-cats = r""
-for c in WP_CATEGORY_NAMESPACE:
-    cats += "\[\[" + c + ":[^\[\]]*(\[\[[^\[\]]*\]\])*[^\[\]]*\]\]" + "|"
-cats = cats[0 : len(cats) - 1]
-category_regex = re.compile(cats)
 
-from others import *
+def read_prior_probs(
+    wikipedia_input_list, prior_prob_output, limit=None, n_procs=1, max_pairs=DEFAULT_MAX_PAIRS, binary=False,
+    checkpoint=None, resume_state=None, per_dump=False
+):
+    scan_wikipedia(
+        wikipedia_input_list, [PriorProbConsumer(prior_prob_output, limit, max_pairs, binary)], n_procs,
+        checkpoint, resume_state, per_dump
+    )
 
 
-def read_prior_probs(wikipedia_input_list, prior_prob_output, limit=None):
-
-    cnt = 0
-    read_id = False
-    for wikipedia_input in wikipedia_input_list:
-        print(wikipedia_input)
-        lang = wikipedia_input[7:9]
-        print(lang)
-        with bz2.open(wikipedia_input, mode="rb") as file:
-            line = file.readline()
-            while line and (not limit or cnt < limit):
-                if cnt % 25000000 == 0 and cnt > 0:
-                    logger.info("processed {} lines of Wikipedia XML dump".format(cnt))
-                clean_line = line.strip().decode("utf-8")
-
-                # we attempt at reading the article's ID (but not the revision or contributor ID)
-                if "<revision>" in clean_line or "<contributor>" in clean_line:
-                    read_id = False
-                if "<page>" in clean_line:
-                    read_id = True
-
-                if read_id:
-                    ids = id_regex.search(clean_line)
-                    if ids:
-                        current_article_id = ids[0]
-
-                # only processing prior probabilities from true training (non-dev) articles
-                # if not is_dev(current_article_id):
-                aliases, entities, normalizations = get_wp_links(clean_line)
-                for alias, entity, norm in zip(aliases, entities, normalizations):
-                    _store_alias(
-                        alias, entity, lang, normalize_alias=norm, normalize_entity=True)
-
-                line = file.readline()
-                cnt += 1
-
-            logger.info("processed {} lines of Wikipedia XML dump".format(cnt))
-
-    logger.info("Finished. processed {} lines of Wikipedia XML dump".format(cnt))
-
-    # write all aliases and their entities and count occurrences to file
-    with open(prior_prob_output,'w',encoding="utf8") as outputfile:
-        outputfile.write("alias" + "|" + "count" + "|" + "entity" + "\n")
-        for alias, alias_dict in sorted(map_alias_to_link.items(), key=lambda x: x[0]):
-            ##alias->alias_dict entity:count，一个alias可能对应着多个实体，因此有多个count
-            s_dict = sorted(alias_dict.items(), key=lambda x: x[1], reverse=True)
-            for entity, count in s_dict:
-                outputfile.write(alias + "|" + str(count) + "|" + entity + "\n")
-
-
-def read_prior_probs_for_des(wikipedia_input_list, prior_prob_output, def_input, limit=None):
-
-    cnt = 0
-    read_id = False
-    wp_to_id = io.read_title_to_id(def_input)
+def read_prior_probs_for_des(
+    wikipedia_input_list, prior_prob_output, def_input, limit=None, n_procs=1, index=False, per_dump=False
+):
+    # index=True maps the memory-mapped title index instead of loading a dict, cf. wiki_io.read_title_index
+    wp_to_id = io.read_title_to_id(def_input, index=index)
     # print('wp_to_id', len(wp_to_id)) #15608263
-    # print(list(wp_to_id.keys()))
-    # exit()
+    scan_wikipedia(
+        wikipedia_input_list, [DescriptionCountConsumer(prior_prob_output, wp_to_id, limit)], n_procs,
+        per_dump=per_dump
+    )
+
+
+def scan_wikipedia(wikipedia_input_list, consumers, n_procs=1, checkpoint=None, resume_state=None, per_dump=False):
+    """
+    Read each Wikipedia dump once and feed every page to all consumers, e.g. to compute the prior probabilities,
+    the description counts and the training data with a single decompression of the dumps.
+    With n_procs > 1, the pages are processed by consumers spawned in worker processes (see PageConsumer).
+    With per_dump, each worker reads whole dumps instead of chunks of a dump: the languages are read at the same
+    time, and their partial outputs are merged in dump order. This also works for dumps that can't be split.
+    With a checkpoint.Checkpoint, the state of the consumers is saved between two chunks of a dump,
+    and the scan continues from resume_state, the last saved state, if given.
+    The chunks and the dumps of the workers write their temporary files to a scratch directory of the pass,
+    which is removed at the end, and cleared when resuming: what it holds wasn't merged before the checkpoint.
+    """
+    limit = any(consumer.limit for consumer in consumers)
+    if checkpoint is not None and limit:
+        raise ValueError("Checkpoints are not supported with a limit")
+    if checkpoint is not None and per_dump:
+        raise ValueError("Checkpoints are not supported with per_dump")
+    scratch_dir = _make_scratch_dir(consumers, resume_state)
+    try:
+        _scan_wikipedia(wikipedia_input_list, consumers, n_procs, checkpoint, resume_state, per_dump, scratch_dir)
+    except BaseException:
+        if checkpoint is None:
+            # there is no checkpoint to resume from, the files of the consumers are dropped too
+            for consumer in consumers:
+                consumer.discard()
+        raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _make_scratch_dir(consumers, resume_state):
+    if resume_state is not None and resume_state.get("scratch_dir"):
+        # the partial outputs of the chunks after the checkpoint
+        shutil.rmtree(resume_state["scratch_dir"], ignore_errors=True)
+    tmp_dir = next((consumer.tmp_dir for consumer in consumers if consumer.tmp_dir), None)
+    scratch_dir = tempfile.mkdtemp(prefix="scan_wikipedia_", dir=tmp_dir)
+    for consumer in consumers:
+        consumer.scratch_dir = scratch_dir
+    return scratch_dir
+
+
+def _scan_wikipedia(wikipedia_input_list, consumers, n_procs, checkpoint, resume_state, per_dump, scratch_dir):
+    global _worker_consumers
+    # shared with the (forked) worker processes, instead of being pickled for each of them
+    _worker_consumers = consumers
+    limit = any(consumer.limit for consumer in consumers)
+    # a limit needs the up-to-date counts of the consumers, so it is only supported in a single process
+    parallel = n_procs > 1 and not limit
+    if parallel and per_dump:
+        _scan_dumps_in_parallel(wikipedia_input_list, consumers, n_procs)
+        for consumer in consumers:
+            consumer.finish()
+        return
+    first_dump = 0
+    if resume_state is not None:
+        first_dump = resume_state["n_dumps_done"]
+        logger.info("Skipping {} Wikipedia dumps".format(first_dump))
+
+    for dump_index, wikipedia_input in enumerate(wikipedia_input_list):
+        if dump_index < first_dump:
+            continue
+        lang = _get_lang(wikipedia_input)
+        logger.info("Reading {} ({})".format(wikipedia_input, lang))
+        n_done = 0
+        if resume_state is not None and dump_index == first_dump:
+            n_done = resume_state["n_ranges_done"]
+            for consumer, consumer_state in zip(consumers, resume_state["consumers"]):
+                consumer.resume(consumer_state, lang)
+        else:
+            for consumer in consumers:
+                consumer.begin_dump(lang)
+
+        if checkpoint is not None:
+            # the chunks are also the unit of the checkpoints, even in a single process
+            ranges = dump_reader.get_page_stream_ranges(wikipedia_input)
+            if n_done:
+                if resume_state["n_ranges"] != len(ranges):
+                    raise ValueError("The checkpoint was saved for {} chunks of {}, not {}".format(
+                        resume_state["n_ranges"], wikipedia_input, len(ranges)
+                    ))
+                logger.info("Skipping {} chunks of {}".format(n_done, wikipedia_input))
+            results = dump_reader.map_page_ranges(
+                wikipedia_input, _consume_pages, args=(lang,), n_procs=n_procs, ranges=ranges[n_done:]
+            )
+            try:
+                for partials in results:
+                    for consumer, partial in zip(consumers, partials):
+                        consumer.merge(partial)
+                    n_done += 1
+                    if checkpoint.due():
+                        checkpoint.save({
+                            "n_dumps_done": dump_index,
+                            "n_ranges": len(ranges),
+                            "n_ranges_done": n_done,
+                            "consumers": [consumer.checkpoint() for consumer in consumers],
+                            "scratch_dir": scratch_dir,
+                        })
+            finally:
+                # on an error, the workers are stopped before the scratch directory is removed
+                results.close()
+        elif parallel:
+            results = dump_reader.map_page_ranges(wikipedia_input, _consume_pages, args=(lang,), n_procs=n_procs)
+            try:
+                for partials in results:
+                    for consumer, partial in zip(consumers, partials):
+                        consumer.merge(partial)
+            finally:
+                results.close()
+        else:
+            with bz2.open(wikipedia_input, mode="rb") as file:
+                for page in dump_reader.pages_from(file):
+                    active_consumers = [consumer for consumer in consumers if not consumer.done()]
+                    if not active_consumers:
+                        break
+                    for consumer in active_consumers:
+                        consumer.process_page(page, lang)
+
+        for consumer in consumers:
+            consumer.end_dump(lang)
+
+    for consumer in consumers:
+        consumer.finish()
+
+
+def _consume_pages(pages, lang):
+    # worker side of scan_wikipedia, on the pages of one chunk of the dump
+    consumers = [consumer.spawn() for consumer in _worker_consumers]
+    for page in pages:
+        for consumer in consumers:
+            consumer.process_page(page, lang)
+    return [consumer.partial() for consumer in consumers]
+
+
+def _scan_dumps_in_parallel(wikipedia_input_list, consumers, n_procs):
+    # the biggest dumps start first, so that the small ones fill the other workers meanwhile
+    tasks = sorted(enumerate(wikipedia_input_list), key=lambda task: os.path.getsize(task[1]), reverse=True)
+    results = dict()
+    n_merged = 0
+    logger.info("Reading {} Wikipedia dumps with {} processes".format(len(tasks), n_procs))
+    with Pool(max(1, min(n_procs, len(tasks)))) as pool:
+        for dump_index, lang, partials in pool.imap_unordered(_consume_dump, tasks):
+            results[dump_index] = lang, partials
+            # merging in dump order gives the same outputs as reading the dumps one after the other
+            while n_merged in results:
+                lang, partials = results.pop(n_merged)
+                for consumer, partial in zip(consumers, partials):
+                    consumer.merge_dump(partial, lang)
+                n_merged += 1
+
+
+def _consume_dump(task):
+    # worker side of scan_wikipedia with per_dump, on a whole dump
+    dump_index, wikipedia_input = task
+    lang = _get_lang(wikipedia_input)
+    logger.info("Reading {} ({})".format(wikipedia_input, lang))
+    consumers = [consumer.spawn_dump(lang) for consumer in _worker_consumers]
+    for consumer in consumers:
+        consumer.begin_dump(lang)
+    with bz2.open(wikipedia_input, mode="rb") as file:
+        for page in dump_reader.pages_from(file):
+            for consumer in consumers:
+                consumer.process_page(page, lang)
+    for consumer in consumers:
+        consumer.end_dump(lang)
+    return dump_index, lang, [consumer.dump_partial() for consumer in consumers]
+
+
+def _get_lang(wikipedia_input):
+    """
+    Language of a dump, from its <siteinfo> header rather than from its path.
+    The namespaces of the header are also set up for the language, cf. wiki_namespaces.get_namespace_matcher.
+    """
+    siteinfo = dump_reader.read_siteinfo(wikipedia_input)
+    lang = siteinfo.lang
+    if lang is None:
+        # e.g. the shards of a dump after the first one, named like the dump (enwiki-...)
+        m = re.match(r"([a-z_]+?)wiki", os.path.basename(wikipedia_input))
+        lang = m.group(1) if m else os.path.basename(wikipedia_input)[0:2]
+        logger.warning("No <siteinfo> in {}, taking {} from its name as its language".format(wikipedia_input, lang))
+    # before the worker processes are forked, which inherit it
+    get_namespace_matcher(lang, siteinfo.namespaces)
+    return lang
+
+
+class PageConsumer(object):
+    """
+    Consumer of the pages of the Wikipedia dumps, cf. scan_wikipedia.
+
+    In a worker process, the pages are fed to a fresh consumer obtained with spawn(),
+    whose partial() results are merged back into the original consumer with merge().
+    With per_dump, a worker reads a whole dump with a consumer obtained with spawn_dump(), which writes
+    its partial outputs to disk, and its dump_partial() is merged back with merge_dump().
+    """
+
+    # once all consumers are done with their limit, the rest of the dump is skipped
+    limit = None
+    # directory next to the outputs, in which scan_wikipedia creates its scratch directory
+    tmp_dir = None
+    # scratch directory of the temporary files of the spawned consumers, set by scan_wikipedia
+    scratch_dir = None
+
+    def begin_dump(self, lang):
+        pass
+
+    def process_page(self, page, lang):
+        """ Process one (id, title, ns, text) page of the dump of language lang """
+        raise NotImplementedError
+
+    def done(self):
+        return False
+
+    def spawn(self):
+        raise NotImplementedError
+
+    def partial(self):
+        raise NotImplementedError
 
-    record = {}
-    lang_num={}
-    for wikipedia_input in wikipedia_input_list:
-        print(wikipedia_input)
-        lang = wikipedia_input[7:9]
-        print(lang)
-        lang_num[lang]=0
-        with bz2.open(wikipedia_input, mode="rb") as file:
-            line = file.readline()
-            while line and (not limit or cnt < limit):
-                if cnt % 25000000 == 0 and cnt > 0:
-                    logger.info("processed {} lines of Wikipedia XML dump".format(cnt))
-                clean_line = line.strip().decode("utf-8")
-
-                # we attempt at reading the article's ID (but not the revision or contributor ID)
-                if "<revision>" in clean_line or "<contributor>" in clean_line:
-                    read_id = False
-                if "<page>" in clean_line:
-                    read_id = True
-
-                if read_id:
-                    ids = id_regex.search(clean_line)
-                    if ids:
-                        current_article_id = ids[0]
-
-                # only processing prior probabilities from true training (non-dev) articles
-                # if not is_dev(current_article_id):
-                aliases, entities, normalizations = get_wp_links(clean_line)
-                for alias, entity, norm in zip(aliases, entities, normalizations):
-                    alias = alias.strip()
-                    entity = entity.strip()
-                    entity = _capitalize_first(entity.split("#")[0])
-                    if norm:
-                        alias = alias.split("#")[0]
-
-                    if alias and entity:
-                        if lang+'_'+entity in wp_to_id:
-                            id = wp_to_id[lang+'_'+entity]
-                        else:
-                            continue
-
-                        if id not in record:
-                            record[id]={}
-                        if lang not in record[id]:
-                            record[id][lang]=0
-
-                        record[id][lang]+=1
-                        lang_num[lang]+=1
-
-                line = file.readline()
-                cnt += 1
-
-            logger.info("processed {} lines of Wikipedia XML dump".format(cnt))
-
-    logger.info("Finished. processed {} lines of Wikipedia XML dump".format(cnt))
-
-    # write all aliases and their entities and count occurrences to file
-    with open(prior_prob_output,'wb') as outputfile:
-        pickle.dump((record,lang_num),outputfile)
-
-
-def _store_alias(alias, entity, lang, normalize_alias=False, normalize_entity=True):
+    def merge(self, partial):
+        raise NotImplementedError
+
+    def spawn_dump(self, lang):
+        raise NotImplementedError
+
+    def dump_partial(self):
+        """ Picklable result of a spawn_dump() consumer, pointing to its partial outputs on disk """
+        raise NotImplementedError
+
+    def merge_dump(self, partial, lang):
+        """ Merge the dump_partial() of a dump, in place of begin_dump, merge and end_dump """
+        raise NotImplementedError
+
+    def checkpoint(self):
+        """ Flush the aggregates to disk, and return the JSON state with which resume() can continue from here """
+        raise NotImplementedError
+
+    def resume(self, state, lang):
+        """ Restore a checkpoint() state, in place of begin_dump for the dump that was being read """
+        raise NotImplementedError
+
+    def end_dump(self, lang):
+        pass
+
+    def finish(self):
+        pass
+
+    def discard(self):
+        """ Remove the temporary files of the consumer after an error, in place of finish """
+        pass
+
+
+class PriorProbConsumer(PageConsumer):
+    """
+    Count the aliases of the links to each entity, and write them to prior_prob_output.
+    Beyond max_pairs (alias, entity) pairs in memory, the counts are spilled to disk next to prior_prob_output
+    (in the scratch directory of scan_wikipedia, in the worker processes).
+    """
+
+    def __init__(self, prior_prob_output, limit=None, max_pairs=DEFAULT_MAX_PAIRS, binary=False):
+        self.prior_prob_output = prior_prob_output
+        self.limit = limit
+        self.binary = binary
+        self.tmp_dir = os.path.dirname(os.path.abspath(prior_prob_output)) if prior_prob_output else None
+        self.alias_counter = AliasCounter(max_pairs, self.tmp_dir)
+        self.cnt = 0
+
+    def process_page(self, page, lang):
+        # only processing prior probabilities from true training (non-dev) articles
+        # if not is_dev(page[0]):
+        page_cnt = _store_page_aliases(page, lang, self.alias_counter)
+        if (self.cnt + page_cnt) // 25000000 > self.cnt // 25000000:
+            logger.info("processed {} lines of Wikipedia XML dump".format(self.cnt + page_cnt))
+        self.cnt += page_cnt
+
+    def done(self):
+        return bool(self.limit) and self.cnt >= self.limit
+
+    def spawn(self):
+        # the counts of one chunk are spilled beyond max_pairs too, merge takes over the runs
+        consumer = PriorProbConsumer(None, max_pairs=self.alias_counter.max_pairs)
+        consumer.alias_counter.tmp_dir = self.scratch_dir
+        return consumer
+
+    def partial(self):
+        # the counts of a chunk that didn't spill are sent back as they are
+        if self.alias_counter.run_paths:
+            return None, self.alias_counter.checkpoint(), self.cnt
+        return self.alias_counter.alias_to_link, None, self.cnt
+
+    def merge(self, partial):
+        chunk_alias_to_link, chunk_runs, chunk_cnt = partial
+        # merging the chunks in dump order keeps the order in which the entities of an alias were first seen
+        if chunk_runs is not None:
+            self.alias_counter.add_runs(chunk_runs)
+        else:
+            self.alias_counter.update(chunk_alias_to_link)
+        self.cnt += chunk_cnt
+
+    def spawn_dump(self, lang):
+        # the counts of a dump are spilled to the runs of its own counter, which merge_dump takes over
+        consumer = PriorProbConsumer(None, max_pairs=self.alias_counter.max_pairs)
+        consumer.alias_counter.tmp_dir = self.scratch_dir
+        return consumer
+
+    def dump_partial(self):
+        return self.alias_counter.checkpoint(), self.cnt
+
+    def merge_dump(self, partial, lang):
+        runs, dump_cnt = partial
+        self.alias_counter.add_runs(runs)
+        self.cnt += dump_cnt
+        self.end_dump(lang)
+
+    def checkpoint(self):
+        return {"cnt": self.cnt, "alias_counter": self.alias_counter.checkpoint()}
+
+    def resume(self, state, lang):
+        self.cnt = state["cnt"]
+        self.alias_counter.restore(state["alias_counter"])
+
+    def end_dump(self, lang):
+        logger.info("processed {} lines of Wikipedia XML dump".format(self.cnt))
+
+    def finish(self):
+        logger.info("Finished. processed {} lines of Wikipedia XML dump".format(self.cnt))
+
+        # write all aliases and their entities and count occurrences to file
+        try:
+            io.write_prior_probs(self.prior_prob_output, self.alias_counter.items_sorted(), self.binary)
+        finally:
+            self.alias_counter.close()
+
+    def discard(self):
+        self.alias_counter.close()
+
+
+class DescriptionCountConsumer(PageConsumer):
+    """ Count the links to each WD id per language, and pickle them to prior_prob_output """
+
+    def __init__(self, prior_prob_output, wp_to_id, limit=None):
+        self.prior_prob_output = prior_prob_output
+        self.wp_to_id = wp_to_id
+        self.limit = limit
+        self.tmp_dir = os.path.dirname(os.path.abspath(prior_prob_output)) if prior_prob_output else None
+        self.record = {}
+        self.lang_num = {}
+        self.cnt = 0
+
+    def begin_dump(self, lang):
+        self.lang_num[lang] = 0
+
+    def process_page(self, page, lang):
+        page_num, page_cnt = _store_page_descriptions(page, lang, self.wp_to_id, self.record)
+        self.lang_num[lang] = self.lang_num.get(lang, 0) + page_num
+        if (self.cnt + page_cnt) // 25000000 > self.cnt // 25000000:
+            logger.info("processed {} lines of Wikipedia XML dump".format(self.cnt + page_cnt))
+        self.cnt += page_cnt
+
+    def done(self):
+        return bool(self.limit) and self.cnt >= self.limit
+
+    def spawn(self):
+        return DescriptionCountConsumer(None, self.wp_to_id)
+
+    def partial(self):
+        return self.record, self.lang_num, self.cnt
+
+    def merge(self, partial):
+        chunk_record, chunk_lang_num, chunk_cnt = partial
+        for id, lang_counts in chunk_record.items():
+            if id not in self.record:
+                self.record[id] = {}
+            for lang, count in lang_counts.items():
+                self.record[id][lang] = self.record[id].get(lang, 0) + count
+        for lang, num in chunk_lang_num.items():
+            self.lang_num[lang] = self.lang_num.get(lang, 0) + num
+        self.cnt += chunk_cnt
+
+    def spawn_dump(self, lang):
+        consumer = DescriptionCountConsumer(None, self.wp_to_id)
+        consumer.scratch_dir = self.scratch_dir
+        return consumer
+
+    def dump_partial(self):
+        # the counts of a whole dump, in the scratch directory
+        with tempfile.NamedTemporaryFile(dir=self.scratch_dir, suffix=".partial", delete=False) as outputfile:
+            pickle.dump(self.partial(), outputfile)
+        return outputfile.name
+
+    def merge_dump(self, partial, lang):
+        with open(partial, "rb") as inputfile:
+            self.merge(pickle.load(inputfile))
+        os.remove(partial)
+        self.end_dump(lang)
+
+    def checkpoint(self):
+        # the counts so far, next to the output
+        partial_path = self.prior_prob_output + ".partial"
+        with open(partial_path + ".tmp", "wb") as outputfile:
+            pickle.dump((self.record, self.lang_num), outputfile)
+        os.replace(partial_path + ".tmp", partial_path)
+        return {"cnt": self.cnt, "partial_path": partial_path}
+
+    def resume(self, state, lang):
+        with open(state["partial_path"], "rb") as inputfile:
+            self.record, self.lang_num = pickle.load(inputfile)
+        self.cnt = state["cnt"]
+
+    def end_dump(self, lang):
+        logger.info("processed {} lines of Wikipedia XML dump".format(self.cnt))
+
+    def finish(self):
+        logger.info("Finished. processed {} lines of Wikipedia XML dump".format(self.cnt))
+
+        # write all WD ids and their counts per language to file
+        with open(self.prior_prob_output,'wb') as outputfile:
+            pickle.dump((self.record,self.lang_num),outputfile)
+        if os.path.exists(self.prior_prob_output + ".partial"):
+            os.remove(self.prior_prob_output + ".partial")
+
+
+def _store_description_link(alias, entity, norm, lang, wp_to_id, record):
+    alias = alias.strip()
+    entity = entity.strip()
+    entity = _capitalize_first(entity.split("#")[0])
+    if norm:
+        alias = alias.split("#")[0]
+
+    if alias and entity:
+        if lang+'_'+entity in wp_to_id:
+            id = wp_to_id[lang+'_'+entity]
+        else:
+            return False
+
+        if id not in record:
+            record[id]={}
+        if lang not in record[id]:
+            record[id][lang]=0
+
+        record[id][lang]+=1
+        return True
+    return False
+
+
+def _store_page_descriptions(page, lang, wp_to_id, record):
+    # the links of one page, returns the number of links found in wp_to_id and the number of lines
+    article_id, article_title, ns, text = page
+    num = 0
+    namespaces = get_namespace_matcher(lang)
+    lines = text.split("\n")
+    for line in lines:
+        if "[[" not in line:
+            continue
+        for alias, entity, norm in iter_wp_links(line.strip(), namespaces):
+            if _store_description_link(alias, entity, norm, lang, wp_to_id, record):
+                num += 1
+    return num, len(lines)
+
+
+def _store_page_aliases(page, lang, alias_counter):
+    # the links of one page, returns the number of lines
+    article_id, article_title, ns, text = page
+    namespaces = get_namespace_matcher(lang)
+    lines = text.split("\n")
+    for line in lines:
+        if "[[" not in line:
+            continue
+        for alias, entity, norm in iter_wp_links(line.strip(), namespaces):
+            _store_alias(
+                alias, entity, lang, normalize_alias=norm, normalize_entity=True, alias_counter=alias_counter)
+    return len(lines)
+
+
+def _store_alias(alias, entity, lang, alias_counter, normalize_alias=False, normalize_entity=True):
     alias = alias.strip()
     entity = entity.strip()
 
@@ -192,47 +559,46 @@ def _store_alias(alias, entity, lang, normalize_alias=False, normalize_entity=Tr
 
     if alias and entity:
         entity = lang+'_'+entity
-        alias_dict = map_alias_to_link.get(alias, dict())
-        entity_count = alias_dict.get(entity, 0)
-        alias_dict[entity] = entity_count + 1
-        map_alias_to_link[alias] = alias_dict  ##alias->alias_dict entity:count，一个alias可能对应着多个实体，因此有多个count
+        alias_counter.add(alias, entity)  ##alias->entity:count，一个alias可能对应着多个实体，因此有多个count
 
 
-def get_wp_links(text):
-    aliases = []
-    entities = []
-    normalizations = []
-
-    matches = link_regex.findall(text) ##[[]]框起来的是链接
-
-    for match in matches:
-        match = match[2:][:-2].replace("_", " ").strip()
-
-        if ns_regex.match(match):
-            pass  # ignore the entity if it points to a "meta" page or category page
-
+def iter_wp_links(text, namespaces=None):
+    """
+    Yield the (alias, entity, normalize) of the [[entity]] and [[entity|alias]] links of a line.
+    normalize is True for a simple [[link]], whose alias still has to be cut at the #.
+    The links to meta pages and other languages are skipped, with namespaces the NamespaceMatcher of the language.
+    """
+    if "[[" not in text:
+        return
+    if namespaces is None:
+        namespaces = get_namespace_matcher(None)
+    is_meta = namespaces.is_meta
+    for match in link_regex.findall(text):
+        entity, pipe, alias = match[2:-2].partition("|")
+        entity = entity.replace("_", " ").strip()
+        if ":" in entity and is_meta(entity):
+            continue  # ignore the entity if it points to a "meta" page or category page
         # this is a simple [[link]], with the alias the same as the mention
-        elif "|" not in match:
-            aliases.append(match)
-            entities.append(match)
-            normalizations.append(True)
+        if not pipe:
+            yield entity, entity, True
+            continue
+        # in wiki format, the link is written as [[entity|alias]], possibly followed by more |
+        alias = alias.partition("|")[0].replace("_", " ").strip()
+        # specific wiki format  [[alias (specification)|]]
+        if len(alias) == 0 and "(" in entity:
+            alias = entity.split("(")[0]
+        yield alias, entity, False
 
-        # in wiki format, the link is written as [[entity|alias]]
-        else:
-            splits = match.split("|")
-            entity = splits[0].strip()
-            alias = splits[1].strip()
-            # specific wiki format  [[alias (specification)|]]
-            if len(alias) == 0 and "(" in entity:
-                alias = entity.split("(")[0]
-                aliases.append(alias)
-                entities.append(entity)
-                normalizations.append(False)
-            else:
-                aliases.append(alias)
-                entities.append(entity)
-                normalizations.append(False)
 
+def get_wp_links(text, namespaces=None):
+    # the links of iter_wp_links, as parallel lists
+    aliases = []
+    entities = []
+    normalizations = []
+    for alias, entity, norm in iter_wp_links(text, namespaces):
+        aliases.append(alias)
+        entities.append(entity)
+        normalizations.append(norm)
     return aliases, entities, normalizations
 
 
@@ -246,135 +612,176 @@ def _capitalize_first(text):
 
 
 def create_training(
-    wp_input, def_input, output_dir, limit=None
+    wp_input, def_input, output_dir, limit=None, n_procs=1, index=False, checkpoint=None, resume_state=None,
+    per_dump=False, segmenter=DEFAULT_SEGMENTER, group_contexts=False, n_shards=1, max_shard_size=None,
+    compression=None
 ):
-    wp_to_id = io.read_title_to_id(def_input)
-    _process_wikipedia_texts(wp_input, wp_to_id, output_dir, limit)
+    wp_to_id = io.read_title_to_id(def_input, index=index)
+    consumer = TrainingConsumer(
+        output_dir, wp_to_id, limit, segmenter, group_contexts, n_shards, max_shard_size, compression
+    )
+    _process_wikipedia_texts(wp_input, consumer, n_procs, checkpoint, resume_state, per_dump)
 
 
 def _process_wikipedia_texts(
-    wikipedia_input_list, wp_to_id, output_dir, limit=None):
+    wikipedia_input_list, consumer, n_procs=1, checkpoint=None, resume_state=None, per_dump=False):
     """
     Read the XML wikipedia data to parse out training data:
     raw text data + positive instances
     """
+    scan_wikipedia(wikipedia_input_list, [consumer], n_procs, checkpoint, resume_state, per_dump)
 
-    # read_ids = set()
-
-    for wikipedia_input in wikipedia_input_list:
-        lang = wikipedia_input.split('/')[-1][0:2]
-        training_output = os.path.join(output_dir,'gold_entities_%s.jsonl'%lang)
-        print(training_output)
-        with bz2.open(wikipedia_input, mode="rb") as file, \
-                open(training_output,'w',encoding="utf8") as entity_file:
-            article_count = 0
-            article_text = ""
-            article_title = None
-            article_id = None
-            reading_text = False
-            reading_revision = False
-            num=0
-            for line in file:
-                clean_line = line.strip().decode("utf-8")
-
-                if clean_line == "<revision>":
-                    reading_revision = True
-                elif clean_line == "</revision>":
-                    reading_revision = False
-
-                # Start reading new page
-                if clean_line == "<page>":
-                    article_text = ""
-                    article_title = None
-                    article_id = None
-                # finished reading this page
-                elif clean_line == "</page>":
-                    if article_id:
-                        clean_text, entities = _process_wp_text(
-                            article_title, article_text, wp_to_id, lang
-                        )
-                        if clean_text is not None and entities is not None:
-                            _write_training_entities(
-                                entity_file, article_id, article_title, clean_text, entities
-                            )
-                            num+=1
-                            # if num==10:
-                            #     break
-                            article_count += 1
-                            if article_count % 10000 == 0 and article_count > 0:
-                                logger.info(
-                                    "Processed {} articles".format(article_count)
-                                )
-                            if limit and article_count >= limit:
-                                break
-                    article_text = ""
-                    article_title = None
-                    article_id = None
-                    reading_text = False
-                    reading_revision = False
-
-                # start reading text within a page
-                if "<text" in clean_line:
-                    reading_text = True
-
-                if reading_text:
-                    article_text += " " + clean_line
-
-                # stop reading text within a page (we assume a new page doesn't start on the same line)
-                if "</text" in clean_line:
-                    reading_text = False
-
-                # read the ID of this article (outside the revision portion of the document)
-                if not reading_revision:
-                    ids = id_regex.search(clean_line)
-                    if ids:
-                        article_id = ids[0]
-                        # print(article_id)
-                        # if article_id in read_ids:
-                        #     logger.info(
-                        #         "Found duplicate article ID {} {}".format(article_id, clean_line)
-                        #     )  # This should never happen ...
-                        # read_ids.add(article_id)
-
-                # read the title of this article (outside the revision portion of the document)
-                if not reading_revision:
-                    titles = title_regex.search(clean_line)
-                    if titles:
-                        article_title = titles[0].strip()
-
-    logger.info("Finished. Processed {} articles".format(article_count))
-
-
-def _process_wp_text(article_title, article_text, wp_to_id,lang):
-    # ignore meta Wikipedia pages
 
-    if ns_regex.match(article_title):
-        return None, None
+class TrainingConsumer(PageConsumer):
+    """
+    Write the gold entities of the articles to gold_entities_<lang>.jsonl in output_dir,
+    with the sentences of the segmenter backend, cf. wiki_segmenter.get_segmenter.
+    With group_contexts, each context is written once with the list of its mentions.
+    With n_shards, max_shard_size or compression, the file is split in shards listed in
+    gold_entities_<lang>.manifest.json, cf. sharded_output.ShardedWriter.
+    """
 
-    # remove the text tags
-    text_search = text_tag_regex.sub("", article_text)
-    text_search = text_regex.search(text_search)
-    if text_search is None:
+    def __init__(
+        self, output_dir, wp_to_id, limit=None, segmenter=DEFAULT_SEGMENTER, group_contexts=False,
+        n_shards=1, max_shard_size=None, compression=None
+    ):
+        self.output_dir = output_dir
+        self.tmp_dir = output_dir
+        self.wp_to_id = wp_to_id
+        self.limit = limit
+        self.segmenter = segmenter
+        self.group_contexts = group_contexts
+        self.n_shards = n_shards
+        self.max_shard_size = max_shard_size
+        self.compression = compression
+        self.entity_file = None
+        self.article_count = 0
+
+    def _sharded(self):
+        return is_sharded(self.n_shards, self.max_shard_size, self.compression)
+
+    def _open_shards(self, training_output, shards):
+        return ShardedWriter.resume(training_output, shards, self.n_shards, self.max_shard_size, self.compression)
+
+    def begin_dump(self, lang):
+        training_output = os.path.join(self.output_dir,'gold_entities_%s.jsonl'%lang)
+        logger.info("Writing the gold entities of {} to {}".format(lang, training_output))
+        if self._sharded():
+            # the shards of a previous run are removed
+            self.entity_file = self._open_shards(training_output, [])
+        else:
+            self.entity_file = open(training_output,'w',encoding="utf8")
+        self.article_count = 0
+
+    def checkpoint(self):
+        if self._sharded():
+            return {"article_count": self.article_count, "shards": self.entity_file.checkpoint()}
+        return {"article_count": self.article_count, "size": file_size(self.entity_file)}
+
+    def resume(self, state, lang):
+        training_output = os.path.join(self.output_dir,'gold_entities_%s.jsonl'%lang)
+        if self._sharded():
+            self.entity_file = self._open_shards(training_output, state["shards"])
+        else:
+            truncate_file(training_output, state["size"])
+            self.entity_file = open(training_output,'a',encoding="utf8")
+        self.article_count = state["article_count"]
+
+    def process_page(self, page, lang):
+        article_id, article_title, ns, article_text = page
+        segmenter = get_segmenter(lang, self.segmenter)
+        clean_text, entities = _process_wp_text(
+            article_title, article_text, self.wp_to_id, lang, segmenter
+        )
+        if clean_text is not None and entities is not None:
+            _write_training_entities(
+                self.entity_file, article_id, article_title, clean_text, entities, segmenter, self.group_contexts
+            )
+            self.article_count += 1
+            if self.article_count % 10000 == 0 and self.article_count > 0:
+                logger.info(
+                    "Processed {} articles".format(self.article_count)
+                )
+
+    def done(self):
+        return bool(self.limit) and self.article_count >= self.limit
+
+    def spawn(self):
+        # the gold entities of one chunk are written to a temporary file in the scratch directory, cf. merge
+        consumer = TrainingConsumer(None, self.wp_to_id, segmenter=self.segmenter, group_contexts=self.group_contexts)
+        consumer.entity_file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf8", dir=self.scratch_dir, suffix=".partial", delete=False
+        )
+        return consumer
+
+    def partial(self):
+        self.entity_file.close()
+        return self.entity_file.name, self.article_count
+
+    def merge(self, partial):
+        chunk_path, chunk_count = partial
+        with open(chunk_path, "r", encoding="utf8") as chunk_file:
+            # whole lines at a time, so that a line isn't split between two shards
+            for lines in iter(lambda: chunk_file.readlines(1 << 20), []):
+                self.entity_file.write("".join(lines))
+        os.remove(chunk_path)
+        self.article_count += chunk_count
+        logger.info("Processed {} articles".format(self.article_count))
+
+    def spawn_dump(self, lang):
+        # the worker writes the gold entities of its dump to gold_entities_<lang>.jsonl itself
+        return TrainingConsumer(
+            self.output_dir, self.wp_to_id, segmenter=self.segmenter, group_contexts=self.group_contexts,
+            n_shards=self.n_shards, max_shard_size=self.max_shard_size, compression=self.compression,
+        )
+
+    def dump_partial(self):
+        return self.article_count
+
+    def merge_dump(self, partial, lang):
+        self.article_count = partial
+        logger.info("Processed {} articles".format(self.article_count))
+
+    def end_dump(self, lang):
+        self.entity_file.close()
+        self.entity_file = None
+
+    def finish(self):
+        logger.info("Finished. Processed {} articles".format(self.article_count))
+
+
+def _process_wp_text(article_title, article_text, wp_to_id,lang, segmenter=None):
+    # ignore meta Wikipedia pages
+    namespaces = get_namespace_matcher(lang)
+    if namespaces.is_meta(article_title):
         return None, None
-    text = text_search.group(0)
+
+    # the text is processed as a single line
+    text = " ".join(line.strip() for line in article_text.split("\n"))
 
     # stop processing if this is a redirect page
     if text.startswith("#REDIRECT"):
         return None, None
 
     # get the raw text without markup etc, keeping only interwiki links
-    clean_text = clean(_get_clean_wp_text(text))
+    clean_text = clean(_get_clean_wp_text(text, namespaces))
     if len(clean_text)==0:
         return None,None
 
-    clean_text, entities = _remove_links(clean_text, wp_to_id,lang)
+    clean_text, entities = _remove_links(clean_text, wp_to_id,lang, segmenter)
     # print(clean_text) text
     # print(entities)  list, (entity,id,start,end)
     # exit()
     return clean_text, entities
 
 
-def _get_clean_wp_text(article_text):
+def _replace_special_char(match):
+    return SPECIAL_CHARS[match.group(0)]
+
+
+def _get_clean_wp_text(article_text, namespaces=None):
+    if namespaces is None:
+        namespaces = get_namespace_matcher(None)
     clean_text = article_text.strip()
 
     # remove bolding & italic markup
@@ -396,8 +803,7 @@ def _get_clean_wp_text(article_text):
 
 
     clean_text = html_regex.sub("", clean_text)
-    clean_text = category_regex.sub("", clean_text)
-    clean_text = file_regex.sub("", clean_text)
+    clean_text = namespaces.remove_category_and_file_links(clean_text)
     # remove multiple =
     while "==" in clean_text:
         clean_text = clean_text.replace("==", "=")
@@ -412,15 +818,12 @@ def _get_clean_wp_text(article_text):
     clean_text = ref_2_regex.sub("", clean_text)
 
     # remove additional wikiformatting
-    clean_text = re.sub(r"&lt;blockquote&gt;", "", clean_text)
-    clean_text = re.sub(r"&lt;/blockquote&gt;", "", clean_text)
+    clean_text = clean_text.replace("&lt;blockquote&gt;", "")
+    clean_text = clean_text.replace("&lt;/blockquote&gt;", "")
 
-    # change special characters back to normal ones
-    clean_text = clean_text.replace(r"&lt;", "<")
-    clean_text = clean_text.replace(r"&gt;", ">")
-    clean_text = clean_text.replace(r"&quot;", '"')
-    clean_text = clean_text.replace(r"&amp;nbsp;", " ")
-    clean_text = clean_text.replace(r"&amp;", "&")
+    # change special characters back to normal ones, in a single pass
+    if "&" in clean_text:
+        clean_text = special_char_regex.sub(_replace_special_char, clean_text)
 
     # remove multiple spaces
     while "  " in clean_text:
@@ -435,12 +838,7 @@ def clean(text):
     text = dropNested(text, r'{\|', r'\|}')
     text = replaceExternalLinks(text)
     text = magicWordsRE.sub('', text)
-    res = ''
-    cur = 0
-    for m in syntaxhighlight.finditer(text):
-        res += unescape(text[cur:m.start()]) + m.group(1)
-        cur = m.end()
-    text = res + unescape(text[cur:])
+    text = unescapeOutside(text, syntaxhighlight)
 
     text = bold_italic.sub(r'\1', text)
     text = bold.sub(r'\1', text)
@@ -454,24 +852,28 @@ def clean(text):
     for m in comment.finditer(text):
         spans.append((m.start(), m.end()))
 
+    # only the patterns of the tags in the text can match
+    names = tagNames(text)
+
     # Drop self-closing tags
-    for pattern in selfClosing_tag_patterns:
-        for m in pattern.finditer(text):
-            spans.append((m.start(), m.end()))
+    for tag, pattern in selfClosing_tag_regexes.items():
+        if tag in names:
+            for m in pattern.finditer(text):
+                spans.append((m.start(), m.end()))
 
     # Drop ignored tags
-    for left, right in ignored_tag_patterns:
-        for m in left.finditer(text):
-            spans.append((m.start(), m.end()))
-        for m in right.finditer(text):
-            spans.append((m.start(), m.end()))
+    for tag, (left, right) in ignored_tag_regexes.items():
+        if tag in names:
+            for m in left.finditer(text):
+                spans.append((m.start(), m.end()))
+            for m in right.finditer(text):
+                spans.append((m.start(), m.end()))
 
     # Bulk remove all spans
     text = dropSpans(spans, text)
 
     # Drop discarded elements
-    for tag in discardElements:
-        text = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+    text = dropDiscardElements(text)
 
     # ori = text
     text = unescape(text)
@@ -485,11 +887,7 @@ def clean(text):
     #         index+=1
 
     # Expand placeholders
-    for pattern, placeholder in placeholder_tag_patterns:
-        index = 1
-        for match in pattern.finditer(text):
-            text = text.replace(match.group(), '%s_%d' % (placeholder, index))
-            index += 1
+    text = expandPlaceholders(text)
 
     text = text.replace('<<', u'«').replace('>>', u'»')
 
@@ -504,104 +902,118 @@ def clean(text):
     return text
 
 
-def _remove_links(clean_text, wp_to_id,lang):
-    # read the text char by char to get the right offsets for the interwiki links
-    # with open('text.txt','w') as f:
-    #     f.write(clean_text)
-    #     exit()
+def _remove_links(clean_text, wp_to_id,lang, segmenter=None):
+    # strip the interwiki links of the sentences, keeping their mentions and the offsets of these in each sentence.
+    # only [, ] and | change the state: the text between them is copied in slices,
+    # and the simple links outside of any bracket are read at once
     entities = []
     final_texts = []
     open_read = 0
-    reading_text = True
     reading_entity = False
     reading_mention = False
     reading_special_case = False
-    entity_buffer = ""
-    mention_buffer = ""
+    # the state is kept from one sentence to the next, as a link can be split between them
+    entity_buffer = []
+    mention_buffer = []
 
     ###分词
+    if segmenter is None:
+        segmenter = get_segmenter(lang)
     try:
-        sentences = Text(clean_text).sentences
+        sentences = segmenter.sentences(clean_text)
     except:
         return None,None
 
-    for i, sentence in enumerate(sentences):
+    for sentence in sentences:
         entity = []
-        final_text = ""
-        for index, letter in enumerate(sentence):
+        final_text = []
+        length = 0
+        cur = 0
+        while True:
+            m = link_char_regex.search(sentence, cur)
+            if m is None:
+                break
+            index = m.start()
+            if cur < index:
+                if reading_entity:
+                    entity_buffer.append(sentence[cur:index])
+                elif reading_mention:
+                    mention_buffer.append(sentence[cur:index])
+                else:
+                    final_text.append(sentence[cur:index])
+                    length += index - cur
+
+            if open_read == 0 and not reading_entity and not reading_mention:
+                link = simple_link_regex.match(sentence, index)
+                if link:
+                    entity_name = link.group(1)
+                    # Ignore the links to a paragraph, or starting with :
+                    if "#" not in entity_name and not entity_name.startswith(":"):
+                        mention = link.group(2) or entity_name
+                        qid = wp_to_id.get(lang+'_'+entity_name, None)
+                        if qid:
+                            entity.append((mention, qid, length, length + len(mention)))
+                        final_text.append(mention)
+                        length += len(mention)
+                    cur = link.end()
+                    continue
+            cur = index + 1
+
+            letter = sentence[index]
             if letter == "[":
                 open_read += 1
             elif letter == "]":
                 open_read -= 1
-            elif letter == "|":
-                if reading_text:
-                    final_text += letter
+            elif reading_entity:
                 # switch from reading entity to mention in the [[entity|mention]] pattern
-                elif reading_entity:
-                    reading_text = False
-                    reading_entity = False
-                    reading_mention = True
-                else:
-                    reading_special_case = True
+                reading_entity = False
+                reading_mention = True
+            elif reading_mention:
+                reading_special_case = True
             else:
-                if reading_entity:
-                    entity_buffer += letter
-                elif reading_mention:
-                    mention_buffer += letter
-                elif reading_text:
-                    final_text += letter
-                else:
-                    raise ValueError("Not sure at point", clean_text[index - 2 : index + 2])
+                final_text.append(letter)
+                length += 1
 
             if open_read > 2:
                 reading_special_case = True
 
-            if open_read == 2 and reading_text:
-                reading_text = False
+            if open_read == 2 and not reading_entity and not reading_mention:
                 reading_entity = True
-                reading_mention = False
 
             # we just finished reading an entity
-            if open_read == 0 and not reading_text:
-                if "#" in entity_buffer or entity_buffer.startswith(":"):
+            if open_read == 0 and (reading_entity or reading_mention):
+                entity_name = "".join(entity_buffer)
+                if "#" in entity_name or entity_name.startswith(":"):
                     reading_special_case = True
                 # Ignore cases with nested structures like File: handles etc
                 if not reading_special_case:
-                    if not mention_buffer:
-                        mention_buffer = entity_buffer
-                    start = len(final_text)
-                    end = start + len(mention_buffer)
-                    qid = wp_to_id.get(lang+'_'+entity_buffer, None)
+                    mention = "".join(mention_buffer) or entity_name
+                    qid = wp_to_id.get(lang+'_'+entity_name, None)
                     if qid:
-                        entity.append((mention_buffer, qid, start, end))
-                    final_text += mention_buffer
-
-                entity_buffer = ""
-                mention_buffer = ""
+                        entity.append((mention, qid, length, length + len(mention)))
+                    final_text.append(mention)
+                    length += len(mention)
 
-                reading_text = True
+                entity_buffer = []
+                mention_buffer = []
                 reading_entity = False
                 reading_mention = False
                 reading_special_case = False
 
+        if cur < len(sentence):
+            if reading_entity:
+                entity_buffer.append(sentence[cur:])
+            elif reading_mention:
+                mention_buffer.append(sentence[cur:])
+            else:
+                final_text.append(sentence[cur:])
+                length += len(sentence) - cur
+
         ###一个句子读完，final_text有了，entities是这个句子含有的entities
-        tmp_i = i
-        # print(final_text)
-        if len(final_text)==0:
+        if length==0:
             continue
-        # while len(Text(final_text).words) < 64 and tmp_i < len(sentences) - 1:
-        #     tmp_i +=1
-        #     final_text+=sentences[tmp_i].raw
-            # print(Text(final_text).words)
-        # try:
-        #     while len(Text(final_text).words)<64 and tmp_i<len(sentences)-1:
-        #         tmp_i +=1
-        #         final_text+=sentences[tmp_i].raw
-        # except:
-        #     print(final_text)
-        #     exit()
-
-        final_texts.append(final_text)
+
+        final_texts.append("".join(final_text))
         entities.append(entity)
 
     return final_texts, entities
@@ -613,35 +1025,68 @@ def _write_training_description(outputfile, qid, description):
         outputfile.write(line)
 
 
-def _write_training_entities(outputfile, article_id, article_title, clean_text, entities):
+def _iter_training_contexts(clean_text, entities, segmenter=None):
+    # the (context, entity list) of each sentence with entities, its context growing to 64 words with the next ones
+    if segmenter is None:
+        segmenter = get_segmenter(None)
+    # the words of each sentence are only counted once, as the contexts of the next sentences overlap
+    word_counts = [None] * len(clean_text)
 
     for i in range(len(clean_text)):
-        text = clean_text[i]
         entity_list = entities[i]
         if len(entity_list)>0:
             ####text变长
             tmp_i = i
-            while len(Text(text).words)<64 and tmp_i<len(clean_text)-1:
+            if word_counts[i] is None:
+                word_counts[i] = segmenter.count_words(clean_text[i])
+            n_words = word_counts[i]
+            while n_words<64 and tmp_i<len(clean_text)-1:
                 tmp_i+=1
-                text+=clean_text[tmp_i]
-
-            for ent in entity_list:
-                line = (
-                        json.dumps(
-                            {
-                                "article_id": article_id,
-                                'article_title':article_title,
-                                "context": text,
-                                "entity": ent[1],
-                                'mention':ent[0],
-                                'start':ent[2],
-                                'end':ent[3]
-                            },
-                            ensure_ascii=False,
-                        )
-                        + "\n"
-                )
-                outputfile.write(line)
+                if word_counts[tmp_i] is None:
+                    word_counts[tmp_i] = segmenter.count_words(clean_text[tmp_i])
+                n_words += word_counts[tmp_i]
+
+            yield "".join(clean_text[i:tmp_i + 1]), entity_list
+
+
+def _write_training_entities(
+    outputfile, article_id, article_title, clean_text, entities, segmenter=None, group_contexts=False
+):
+    # a line per mention, or with group_contexts a line per context, cf. wiki_io.read_gold_entities
+    for text, entity_list in _iter_training_contexts(clean_text, entities, segmenter):
+        if group_contexts:
+            line = (
+                    json.dumps(
+                        {
+                            "article_id": article_id,
+                            'article_title':article_title,
+                            "context": text,
+                            "mentions": [[ent[1], ent[0], ent[2], ent[3]] for ent in entity_list],
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+            )
+            outputfile.write(line)
+            continue
+
+        for ent in entity_list:
+            line = (
+                    json.dumps(
+                        {
+                            "article_id": article_id,
+                            'article_title':article_title,
+                            "context": text,
+                            "entity": ent[1],
+                            'mention':ent[0],
+                            'start':ent[2],
+                            'end':ent[3]
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+            )
+            outputfile.write(line)
 
 
 def read_training_indices(entity_file_path):